@@ -2,15 +2,237 @@
 """
 Stock Prediction Script - Matches Vendify.ipynb deployment logic
 Takes historical sales data and predicts next day sales per machine
+
+model_path may point at a single model ({'model', 'feature_cols'}) or at a
+per-machine bundle from rpi/train_model.py --per-machine, which is routed by device_id.
+
+Optional input keys:
+  quantiles: [0.5, 0.9]   Per-machine and fleet quantiles from the forest's trees
+  interval: 0.8           Central prediction interval (adds p10/p90 bounds)
+  format: 'records' | 'columnar' | 'ndjson' | 'arrow'   Response format
+  cache: true / cache_dir: '/tmp/predict-cache'   Memoize results on disk (also $PREDICT_CACHE_DIR;
+                                                  "cache": true alone uses CACHE_DIR)
+  cache_ttl: 21600, cache_max_entries: 256         Cache eviction settings
+
+history_path: 'sales_matrix.i32'   Read history from a machine x day sales matrix
+  (rpi/sales_matrix.py) instead of historical_data; also $PREDICT_HISTORY
+
+hourly_profile: 'hourly_profile.npz'   Also split each machine's prediction into
+  24 expected values per sales-day hour (rpi/hourly_profile.py); also $PREDICT_HOURLY_PROFILE
+
+backend: 'pandas' | 'polars'   Engine for the records feature block (also
+  $PREDICT_BACKEND); polars is multi-threaded, pandas is the reference and the fallback
+
+anomalies: true   Instead of predicting, score each machine's last days against
+  the forest's predicted distribution and rank under-performers (see detect_anomalies;
+  only days with a record are scored, so send 0 for a day a machine sold nothing):
+  anomaly_days: 7, anomaly_method: 'zscore' | 'quantile',
+  anomaly_quantile: 0.1, anomaly_threshold: -2.0 (z) or 2 (days below the quantile)
+
+stock: {"852301": 34, ...} or [{device_id, quantity, threshold?}, ...]   Instead of
+  predictions, project hours until each machine's stock runs out (see project_stock),
+  most urgent first: stock_as_of: '2026-02-11T09:00:00' (UTC, default now),
+  projection_days: 3; uses hourly_profile for the within-day shape if given
+
+shadow_models: ['candidate.joblib', ...] or {name: path}   Candidate models (also
+  $PREDICT_SHADOW_MODELS, comma-separated) scored on the production model's feature
+  matrix after the response is written; outputs are appended next to the production
+  ones in shadow_log (default: shadow_predictions.jsonl beside model_path, or $PREDICT_SHADOW_LOG)
+
+Run with --profile (or $PREDICT_PROFILE=1) to write a CPU profile and allocation
+snapshot to $PREDICT_PROFILE_DIR (default: next to this script); the summary goes to stderr.
+
+historical_data may also be columnar ({device_id: [...], date: [...], sold: [...]}),
+or stdin may be NDJSON or an Arrow IPC stream (see read_request). The response
+uses the same layout as the request unless 'format' says otherwise.
 """
+import io
+import os
 import sys
 import json
-import joblib
+import time
+import hashlib
+import tempfile
 import pandas as pd
 import numpy as np
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from pathlib import Path
+
+# Prediction cache defaults (enabled by "cache": true, "cache_dir" or $PREDICT_CACHE_DIR)
+CACHE_MAX_ENTRIES = 256
+CACHE_TTL_SECONDS = 6 * 3600
+# Each request is its own process, so the cache has to live on disk to ever hit
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'predict-cache')
+
+# Pseudo-sales of the broader profile mixed into each hourly profile (as rpi/hourly_profile.py)
+HOURLY_PRIOR_SALES = 20
+
+# --profile artifacts (predict-<timestamp>-<pid>.prof / .alloc.txt), as rpi/run_profile.py
+PROFILE_DIR = os.environ.get('PREDICT_PROFILE_DIR', os.path.dirname(os.path.abspath(__file__)))
+PROFILE_TOP_FUNCTIONS = 10          # Functions in the summary, by own time
+PROFILE_TOP_ALLOCATIONS = 25        # Allocation sites in the .alloc.txt artifact (5 are reported)
+PROFILE_TRACE_FRAMES = 1            # Stack depth kept per allocation
+
+# Shadow model outputs, one JSON line per request (default: next to the production model)
+SHADOW_LOG_NAME = 'shadow_predictions.jsonl'
+
+# Stock projection horizon in days
+PROJECTION_DAYS = 3
+
+# Feature backend for records input: 'pandas' (reference) or 'polars' (used if installed)
+FEATURE_BACKEND = os.environ.get('PREDICT_BACKEND', 'pandas')
+
+# Anomaly scoring defaults
+ANOMALY_DAYS = 7
+ANOMALY_QUANTILE = 0.1
+ANOMALY_THRESHOLDS = {'zscore': -2.0, 'quantile': 2}
+
+# Per-machine features every model consumes (device identity is added separately)
+BASE_FEATURES = [
+    'weekday', 'month', 'day_of_month', 'is_weekend', 'lag_1', 'lag_7',
+    'rolling_avg_3', 'rolling_avg_7', 'rolling_avg_14', 'rolling_std_7',
+]
+
+def pack_forest(model):
+    """
+    Flatten the leaf values of every tree in a fitted forest into one array.
+    Returns (values, offsets) where tree i's node n is values[offsets[i] + n].
+    """
+    estimators = getattr(model, 'estimators_', None)
+    if not isinstance(estimators, list) or not hasattr(estimators[0], 'tree_'):
+        raise ValueError('Quantiles need a random forest model')
+
+    trees = [est.tree_ for est in estimators]
+    offsets = np.cumsum([0] + [t.node_count for t in trees[:-1]])
+    values = np.concatenate([t.value[:, 0, 0] for t in trees])
+    return values, offsets
+
+
+def forest_tree_predictions(model, X):
+    """
+    Per-tree predictions as a (trees x rows) array.
+    model.apply() finds every (row, tree) leaf in one batched call, and a single
+    gather reads their values, instead of a predict() call per estimator.
+    """
+    values, offsets = pack_forest(model)
+    leaves = model.apply(X)
+    return values[leaves + offsets].T
+
+
+def quantile_key(q):
+    """Label for a quantile, e.g. 0.9 -> 'p90'."""
+    return f"p{q * 100:g}"
+
+
+def interval_bounds(interval):
+    """Lower and upper quantile of a central interval, e.g. 0.8 -> (0.1, 0.9)."""
+    tail = (1 - float(interval)) / 2
+    return round(tail, 6), round(1 - tail, 6)
+
 
-def prepare_features_and_predict(df_raw, model_path, predict_date=None):
+def resolve_quantiles(quantiles=None, interval=None):
+    """Merge requested quantiles with the bounds of a central interval."""
+    qs = set(float(q) for q in (quantiles or []))
+    if interval is not None:
+        qs.update(interval_bounds(interval))
+    for q in qs:
+        if not 0 <= q <= 1:
+            raise ValueError(f'Quantile out of range: {q}')
+    return sorted(qs)
+
+
+def build_feature_matrix(model_data, base, device_ids):
+    """
+    Build the model input for all machines at once.
+
+    Device identity is encoded according to model_data['device_encoding']:
+      'index'   - one integer 'device_idx' column (-1 for unknown devices)
+      'sparse'  - base features plus a sparse one-hot block over model_data['devices']
+      (absent)  - legacy models with dense 'device_<id>' dummy columns in feature_cols
+    The first two cost O(features) per machine regardless of fleet size.
+    """
+    encoding = model_data.get('device_encoding')
+    feature_cols = model_data['feature_cols']
+    device_ids = [str(d) for d in device_ids]
+    n = len(device_ids)
+
+    if encoding in ('index', 'sparse'):
+        device_index = {str(d): i for i, d in enumerate(model_data['devices'])}
+        codes = np.array([device_index.get(d, -1) for d in device_ids])
+
+        if encoding == 'index':
+            X = base.reindex(columns=feature_cols).reset_index(drop=True)
+            X['device_idx'] = codes
+            return X[feature_cols].fillna(0)
+
+        from scipy import sparse
+        dense = sparse.csr_matrix(base.reindex(columns=feature_cols).fillna(0).values.astype(np.float64))
+        known = codes >= 0
+        onehot = sparse.csr_matrix(
+            (np.ones(known.sum()), (np.flatnonzero(known), codes[known])),
+            shape=(n, len(device_index))
+        )
+        return sparse.hstack([dense, onehot], format='csr')
+
+    # Compatibility path: dense device_<id> dummies, filled in one vectorized pass
+    col_index = {c: i for i, c in enumerate(feature_cols)}
+    values = np.zeros((n, len(feature_cols)))
+    for col in base.columns:
+        if col in col_index:
+            values[:, col_index[col]] = base[col].values
+    dummy_pos = np.array([col_index.get(f'device_{d}', -1) for d in device_ids])
+    known = dummy_pos >= 0
+    values[np.flatnonzero(known), dummy_pos[known]] = 1
+
+    return pd.DataFrame(values, columns=feature_cols)
+
+
+def load_model_data(model_path):
+    """
+    Unpickle a model file. joblib (and whatever library the model was built
+    with) is only imported here, so cached responses never load either.
+    """
+    import joblib
+    return joblib.load(model_path)
+
+
+def predict_rows(model_data, X, device_ids, per_tree=False):
+    """
+    Predict every row of X in batched calls.
+    Per-machine bundles (train_model.py --per-machine) route each row to its
+    machine's model by device_id, with one predict call per model.
+    Returns (predictions, per-tree matrix or None).
+    """
+    if 'models' not in model_data:
+        model = model_data['model']
+        if per_tree:
+            trees = forest_tree_predictions(model, X)
+            return trees.mean(axis=0), trees
+        return model.predict(X), None
+
+    routes, fallback = model_data['routes'], model_data['fallback']
+    X = X.reset_index(drop=True)
+    keys = np.array([routes.get(str(d), fallback) for d in device_ids])
+
+    preds = np.zeros(len(X))
+    trees = None
+    for key in np.unique(keys):
+        idx = np.flatnonzero(keys == key)
+        model = model_data['models'][key]
+        if per_tree:
+            group_trees = forest_tree_predictions(model, X.iloc[idx])
+            if trees is None:
+                trees = np.zeros((group_trees.shape[0], len(X)))
+            trees[:, idx] = group_trees
+            preds[idx] = group_trees.mean(axis=0)
+        else:
+            preds[idx] = model.predict(X.iloc[idx])
+    return preds, trees
+
+
+def predict_machines(df_raw, model_path, predict_date=None, quantiles=None, interval=None, backend=None,
+                     shadow=None):
     """
     Prepare features from raw sales data and predict next day sales.
 
@@ -18,19 +240,21 @@ def prepare_features_and_predict(df_raw, model_path, predict_date=None):
         df_raw: DataFrame with columns [device_id, date, sold] - daily sales per machine
         model_path: Path to the trained model
         predict_date: Date to predict for (default: day after last date in data)
+        quantiles: Optional quantiles to return, e.g. [0.5, 0.9] (forest models only)
+        interval: Optional central interval coverage, e.g. 0.8 -> p10..p90
+        backend: 'pandas' or 'polars' for the feature block (default: FEATURE_BACKEND)
+        shadow: Optional ShadowModels that keeps the feature matrix for later scoring
 
     Returns:
-        Dictionary with predictions per machine and total
+        (summary dict, DataFrame with one prediction row per machine)
     """
-    # Load model
-    model_data = joblib.load(model_path)
-    model = model_data['model']
-    feature_cols = model_data['feature_cols']
+    # Load model; its feature list decides which features get computed
+    model_data = load_model_data(model_path)
+    plan = plan_features(model_data['feature_cols'])
 
     # Ensure date is datetime
-    df = df_raw.copy()
+    df = df_raw[['device_id', 'date', 'sold']].copy()
     df['date'] = pd.to_datetime(df['date'])
-    df = df.sort_values(['device_id', 'date'])
 
     # Determine prediction date
     last_date = df['date'].max()
@@ -39,38 +263,315 @@ def prepare_features_and_predict(df_raw, model_path, predict_date=None):
     else:
         predict_date = pd.to_datetime(predict_date)
 
-    # Create features per machine
-    MACHINE_COL = 'device_id'
-    target_col = 'sold'
+    # Latest feature row per machine, from its trailing rows only
+    if resolve_backend(backend) == 'polars':
+        last_rows = polars_last_rows(df, plan)
+    else:
+        last_rows = machine_last_rows(df.sort_values(['device_id', 'date']), plan)
+
+    return predict_last_rows(model_data, last_rows, last_date, predict_date, quantiles, interval, shadow)
 
-    df_features = df.copy()
-    df_features['day'] = df_features['date'].dt.day
-    df_features['weekday'] = df_features['date'].dt.weekday
-    df_features['month'] = df_features['date'].dt.month
-    df_features['is_weekend'] = (df_features['weekday'] >= 5).astype(int)
-
-    # Rolling features per machine
-    WINDOWS = [3, 7, 14]
-    for w in WINDOWS:
-        df_features[f'rolling_avg_{w}'] = df_features.groupby(MACHINE_COL)[target_col].transform(
-            lambda x: x.rolling(window=w, min_periods=1).mean()
-        )
-        df_features[f'rolling_std_{w}'] = df_features.groupby(MACHINE_COL)[target_col].transform(
-            lambda x: x.rolling(window=w, min_periods=1).std().fillna(0)
-        )
 
-    # Lag features
-    for lag in [1, 7]:
-        df_features[f'lag_{lag}'] = df_features.groupby(MACHINE_COL)[target_col].shift(lag)
+def model_inputs(model_data, rows):
+    """The columns of rows that the model consumes (device identity is added separately)."""
+    return rows[[c for c in model_data['feature_cols'] if c in rows.columns]]
+
+
+def plan_features(feature_cols):
+    """
+    Rolling windows and lags a model's feature_cols need, e.g.
+    {'avg': [3, 7, 14], 'std': [7], 'lags': [7], 'rows': 14}, where rows is the
+    trailing history per machine that covers all of them. lag_1 is always the
+    last day's sales and date features are set from the prediction date, so
+    neither needs history.
+    """
+    def sizes(prefix):
+        return sorted({int(c[len(prefix):]) for c in feature_cols
+                       if c.startswith(prefix) and c[len(prefix):].isdigit()})
+
+    plan = {'avg': sizes('rolling_avg_'), 'std': sizes('rolling_std_'),
+            'lags': [lag for lag in sizes('lag_') if lag != 1]}
+    plan['rows'] = max(plan['avg'] + plan['std'] + [lag + 1 for lag in plan['lags']] + [1])
+    return plan
+
+
+def machine_last_rows(df, plan):
+    """
+    Latest row per machine with the planned rolling means/stds (over its last
+    w rows, like rolling(min_periods=1)) and lags (0 without enough rows).
+    Only the trailing plan['rows'] rows of each machine are touched.
+    df must be sorted by device_id, date.
+    """
+    tail = df.groupby('device_id', sort=False).tail(plan['rows'])
+    # Position from the end of each machine's rows: 0 is its latest day
+    back = tail.groupby('device_id', sort=False).cumcount(ascending=False).values
+
+    last_rows = tail[back == 0].set_index('device_id')
+    for w in plan['avg']:
+        last_rows[f'rolling_avg_{w}'] = tail[back < w].groupby('device_id')['sold'].mean()
+    for w in plan['std']:
+        last_rows[f'rolling_std_{w}'] = tail[back < w].groupby('device_id')['sold'].std().fillna(0)
+    for lag in plan['lags']:
+        last_rows[f'lag_{lag}'] = tail[back == lag].groupby('device_id')['sold'].first()
+        last_rows[f'lag_{lag}'] = last_rows[f'lag_{lag}'].fillna(0)
+    return last_rows.sort_index().reset_index()
+
+
+def resolve_backend(backend=None):
+    """Feature backend to run: the one asked for, or pandas when Polars is not installed."""
+    backend = backend or FEATURE_BACKEND
+    if backend not in ('pandas', 'polars'):
+        raise ValueError(f'Unknown feature backend: {backend}')
+    if backend == 'polars':
+        try:
+            import polars  # noqa: F401
+        except ImportError:
+            return 'pandas'
+    return backend
+
+
+def polars_last_rows(df, plan):
+    """
+    machine_last_rows on Polars: one multi-threaded group_by over all machines,
+    with every window reduced from the tail of each machine's rows. Sorting by
+    date alone is enough, since group_by keeps the row order within a machine.
+    df need not be sorted.
+    """
+    import polars as pl
+
+    sold = pl.col('sold').cast(pl.Float64)
+    columns = [pl.col('date').last(), pl.col('sold').last()]
+    for w in plan['avg']:
+        columns.append(sold.tail(w).mean().alias(f'rolling_avg_{w}'))
+    for w in plan['std']:
+        columns.append(sold.tail(w).std().fill_null(0).fill_nan(0).alias(f'rolling_std_{w}'))
+    for lag in plan['lags']:
+        # Empty slice (fewer than lag + 1 rows) -> null -> 0
+        columns.append(pl.col('sold').reverse().slice(lag, 1).first().fill_null(0).alias(f'lag_{lag}'))
+
+    frame = pl.from_pandas(df).sort('date', maintain_order=True)
+    return frame.group_by('device_id').agg(columns).sort('device_id').to_pandas()
+
+
+def load_sales_history(path):
+    """
+    Open a machine x day sales matrix (rpi/sales_matrix.py) read-only.
+    Returns (sold, devices, start_date, first_day); sold is a (days x machines)
+    int32 memmap, so only the rows that are sliced get read from disk.
+    """
+    path = Path(path)
+    meta = json.loads(path.with_suffix('.json').read_text())
+    shape = (meta['capacity'], len(meta['devices']))
+    sold = np.memmap(path, dtype=np.int32, mode='r', shape=shape)[:meta['days']]
+    return sold, meta['devices'], pd.Timestamp(meta['start_date']), np.array(meta['first_day'])
+
+
+def history_last_rows(sold, devices, start_date, first_day, end=None, plan=None):
+    """
+    Latest feature row per machine from the sales matrix: every window is a
+    trailing slice of rows, reduced for all machines at once. Days before a
+    machine's first_day are left out (like rolling(min_periods=1) on its rows);
+    calendar days without sales count as 0. plan (see plan_features) limits
+    the windows and lags computed; the default covers BASE_FEATURES.
+    """
+    plan = plan or plan_features(BASE_FEATURES)
+    end = len(sold) - 1 if end is None else end
+    started = first_day <= end
+    first_day = first_day[started]
+    devices = np.array(devices, dtype=object)[started]
+
+    # Only the trailing rows any window or lag reaches are read, then the
+    # machines are masked; `block` row i is matrix row base + i
+    base = max(0, end - plan['rows'] + 1)
+    block = np.asarray(sold[base:end + 1])[:, started]
+
+    last_rows = pd.DataFrame({
+        'device_id': devices,
+        'date': start_date + timedelta(days=int(end)),
+        'sold': block[end - base].astype(int),
+    })
+
+    for w in sorted(set(plan['avg']) | set(plan['std'])):
+        lo = max(0, end - w + 1)
+        window = block[lo - base:].astype(np.float64)
+        valid = np.arange(lo, end + 1)[:, None] >= first_day[None, :]
+        n = valid.sum(axis=0)
+        mean = (window * valid).sum(axis=0) / n
+        if w in plan['avg']:
+            last_rows[f'rolling_avg_{w}'] = mean
+        if w in plan['std']:
+            sq = (((window - mean) ** 2) * valid).sum(axis=0)
+            last_rows[f'rolling_std_{w}'] = np.where(n > 1, np.sqrt(sq / np.maximum(n - 1, 1)), 0.0)
+
+    for lag in plan['lags']:
+        row = end - lag
+        last_rows[f'lag_{lag}'] = np.where(row >= first_day, block[max(row, 0) - base], 0) if row >= 0 else 0
+    return last_rows
+
+
+def predict_from_history(history_path, model_path, predict_date=None, quantiles=None, interval=None, shadow=None):
+    """predict_machines() with history read from a sales matrix instead of records."""
+    model_data = load_model_data(model_path)
+    sold, devices, start_date, first_day = load_sales_history(history_path)
+    if len(sold) == 0:
+        raise ValueError(f"Sales history {history_path} is empty")
+
+    last_rows = history_last_rows(sold, devices, start_date, first_day,
+                                  plan=plan_features(model_data['feature_cols']))
+    last_date = last_rows['date'].iloc[0]
+    predict_date = last_date + timedelta(days=1) if predict_date is None else pd.to_datetime(predict_date)
+    return predict_last_rows(model_data, last_rows, last_date, predict_date, quantiles, interval, shadow)
+
+
+def history_scored_days(history_path, plan, days):
+    """
+    (day, feature rows, actual) for each of a sales matrix's last `days` days,
+    over the machines whose first_day is before it.
+    """
+    sold, devices, start_date, first_day = load_sales_history(history_path)
+    last = len(sold) - 1
+    if last < 1:
+        raise ValueError('Anomaly scoring needs at least two days of history')
+    for end in range(last - min(days, last), last):
+        rows = history_last_rows(sold, devices, start_date, first_day, end, plan)
+        yield start_date + timedelta(days=end + 1), rows, np.asarray(sold[end + 1, first_day <= end])
+
+
+def records_scored_days(df, plan, days):
+    """
+    (day, feature rows, actual) for each of the records' last `days` days, over
+    the machines with a record that day. Features come from machine_last_rows on
+    each machine's records before the day, as predict_machines builds them, so
+    a machine with gaps is scored on the rows it reported, not calendar days.
+    """
+    df = pd.DataFrame({
+        'device_id': df['device_id'].astype(str),
+        'date': pd.to_datetime(df['date']),
+        'sold': pd.to_numeric(df['sold']),
+    }).groupby(['device_id', 'date'], as_index=False)['sold'].sum()
+
+    first, last = df['date'].min(), df['date'].max()
+    span = (last - first).days
+    if span < 1:
+        raise ValueError('Anomaly scoring needs at least two days of history')
+    for back in range(min(days, span) - 1, -1, -1):
+        day = last - timedelta(days=back)
+        actual = df[df['date'] == day].set_index('device_id')['sold']
+        rows = machine_last_rows(df[df['date'] < day], plan)
+        rows = rows[rows['device_id'].isin(actual.index)].reset_index(drop=True)
+        yield day, rows, actual.reindex(rows['device_id']).values
+
+
+def detect_anomalies(model_path, df=None, history_path=None, days=ANOMALY_DAYS,
+                     method='zscore', quantile=ANOMALY_QUANTILE, threshold=None):
+    """
+    Score every machine's last `days` days against what the model expected.
+
+    Each scored day is predicted from the day before it, exactly as the next-day
+    prediction would have been, with all machines and days in one per-tree
+    predict call (forest models only). With records input only the days a
+    machine has a record for are scored, each from its last reported rows like
+    predict_machines, so a machine whose records stop is not taken for one
+    selling nothing: send a 0 record for a day it sold nothing. A sales matrix
+    has no gaps (a day without orders is a 0-sales day), so every day from
+    first_day on is scored.
+    Scores are then summed per machine with bincount, not per device:
+      zscore    z = sum(actual - mean) / sqrt(sum(variance)); the variance is the
+                tree spread plus Poisson count noise. Flagged at z <= threshold (-2).
+      quantile  days whose actual fell below the trees' `quantile` (p10),
+                plus the shortfall under it. Flagged at >= threshold (2) days.
+    Returns (summary dict, DataFrame of machines ranked worst first).
+    """
+    if method not in ANOMALY_THRESHOLDS:
+        raise ValueError(f"Unknown anomaly method: {method} (choose from {', '.join(ANOMALY_THRESHOLDS)})")
+    threshold = float(ANOMALY_THRESHOLDS[method] if threshold is None else threshold)
+
+    model_data = load_model_data(model_path)
+    plan = plan_features(model_data['feature_cols'])
+    if history_path:
+        scored = history_scored_days(history_path, plan, int(days))
+    else:
+        scored = records_scored_days(df, plan, int(days))
+
+    # Next-day model inputs for every (scored day, machine), with that day's actual
+    inputs, actual, window = [], [], []
+    for day, rows, day_actual in scored:
+        rows['weekday'] = day.weekday()
+        rows['month'] = day.month
+        rows['day_of_month'] = day.day
+        rows['is_weekend'] = 1 if day.weekday() >= 5 else 0
+        rows['lag_1'] = rows['sold']
+        inputs.append(rows)
+        actual.append(day_actual)
+        window.append(day)
+    inputs = pd.concat(inputs, ignore_index=True)
+    if inputs.empty:
+        raise ValueError('No machine has a record in the anomaly window')
+    actual = np.concatenate(actual).astype(np.float64)
+
+    X = build_feature_matrix(model_data, model_inputs(model_data, inputs), inputs['device_id'].values)
+    _, per_tree = predict_rows(model_data, X, inputs['device_id'].values, per_tree=True)
+    per_tree = np.clip(per_tree, 0, None)
+
+    # Per-machine sums over the scored days
+    machines, codes = np.unique(inputs['device_id'].astype(str).values, return_inverse=True)
+    n = len(machines)
+    mean = per_tree.mean(axis=0)
+    ranked = pd.DataFrame({
+        'device_id': machines,
+        'days': np.bincount(codes, minlength=n),
+        'actual': np.bincount(codes, weights=actual, minlength=n).astype(int),
+        'expected': np.round(np.bincount(codes, weights=mean, minlength=n), 1),
+    })
+
+    if method == 'zscore':
+        variance = per_tree.var(axis=0) + np.maximum(mean, 1.0)
+        residual = np.bincount(codes, weights=actual - mean, minlength=n)
+        ranked['z'] = np.round(residual / np.sqrt(np.bincount(codes, weights=variance, minlength=n)), 2)
+        ranked['flagged'] = ranked['z'] <= threshold
+        ranked = ranked.sort_values(['z', 'device_id'])
+    else:
+        lower = np.quantile(per_tree, quantile, axis=0)
+        key = quantile_key(quantile)
+        ranked[f'below_{key}'] = np.bincount(codes, weights=actual < lower, minlength=n).astype(int)
+        ranked['shortfall'] = np.round(np.bincount(codes, weights=np.maximum(lower - actual, 0), minlength=n), 1)
+        ranked['flagged'] = ranked[f'below_{key}'] >= threshold
+        ranked = ranked.sort_values([f'below_{key}', 'shortfall', 'device_id'], ascending=[False, False, True])
+
+    ranked = ranked.reset_index(drop=True)
+    summary = {
+        'success': True,
+        'mode': 'anomalies',
+        'method': method,
+        'threshold': threshold,
+        'window': [window[0].strftime('%Y-%m-%d'), window[-1].strftime('%Y-%m-%d')],
+        'machines': n,
+        'flagged': int(ranked['flagged'].sum()),
+    }
+    return summary, ranked
+
+
+def build_ranked_response(summary, ranked, fmt):
+    """
+    Anomaly or projection summary with the ranked machines, as records or
+    parallel arrays under the mode's name. Missing values become null.
+    """
+    result = dict(summary)
+    ranked = ranked.astype(object).where(ranked.notna(), None)
+    if fmt == 'columnar':
+        result[summary['mode']] = {c: ranked[c].tolist() for c in ranked.columns}
+    else:
+        result[summary['mode']] = ranked.to_dict(orient='records')
+    return result
 
-    # Fill NA lags with 0
-    lag_cols = [c for c in df_features.columns if c.startswith('lag_')]
-    df_features[lag_cols] = df_features[lag_cols].fillna(0)
 
-    # Get last row per machine (most recent day's data)
-    last_rows = df_features.groupby(MACHINE_COL).apply(
-        lambda g: g.sort_values('date').iloc[-1]
-    ).reset_index(drop=True)
+def predict_last_rows(model_data, last_rows, last_date, predict_date, quantiles=None, interval=None, shadow=None):
+    """
+    Predict the day after each machine's latest feature row.
+    With a ShadowModels, the feature matrix is handed to it for scoring later.
+    """
+    MACHINE_COL = 'device_id'
+    target_col = 'sold'
 
     # Update features for prediction date
     last_rows['weekday'] = predict_date.weekday()
@@ -81,86 +582,690 @@ def prepare_features_and_predict(df_raw, model_path, predict_date=None):
     # For lag_1, use the last day's sales (which is in 'sold' column of last_rows)
     last_rows['lag_1'] = last_rows[target_col]
 
-    # Prepare feature matrix
-    predictions = []
-
-    for _, row in last_rows.iterrows():
-        device_id = row[MACHINE_COL]
-
-        # Build feature dict
-        features = {
-            'weekday': row['weekday'],
-            'month': row['month'],
-            'day_of_month': row.get('day_of_month', predict_date.day),
-            'is_weekend': row['is_weekend'],
-            'lag_1': row['lag_1'],
-            'lag_7': row.get('lag_7', 0),
-            'rolling_avg_3': row.get('rolling_avg_3', row[target_col]),
-            'rolling_avg_7': row.get('rolling_avg_7', row[target_col]),
-            'rolling_avg_14': row.get('rolling_avg_14', row[target_col]),
-            'rolling_std_7': row.get('rolling_std_7', 0),
-        }
+    # Prepare feature matrix (one row per machine)
+    X = build_feature_matrix(model_data, model_inputs(model_data, last_rows), last_rows[MACHINE_COL].values)
+    if shadow is not None:
+        shadow.keep(model_data, X, last_rows[MACHINE_COL].values)
+
+    # Predict all machines in one call
+    qs = resolve_quantiles(quantiles, interval)
+    # Mean and quantiles both come from the same per-tree pass
+    raw_preds, per_tree = predict_rows(model_data, X, last_rows[MACHINE_COL].values, per_tree=bool(qs))
+    if qs:
+        machine_q = np.quantile(per_tree, qs, axis=0)
+        total_q = np.quantile(np.clip(per_tree, 0, None).sum(axis=1), qs)
+
+    # One row per machine, built from whole columns
+    preds = pd.DataFrame({
+        'device_id': last_rows[MACHINE_COL].astype(str).values,
+        'last_date': last_rows['date'].dt.strftime('%Y-%m-%d').values,
+        'last_sold': last_rows[target_col].astype(int).values,
+        'predicted': np.maximum(0, np.round(raw_preds)).astype(int),
+    })
+    summary = {
+        'success': True,
+        'predict_date': predict_date.strftime('%Y-%m-%d'),
+        'based_on_date': last_date.strftime('%Y-%m-%d'),
+        'total_predicted': int(preds['predicted'].sum()),
+        'machines': len(preds),
+    }
+    if qs:
+        for j, q in enumerate(qs):
+            preds[quantile_key(q)] = np.maximum(0, np.round(machine_q[j])).astype(int)
+        if interval is not None:
+            # From the interval itself: other requested quantiles may lie outside it
+            lower, upper = interval_bounds(interval)
+            preds['interval_lower'] = preds[quantile_key(lower)]
+            preds['interval_upper'] = preds[quantile_key(upper)]
+        # Fleet quantiles from per-tree totals, not sums of machine quantiles
+        summary['total_quantiles'] = {quantile_key(q): round(float(v), 1) for q, v in zip(qs, total_q)}
+
+    return summary, preds
+
+
+def weekday_shares(path, device_ids):
+    """
+    (machines x 7 x 24) share of a day's sales expected in each sales-day hour,
+    by weekday, read from an hourly profile file (rpi/hourly_profile.py). Weekday
+    x hour counts are shrunk towards the machine's hour-of-day profile, and that
+    towards the fleet's, as HourlyProfile.split() does; machines without history
+    get the fleet profile.
+    """
+    with np.load(path) as data:
+        counts = data['counts'].astype(np.float64)
+        devices = [str(d) for d in data['devices']]
+
+    def shrink(c, prior):
+        return (c + HOURLY_PRIOR_SALES * prior) / (c.sum(axis=-1, keepdims=True) + HOURLY_PRIOR_SALES)
+
+    fleet = shrink(counts.sum(axis=(0, 1)), np.full(24, 1 / 24))
+    machine = shrink(counts.sum(axis=1), fleet)
+    shares = shrink(counts, machine[:, None, :])
+
+    device_index = {d: i for i, d in enumerate(devices)}
+    rows = np.array([device_index.get(str(d), -1) for d in device_ids], dtype=int)
+    return np.where((rows >= 0)[:, None, None], shares[np.maximum(rows, 0)], fleet)
+
+
+def hourly_shares(path, device_ids, day):
+    """(machines x 24) share of `day`'s sales expected in each sales-day hour (see weekday_shares)."""
+    return weekday_shares(path, device_ids)[:, day.weekday(), :]
+
+
+def add_hourly(summary, preds, path):
+    """Split each machine's predicted total into an 'hourly' list of 24 expected sales."""
+    day = pd.Timestamp(summary['predict_date'])
+    hourly = hourly_shares(path, preds['device_id'].values, day) * preds['predicted'].values[:, None]
+    preds = preds.copy()
+    preds['hourly'] = [list(row) for row in np.round(hourly, 2)]
+    return preds
+
+
+def read_stock(stock):
+    """Current stock as (device_id, stock[, threshold]) rows, from a {device_id: quantity} map or records."""
+    if isinstance(stock, dict):
+        return pd.DataFrame({'device_id': [str(d) for d in stock], 'stock': list(stock.values())})
+    df = pd.DataFrame(stock).rename(columns={
+        'deviceId': 'device_id', 'quantity': 'stock', 'minStockThreshold': 'threshold',
+    })
+    df['device_id'] = df['device_id'].astype(str)
+    return df[[c for c in ('device_id', 'stock', 'threshold') if c in df.columns]]
+
+
+def hours_until(cum, demand, level, first_hour):
+    """
+    Hours from the start until cumulative demand reaches `level`, per machine
+    (NaN if it does not within the horizon). cum and demand are (machines x hours);
+    the first hour is only `first_hour` long, as the projection starts inside it.
+    """
+    reached = cum >= level[:, None]
+    hit = reached.any(axis=1)
+    idx = reached.argmax(axis=1)
+    rows = np.arange(len(idx))
+
+    before = np.where(idx > 0, cum[rows, np.maximum(idx - 1, 0)], 0.0)
+    length = np.where(idx == 0, first_hour, 1.0)
+    within = (level - before) / np.maximum(demand[rows, idx], 1e-12) * length
+    hours = np.where(idx > 0, idx - 1 + first_hour, 0.0) + within
+    return np.where(level <= 0, 0.0, np.where(hit, hours, np.nan))
+
 
-        # Create feature vector
-        X = pd.DataFrame([features])
+def project_stock(summary, preds, stock, start=None, days=PROJECTION_DAYS, hourly_path=None):
+    """
+    Project when each stocked machine runs empty (and below its threshold, if
+    given), most urgent first.
+
+    Each machine's predicted daily sales is held as its rate for every day of the
+    horizon and spread over sales-day hours by its weekday x hour profile (flat
+    without one). The whole fleet is simulated at once: one (machines x hours)
+    demand matrix from `start` (UTC, default now), its cumulative sum, and the
+    first hour each machine's stock is used up. Machines with stock but no
+    forecast are listed last.
+    """
+    stock = read_stock(stock)
+    start = pd.Timestamp(start) if start is not None else pd.Timestamp.now(tz='UTC').tz_localize(None)
+    if start.tzinfo is not None:
+        start = start.tz_convert('UTC').tz_localize(None)
 
-        # Add device dummy columns (all 0 except for this device if it exists)
-        for col in feature_cols:
-            if col not in X.columns:
-                if col == f'device_{device_id}':
-                    X[col] = 1
-                else:
-                    X[col] = 0
+    # Sales day and hour the projection starts in; never before the forecast day
+    into_day = start - timedelta(hours=14, minutes=30)
+    first_day = into_day.normalize() + timedelta(days=1)
+    elapsed = (into_day - into_day.normalize()) / timedelta(hours=1)
+    predict_date = pd.Timestamp(summary['predict_date'])
+    if first_day < predict_date:
+        first_day, elapsed = predict_date, 0.0
+        start = predict_date - timedelta(days=1) + timedelta(hours=14, minutes=30)
+    hour, first_hour = int(elapsed), 1 - (elapsed - int(elapsed))
 
-        # Reorder to match training
-        X = X[feature_cols]
+    merged = stock.merge(preds[['device_id', 'predicted']], on='device_id', how='left')
+    forecast = merged['predicted'].notna().values
+    machines = merged[forecast]
+    rate = machines['predicted'].values.astype(np.float64)
+    level = machines['stock'].values.astype(np.float64)
 
-        # Predict
-        pred = max(0, round(model.predict(X)[0]))
+    # (machines x hours) expected sales, from the start hour over `days` days
+    labels = [first_day + timedelta(days=d) for d in range(days + 1)]
+    if hourly_path:
+        by_weekday = weekday_shares(hourly_path, machines['device_id'].values)
+        shares = np.concatenate([by_weekday[:, day.weekday(), :] for day in labels], axis=1)
+    else:
+        shares = np.full((len(machines), 24 * len(labels)), 1 / 24)
+    demand = (shares * rate[:, None])[:, hour:hour + 24 * days]
+    demand[:, 0] *= first_hour
+    cum = np.cumsum(demand, axis=1)
 
-        predictions.append({
-            'device_id': str(device_id),
-            'last_date': row['date'].strftime('%Y-%m-%d'),
-            'last_sold': int(row[target_col]),
-            'predicted': pred
-        })
+    projection = pd.DataFrame({
+        'device_id': machines['device_id'].values,
+        'stock': machines['stock'].values,
+        'daily_demand': rate,
+        'hours_to_empty': hours_until(cum, demand, level, first_hour),
+    })
+    if 'threshold' in machines.columns:
+        projection['threshold'] = machines['threshold'].values
+        threshold = machines['threshold'].fillna(0).values.astype(np.float64)
+        projection['hours_to_threshold'] = hours_until(cum, demand, level - threshold, first_hour)
+    empty_at = start + pd.to_timedelta(projection['hours_to_empty'], unit='h')
+    projection['empty_at'] = empty_at.dt.strftime('%Y-%m-%dT%H:%MZ').where(empty_at.notna(), None)
+    projection['hours_to_empty'] = projection['hours_to_empty'].round(1)
+    if 'hours_to_threshold' in projection.columns:
+        projection['hours_to_threshold'] = projection['hours_to_threshold'].round(1)
 
-    # Calculate total
-    total_predicted = sum(p['predicted'] for p in predictions)
+    unforecast = merged.loc[~forecast, [c for c in merged.columns if c != 'predicted']]
+    projection = pd.concat([
+        projection.sort_values(['hours_to_empty', 'stock'], na_position='last', kind='stable'),
+        unforecast,
+    ], ignore_index=True)
 
-    return {
+    hours = projection['hours_to_empty']
+    result = {
         'success': True,
-        'predict_date': predict_date.strftime('%Y-%m-%d'),
-        'based_on_date': last_date.strftime('%Y-%m-%d'),
-        'total_predicted': total_predicted,
-        'machines': len(predictions),
-        'predictions_per_machine': predictions
+        'mode': 'projection',
+        'predict_date': summary['predict_date'],
+        'start': start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'horizon_days': days,
+        'hourly_profile': bool(hourly_path),
+        'machines': len(projection),
+        'without_forecast': int((~forecast).sum()),
+        'empty_within_24h': int((hours <= 24).sum()),
+        'empty_within_horizon': int(hours.notna().sum()),
     }
+    return result, projection
+
+
+class PredictionCache:
+    """
+    Memoized prediction results keyed by a canonical hash of the request.
+
+    Entries live in an in-memory LRU and, if a directory is given, in one JSON
+    file per key so separate predict.py processes share them. Entries older than
+    ttl seconds are ignored, and the store is trimmed to max_entries (oldest first).
+    Hit/miss/eviction counters are kept per process; info() adds them to the
+    directory's cumulative stats.json under a file lock, replaced atomically.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, directory=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = Path(directory) if directory else None
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.merged = dict(self.stats)
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(df, model_path, predict_date=None, quantiles=None, interval=None):
+        """
+        Hash of the history (order-independent), predict_date, the model
+        artifact's version (path, size, mtime) and the quantile options.
+        """
+        history = pd.DataFrame({
+            'device_id': df['device_id'].astype(str),
+            'date': pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d'),
+            'sold': pd.to_numeric(df['sold']).astype(float),
+        }).sort_values(['device_id', 'date'], kind='stable')
+
+        stat = os.stat(model_path)
+        digest = hashlib.sha256()
+        digest.update(pd.util.hash_pandas_object(history, index=False).values.tobytes())
+        digest.update(json.dumps([
+            str(Path(model_path).resolve()), stat.st_size, stat.st_mtime_ns,
+            predict_date, sorted(quantiles or []), interval,
+        ]).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return (summary, preds) for a fresh entry, or None."""
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is None and self.directory:
+            path = self.directory / f'{key}.json'
+            # A missing, half-written or corrupt file is a miss, not a failed request
+            try:
+                entry = json.loads(path.read_text())
+                self.entries[key] = entry
+            except (OSError, ValueError):
+                entry = None
+
+        if entry is None or now - entry['created'] > self.ttl:
+            self.entries.pop(key, None)
+            self._count('misses')
+            return None
+
+        self.entries.move_to_end(key)
+        self._count('hits')
+        return entry['summary'], pd.DataFrame(entry['predictions'])
+
+    def put(self, key, summary, preds):
+        entry = {
+            'created': time.time(),
+            'summary': summary,
+            'predictions': {c: preds[c].tolist() for c in preds.columns},
+        }
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self._count('evictions')
+
+        if self.directory:
+            with tempfile.NamedTemporaryFile('w', dir=self.directory, prefix=f'{key}.', suffix='.tmp',
+                                             delete=False) as tmp:
+                tmp.write(json.dumps(entry))
+            os.replace(tmp.name, self.directory / f'{key}.json')
+            self._trim_disk()
+
+    def _trim_disk(self):
+        """Drop expired files, then the oldest beyond max_entries."""
+        now = time.time()
+        files = sorted(self.directory.glob('*.json'), key=lambda f: f.stat().st_mtime)
+        files = [f for f in files if f.name != 'stats.json']
+        for f in files:
+            if now - f.stat().st_mtime > self.ttl:
+                f.unlink(missing_ok=True)
+        files = [f for f in files if f.exists()]
+        for f in files[:max(0, len(files) - self.max_entries)]:
+            f.unlink(missing_ok=True)
+            self._count('evictions')
+
+    def _count(self, name):
+        self.stats[name] += 1
+
+    def _merge_totals(self):
+        """Add the counts since the last merge to stats.json and return the totals."""
+        path = self.directory / 'stats.json'
+        with open(self.directory / 'stats.lock', 'w') as lock:
+            try:
+                import fcntl
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            except ImportError:
+                pass
+            try:
+                totals = json.loads(path.read_text())
+            except (OSError, ValueError):
+                totals = {}
+            for name, count in self.stats.items():
+                totals[name] = totals.get(name, 0) + count - self.merged[name]
+            self.merged = dict(self.stats)
+            tmp = path.with_name(f'stats.json.{os.getpid()}.tmp')
+            tmp.write_text(json.dumps(totals))
+            os.replace(tmp, path)
+        return totals
+
+    def info(self, hit):
+        """Counters to report alongside a response."""
+        info = {'hit': hit, **self.stats, 'entries': len(self.entries)}
+        if self.directory:
+            info['totals'] = self._merge_totals()
+        return info
+
+
+def cached_predict(cache, df, model_path, predict_date=None, quantiles=None, interval=None, backend=None,
+                   shadow=None):
+    """
+    predict_machines() through a PredictionCache. Returns (summary, preds, hit).
+    A hit builds no feature matrix, so shadow models are not scored for it.
+    """
+    key = cache.key(df, model_path, predict_date, quantiles, interval)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached[0], cached[1], True
+
+    summary, preds = predict_machines(df, model_path, predict_date, quantiles, interval, backend, shadow)
+    cache.put(key, summary, preds)
+    return summary, preds, False
+
+
+def matrix_layout(model_data):
+    """What decides a model's input matrix: its feature columns and device encoding."""
+    encoding = model_data.get('device_encoding')
+    devices = [str(d) for d in model_data['devices']] if encoding else None
+    return list(model_data['feature_cols']), encoding, devices
+
+
+def resolve_shadow_models(shadow_models=None):
+    """{name: path} from a list of paths (named by file stem) or a dict (default: $PREDICT_SHADOW_MODELS)."""
+    if shadow_models is None:
+        shadow_models = [p.strip() for p in os.environ.get('PREDICT_SHADOW_MODELS', '').split(',') if p.strip()]
+    if isinstance(shadow_models, str):
+        shadow_models = [shadow_models]
+    if isinstance(shadow_models, dict):
+        return {str(name): str(path) for name, path in shadow_models.items()}
+    return {Path(path).stem: str(path) for path in shadow_models}
+
+
+class ShadowModels:
+    """
+    Candidate models scored on the production model's feature matrix.
+
+    predict_last_rows() hands over the matrix it built (keep); once the
+    production response is out, score() runs every candidate on it and appends
+    one JSON line with the production and candidate predictions per machine.
+    The matrix is never rebuilt, so a candidate with different feature columns
+    or device encoding is recorded as skipped.
+    """
+
+    def __init__(self, paths, log_path):
+        self.paths = paths
+        self.log_path = Path(log_path)
+        self.layout = self.X = self.device_ids = None
+
+    def keep(self, model_data, X, device_ids):
+        """Hold on to the production matrix and its row order."""
+        self.layout, self.X, self.device_ids = matrix_layout(model_data), X, device_ids
+
+    def score(self, summary, preds, model_path):
+        """Score every candidate on the kept matrix and append the log entry."""
+        if self.X is None:
+            return None
+
+        entry = {
+            'logged_at': datetime.now().isoformat(timespec='seconds'),
+            'predict_date': summary['predict_date'],
+            'based_on_date': summary['based_on_date'],
+            'model': str(model_path),
+            'total_predicted': summary['total_predicted'],
+            'device_id': preds['device_id'].tolist(),
+            'predicted': preds['predicted'].tolist(),
+            'shadows': {},
+        }
+        for name, path in self.paths.items():
+            start = time.perf_counter()
+            try:
+                model_data = load_model_data(path)
+                if matrix_layout(model_data) != self.layout:
+                    entry['shadows'][name] = {'model': path, 'skipped': 'different feature matrix'}
+                    continue
+                raw_preds, _ = predict_rows(model_data, self.X, self.device_ids)
+                predicted = np.maximum(0, np.round(raw_preds)).astype(int)
+                entry['shadows'][name] = {
+                    'model': path,
+                    'total_predicted': int(predicted.sum()),
+                    'predicted': predicted.tolist(),
+                    'seconds': round(time.perf_counter() - start, 3),
+                }
+            except Exception as e:
+                entry['shadows'][name] = {'model': path, 'error': str(e)}
+
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.log_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        return entry
+
+
+def score_shadows(shadow, summary, preds, model_path):
+    """
+    Close stdout so the caller has the whole response, then score the shadow
+    models. Problems go to stderr: the response is already out.
+    """
+    sys.stdout.flush()
+    sys.stdout.close()
+    if shadow.X is None:
+        print("Cached response, shadow models not scored", file=sys.stderr)
+        return
+    try:
+        shadow.score(summary, preds, model_path)
+    except Exception as e:
+        print(f"Shadow scoring failed: {e}", file=sys.stderr)
+
+
+def prepare_features_and_predict(df_raw, model_path, predict_date=None, quantiles=None, interval=None):
+    """
+    Predict next day sales per machine and return the record-format response:
+    predictions_per_machine is a list of {device_id, last_date, last_sold, predicted} dicts.
+    """
+    summary, preds = predict_machines(df_raw, model_path, predict_date, quantiles, interval)
+    return build_response(summary, preds, 'records')
+
+
+def predictions_to_records(summary, preds):
+    """Per-machine dicts, with quantiles/interval nested as in the record format."""
+    qkeys = list(summary.get('total_quantiles', {}))
+    has_interval = 'interval_lower' in preds.columns
+    columns = {c: preds[c].tolist() for c in preds.columns}
+
+    records = []
+    for i in range(len(preds)):
+        pred = {
+            'device_id': columns['device_id'][i],
+            'last_date': columns['last_date'][i],
+            'last_sold': columns['last_sold'][i],
+            'predicted': columns['predicted'][i],
+        }
+        if qkeys:
+            pred['quantiles'] = {k: columns[k][i] for k in qkeys}
+        if has_interval:
+            pred['interval'] = [columns['interval_lower'][i], columns['interval_upper'][i]]
+        if 'hourly' in columns:
+            pred['hourly'] = columns['hourly'][i]
+        records.append(pred)
+    return records
+
+
+def build_response(summary, preds, fmt):
+    """Assemble a JSON response in record or columnar (parallel arrays) layout."""
+    result = {k: v for k, v in summary.items() if k not in ('total_quantiles', 'cache')}
+    if fmt == 'columnar':
+        result['predictions_per_machine'] = {c: preds[c].tolist() for c in preds.columns}
+    else:
+        result['predictions_per_machine'] = predictions_to_records(summary, preds)
+    if 'total_quantiles' in summary:
+        result['total_quantiles'] = summary['total_quantiles']
+    if 'cache' in summary:
+        result['cache'] = summary['cache']
+    return result
+
+
+def read_request(raw):
+    """
+    Parse stdin into (options, historical DataFrame, response format).
+
+    Accepted inputs:
+      JSON, historical_data as a list of {device_id, date, sold}   -> 'records'
+      JSON, historical_data as {device_id: [...], date: [...], sold: [...]} -> 'columnar'
+      NDJSON: an options object on the first line, then one record per line -> 'ndjson'
+      Arrow IPC stream/file with device_id, date, sold columns; options in the
+        schema metadata under b'request' (needs pyarrow) -> 'arrow'
+    An explicit "format" option overrides the response format.
+    """
+    if raw[:4] == b'\xff\xff\xff\xff' or raw[:6] == b'ARROW1':
+        import pyarrow as pa
+        reader = pa.ipc.open_file(raw) if raw[:6] == b'ARROW1' else pa.ipc.open_stream(raw)
+        table = reader.read_all()
+        metadata = table.schema.metadata or {}
+        options = json.loads(metadata.get(b'request', b'{}'))
+        return options, table.to_pandas(), options.get('format', 'arrow')
+
+    text = raw.decode('utf-8')
+    try:
+        options = json.loads(text)
+    except json.JSONDecodeError:
+        # NDJSON: options header line followed by one record per line
+        header, _, body = text.partition('\n')
+        options = json.loads(header)
+        df = pd.read_json(io.StringIO(body), lines=True, dtype={'device_id': str, 'date': str}) if body.strip() else pd.DataFrame()
+        return options, df, options.get('format', 'ndjson')
+
+    historical_data = options.pop('historical_data', None) or []
+    fmt = 'columnar' if isinstance(historical_data, dict) else 'records'
+    return options, pd.DataFrame(historical_data), options.get('format', fmt)
+
+
+def write_response(summary, preds, fmt, out=None):
+    """Write the response to stdout in the requested format."""
+    out = out or sys.stdout
+    if fmt == 'ndjson':
+        out.write(json.dumps(summary) + '\n')
+        out.write(preds.to_json(orient='records', lines=True).rstrip('\n') + '\n')
+    elif fmt == 'arrow':
+        import pyarrow as pa
+        table = pa.Table.from_pandas(preds, preserve_index=False)
+        table = table.replace_schema_metadata({b'response': json.dumps(summary).encode()})
+        sink = out.buffer if hasattr(out, 'buffer') else out
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        sink.flush()
+    elif summary.get('mode') in ('anomalies', 'projection'):
+        out.write(json.dumps(build_ranked_response(summary, preds, fmt)) + '\n')
+    else:
+        out.write(json.dumps(build_response(summary, preds, fmt)) + '\n')
+
+
+def start_profiling(directory=PROFILE_DIR):
+    """
+    Profile the rest of this process; artifacts are written and summarized at
+    exit. A copy of rpi/run_profile.py (ml/ is deployed on its own), reporting
+    to stderr so the response on stdout is untouched.
+    """
+    import atexit
+    import cProfile
+    import tracemalloc
+
+    tracemalloc.start(PROFILE_TRACE_FRAMES)
+    profiler = cProfile.Profile()
+    atexit.register(finish_profiling, profiler, Path(directory), time.perf_counter())
+    profiler.enable()
+    return profiler
+
+
+def profile_hot_spots(stats, top=PROFILE_TOP_FUNCTIONS, within=None):
+    """
+    (own s, cumulative s, calls, 'file:line(function)') of the functions with
+    the most own time, or with `within` (a directory) the most cumulative time
+    among the functions defined there. As run_profile.hot_spots.
+    """
+    rows = [
+        (tt, ct, nc, f"{Path(file).name}:{line}({func})")
+        for (file, line, func), (cc, nc, tt, ct, callers) in stats.stats.items()
+        if within is None or Path(file).parent == within
+    ]
+    key = (lambda r: r[1]) if within is not None else (lambda r: r[0])
+    return sorted(rows, key=key, reverse=True)[:top]
+
+
+def finish_profiling(profiler, directory, started):
+    """Stop profiling, write the .prof and .alloc.txt artifacts and report the hot spots. As run_profile.finish_profiling."""
+    import pstats
+    import tracemalloc
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    profiler.disable()
+    wall = time.perf_counter() - started
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    directory.mkdir(parents=True, exist_ok=True)
+    stem = directory / f"predict-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+    prof_path = stem.with_suffix('.prof')
+    alloc_path = stem.with_suffix('.alloc.txt')
+    profiler.dump_stats(prof_path)
+
+    allocations = snapshot.statistics('lineno')[:PROFILE_TOP_ALLOCATIONS]
+    with open(alloc_path, 'w') as f:
+        f.write(f"Traced peak: {peak / 2**20:.1f} MB\n")
+        f.write(f"Top {len(allocations)} allocation sites held at exit:\n")
+        for stat in allocations:
+            f.write(f"{stat}\n")
+
+    stats = pstats.Stats(profiler)
+    log(f"Profile: {wall:.2f}s wall, {stats.total_tt:.2f}s profiled CPU, {peak / 2**20:.1f} MB traced peak")
+    log(f"{'Own s':>8} {'Cum s':>8} {'Calls':>9}  Function")
+    for tt, ct, nc, func in profile_hot_spots(stats):
+        log(f"{tt:8.3f} {ct:8.3f} {nc:9d}  {func}")
+    log("Slowest pipeline functions:")
+    for tt, ct, nc, func in profile_hot_spots(stats, 5, Path(sys.argv[0]).resolve().parent):
+        log(f"{tt:8.3f} {ct:8.3f} {nc:9d}  {func}")
+    for stat in allocations[:5]:
+        log(f"Held at exit: {stat.size / 2**20:7.1f} MB  {stat.traceback[0]}")
+    log(f"Profile written to {prof_path} and {alloc_path}")
 
 
 def main():
+    if '--profile' in sys.argv[1:] or os.environ.get('PREDICT_PROFILE', '').lower() in ('1', 'true', 'yes'):
+        start_profiling()
+
     try:
         # Read input from stdin
-        input_data = json.loads(sys.stdin.read())
+        options, df, fmt = read_request(sys.stdin.buffer.read())
+
+        model_path = options.get('model_path')
+        predict_date = options.get('predict_date', None)
+        quantiles = options.get('quantiles')
+        interval = options.get('interval')
+        backend = options.get('backend')
 
-        model_path = input_data.get('model_path')
-        historical_data = input_data.get('historical_data', [])
-        predict_date = input_data.get('predict_date', None)
+        history_path = options.get('history_path') or os.environ.get('PREDICT_HISTORY')
+        if options.get('anomalies') and (not df.empty or history_path):
+            summary, ranked = detect_anomalies(
+                model_path, df, history_path if df.empty else None,
+                days=options.get('anomaly_days', ANOMALY_DAYS),
+                method=options.get('anomaly_method', 'zscore'),
+                quantile=float(options.get('anomaly_quantile', ANOMALY_QUANTILE)),
+                threshold=options.get('anomaly_threshold'),
+            )
+            write_response(summary, ranked, fmt)
+            return
 
-        if not historical_data:
+        shadow = None
+        shadow_paths = resolve_shadow_models(options.get('shadow_models'))
+        if shadow_paths:
+            shadow_log = (options.get('shadow_log') or os.environ.get('PREDICT_SHADOW_LOG')
+                          or Path(model_path).with_name(SHADOW_LOG_NAME))
+            shadow = ShadowModels(shadow_paths, shadow_log)
+
+        hourly_path = options.get('hourly_profile') or os.environ.get('PREDICT_HOURLY_PROFILE')
+        stock = options.get('stock')
+        if df.empty and history_path:
+            summary, preds = predict_from_history(history_path, model_path, predict_date, quantiles, interval, shadow)
+            predicted = (summary, preds)
+            if stock is not None:
+                summary, preds = project_stock(
+                    summary, preds, stock, options.get('stock_as_of'),
+                    int(options.get('projection_days', PROJECTION_DAYS)), hourly_path,
+                )
+            elif hourly_path:
+                preds = add_hourly(summary, preds, hourly_path)
+            write_response(summary, preds, fmt)
+            if shadow is not None:
+                score_shadows(shadow, *predicted, model_path)
+            return
+
+        if df.empty:
             print(json.dumps({'error': 'No historical data provided', 'success': False}))
             sys.exit(1)
 
-        # Convert to DataFrame
-        df = pd.DataFrame(historical_data)
-
         # Required columns: device_id, date, sold
         if 'device_id' not in df.columns:
             # If no device_id, assume aggregated data - create dummy device
             df['device_id'] = 'all'
 
-        result = prepare_features_and_predict(df, model_path, predict_date)
-        print(json.dumps(result))
+        cache_dir = options.get('cache_dir') or os.environ.get('PREDICT_CACHE_DIR')
+        if options.get('cache') or cache_dir:
+            cache_dir = cache_dir or CACHE_DIR
+            cache = PredictionCache(
+                max_entries=int(options.get('cache_max_entries', CACHE_MAX_ENTRIES)),
+                ttl=float(options.get('cache_ttl', CACHE_TTL_SECONDS)),
+                directory=cache_dir,
+            )
+            summary, preds, hit = cached_predict(cache, df, model_path, predict_date, quantiles, interval,
+                                                 backend, shadow)
+            summary = {**summary, 'cache': cache.info(hit)}
+        else:
+            summary, preds = predict_machines(df, model_path, predict_date, quantiles, interval, backend, shadow)
+        predicted = (summary, preds)
+        if stock is not None:
+            summary, preds = project_stock(
+                summary, preds, stock, options.get('stock_as_of'),
+                int(options.get('projection_days', PROJECTION_DAYS)), hourly_path,
+            )
+        elif hourly_path:
+            preds = add_hourly(summary, preds, hourly_path)
+        write_response(summary, preds, fmt)
+        if shadow is not None:
+            score_shadows(shadow, *predicted, model_path)
 
     except Exception as e:
         import traceback
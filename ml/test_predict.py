@@ -0,0 +1,80 @@
+"""Tests for ml/predict.py (python -m pytest ml)."""
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+import predict
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    """A small forest over BASE_FEATURES, saved as predict.py expects."""
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.integers(0, 20, (200, len(predict.BASE_FEATURES))), columns=predict.BASE_FEATURES)
+    y = X['rolling_avg_7'] + rng.normal(0, 3, len(X))
+    model = RandomForestRegressor(n_estimators=50, random_state=0).fit(X, y)
+    path = tmp_path / 'model.joblib'
+    joblib.dump({'model': model, 'feature_cols': list(predict.BASE_FEATURES)}, path)
+    return path
+
+
+@pytest.fixture
+def history():
+    rng = np.random.default_rng(1)
+    dates = pd.date_range('2026-01-01', periods=30)
+    return pd.DataFrame([
+        {'device_id': device, 'date': d.strftime('%Y-%m-%d'), 'sold': int(rng.integers(0, 20))}
+        for device in ('852301', '852302', '852303') for d in dates
+    ])
+
+
+def test_interval_bounds():
+    assert predict.interval_bounds(0.8) == (0.1, 0.9)
+    assert predict.interval_bounds(0.5) == (0.25, 0.75)
+
+
+@pytest.mark.parametrize('quantiles, interval, bounds', [
+    ([0.05], 0.8, ('p10', 'p90')),
+    ([0.9], 0.5, ('p25', 'p75')),
+    ([0.01, 0.99], 0.8, ('p10', 'p90')),
+])
+def test_interval_ignores_quantiles_outside_it(model_path, history, quantiles, interval, bounds):
+    _, preds = predict.predict_machines(history, model_path, quantiles=quantiles, interval=interval)
+    lower, upper = bounds
+    assert preds['interval_lower'].tolist() == preds[lower].tolist()
+    assert preds['interval_upper'].tolist() == preds[upper].tolist()
+    for q in quantiles:
+        assert predict.quantile_key(q) in preds.columns
+
+
+def test_cache_round_trip_on_disk(tmp_path):
+    preds = pd.DataFrame({'device_id': ['852301'], 'predicted_sales': [4.0]})
+    predict.PredictionCache(directory=tmp_path).put('abc', {'machines': 1}, preds)
+    assert not list(tmp_path.glob('*.tmp'))
+
+    summary, cached = predict.PredictionCache(directory=tmp_path).get('abc')
+    assert summary == {'machines': 1}
+    assert cached.equals(preds)
+
+
+def test_corrupt_cache_files_are_misses(tmp_path):
+    (tmp_path / 'abc.json').write_text('{"created": ')
+    (tmp_path / 'stats.json').write_text('not json')
+    cache = predict.PredictionCache(directory=tmp_path)
+    assert cache.get('abc') is None
+    assert cache.info(hit=False)['totals']['misses'] == 1
+
+
+def test_anomaly_features_follow_reported_rows(model_path, history):
+    # 852301 misses a week, so its calendar and reported-row windows differ
+    dates = pd.to_datetime(history['date'])
+    gaps = history[~((history['device_id'] == '852301') & dates.between('2026-01-20', '2026-01-26'))]
+    last = pd.to_datetime(gaps['date']).max()
+
+    _, ranked = predict.detect_anomalies(model_path, df=gaps, days=1)
+    _, preds = predict.predict_machines(gaps[pd.to_datetime(gaps['date']) < last], model_path, predict_date=last)
+    expected = ranked.set_index('device_id')['expected']
+    predicted = preds.set_index('device_id')['predicted']
+    assert (expected - predicted.reindex(expected.index)).abs().max() <= 0.5
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Optional Polars backend for daily aggregation and feature building.
+
+feature_store.py keeps the pandas implementations as the reference; with
+FEATURE_BACKEND=polars (or backend='polars') the same aggregates and features
+are computed here on Polars' multi-threaded engine instead. Inputs and outputs
+stay pandas frames, so callers do not change. If Polars is not installed the
+pandas path is used.
+
+Results match the pandas path up to float rounding; scripts/feature_backends_benchmark.py
+checks that and times both on synthetic year-scale histories.
+
+Select with $FEATURE_BACKEND:
+  pandas   Reference implementation (default)
+  polars   Needs polars>=1.21 (pip install polars)
+"""
+
+import os
+from datetime import timedelta
+
+BACKENDS = ['pandas', 'polars']
+DEFAULT_BACKEND = os.environ.get('FEATURE_BACKEND', 'pandas')
+
+# Order columns partial_daily copies into Polars as they are
+ORDER_COLUMNS = ['log_datetime', 'num_dispensed', 'transaction_amount', 'refund_amount', 'error_code']
+
+
+def resolve_backend(backend=None):
+    """Backend to run: the one asked for (default $FEATURE_BACKEND), or pandas without Polars."""
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown feature backend: {backend} (choose from {', '.join(BACKENDS)})")
+    if backend == 'polars':
+        try:
+            import polars  # noqa: F401
+        except ImportError:
+            return 'pandas'
+    return backend
+
+
+def partial_daily(df):
+    """feature_store.partial_daily on Polars."""
+    import pandas as pd
+    import polars as pl
+
+    # String columns are the costly part of the copy into Polars: machines go
+    # over as sorted integer codes (so code order is serial order), outcomes as a flag
+    codes, machines = pd.factorize(df['machine_sn'], sort=True)
+    orders = pl.from_pandas(df[ORDER_COLUMNS].assign(
+        machine=codes, success=(df['operation_outcome'] == 'Success').values,
+    ))
+    success = pl.col('success')
+    # One lazy query, so the per-order columns are never materialized on their own
+    parts = orders.lazy().select(
+        date=((pl.col('log_datetime') - timedelta(hours=14, minutes=30)).dt.date()
+              + timedelta(days=1)).cast(pl.Datetime('ns')),
+        machine=pl.col('machine'),
+        daily_sales=pl.when(success).then(pl.col('num_dispensed')).otherwise(0),
+        transactions=success.cast(pl.Int64),
+        total_amount=pl.when(success).then(pl.col('transaction_amount')).otherwise(0),
+        total_refund=pl.when(success).then(pl.col('refund_amount')).otherwise(0),
+        error_count=pl.col('error_code').ne_missing(0).cast(pl.Int64),
+    )
+    parts = parts.group_by(['date', 'machine']).agg(pl.all().sum()).sort(['date', 'machine'])
+    parts = parts.collect().to_pandas()
+    parts.insert(1, 'machine_sn', machines[parts.pop('machine').values])
+    return parts
+
+
+def combine_daily(partials, device_groups=None):
+    """feature_store.combine_daily on Polars."""
+    import polars as pl
+
+    parts = pl.concat([pl.from_pandas(p) for p in partials], how='vertical_relaxed').lazy()
+    parts = parts.group_by(['date', 'machine_sn']).agg(pl.all().sum())
+
+    keys = ['date']
+    if device_groups is not None:
+        groups = pl.from_pandas(device_groups[['machine_sn', 'group_id']].drop_duplicates()).lazy()
+        parts = parts.join(groups, on='machine_sn')
+        keys = ['group_id', 'date']
+
+    # Days and machines count only where something sold
+    df_agg = parts.filter(pl.col('transactions') > 0).group_by(keys).agg(
+        pl.col('daily_sales').sum(),
+        pl.col('transactions').sum(),
+        pl.col('total_amount').sum(),
+        pl.col('total_refund').sum(),
+        active_machines=pl.col('machine_sn').n_unique().cast(pl.Int64),
+    )
+
+    errors = parts.group_by(keys).agg(pl.col('error_count').sum())
+    df_agg = df_agg.join(errors, on=keys, how='left').with_columns(
+        pl.col('error_count').fill_null(0).cast(pl.Float64)
+    )
+    return df_agg.sort(keys).collect().to_pandas()
+
+
+def create_features(df_agg, windows, lags, target, by=None):
+    """
+    feature_store.create_features on Polars. With `by` (a column name) every
+    rolling and lag feature is computed within each value of it, in one pass,
+    as create_group_features does per group.
+    """
+    import polars as pl
+
+    def within(expr):
+        return expr.over(by) if by else expr
+
+    frame = pl.from_pandas(df_agg).with_columns(pl.col('date').cast(pl.Datetime('ns')))
+    if by:
+        frame = frame.sort([by, 'date'], maintain_order=True)
+
+    sales = pl.col(target).cast(pl.Float64)
+    weekday = pl.col('date').dt.weekday().cast(pl.Int32) - 1
+    columns = [
+        pl.col('date').dt.day().cast(pl.Int32).alias('day'),
+        weekday.alias('weekday'),
+        pl.col('date').dt.month().cast(pl.Int32).alias('month'),
+        (weekday >= 5).cast(pl.Int64).alias('is_weekend'),
+    ]
+    for w in windows:
+        columns.append(within(sales.rolling_mean(w, min_samples=1)).alias(f'rolling_mean_{w}'))
+        columns.append(within(sales.rolling_std(w, min_samples=1)).fill_null(0).fill_nan(0).alias(f'rolling_std_{w}'))
+    for lag in lags:
+        columns.append(within(sales.shift(lag)).fill_null(0).alias(f'lag_{lag}'))
+    columns.append(
+        pl.when(pl.col('transactions') != 0)
+        .then(pl.col('error_count') / pl.col('transactions'))
+        .otherwise(0.0)
+        .alias('error_rate')
+    )
+
+    df_features = frame.with_columns(columns)
+    if not by:
+        df_features = df_features.sort('date', maintain_order=True)
+    return df_features.to_pandas()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Feature-configuration experiments for the fleet-total model.
+Loads the daily series once, places it in shared memory, and evaluates a grid
+of rolling windows / lags / feature sets in parallel worker processes that read
+the series without copying it. Prints a table ranked by walk-forward error,
+next to the cost of computing the features and training.
+
+Usage:
+  python feature_experiments.py --source training_data.csv
+  python feature_experiments.py --windows 3,7,14 7,14,28 --lags 1,7 1,7,14 --folds 6
+"""
+
+import time
+import argparse
+import warnings
+warnings.filterwarnings('ignore')
+
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from multiprocessing import shared_memory
+
+from feature_store import FeatureStore, AGG_COLUMNS, TARGET_COL, WINDOWS, LAGS, create_features
+from model_engines import ENGINES, DEFAULT_ENGINE
+from resource_profile import ResourceProfile, limit_native_threads
+from train_model import DATA_FILE, walk_forward_predictions
+
+# Default grid
+GRID_WINDOWS = [(3, 7, 14), (7, 14), (3, 7, 14, 28), (7,)]
+GRID_LAGS = [(1, 7), (1, 7, 14), (7,)]
+
+# Feature sets: daily aggregates other than sales kept as model inputs
+FEATURE_SETS = {
+    'all': None,
+    'sales': ['transactions', 'total_amount', 'total_refund', 'active_machines', 'error_count', 'error_rate'],
+}
+
+# Worker-side view of the shared daily series
+_series = None
+
+
+def share_series(df_agg):
+    """
+    Copy the daily aggregates into one shared float64 block (date as days since epoch).
+    Returns (shm, spec), where spec lets workers attach with attach_series.
+    """
+    values = df_agg[AGG_COLUMNS[1:]].to_numpy(dtype=np.float64)
+    days = df_agg['date'].values.astype('datetime64[D]').astype(np.int64)
+    data = np.column_stack([days, values])
+
+    shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    np.ndarray(data.shape, dtype=np.float64, buffer=shm.buf)[:] = data
+    return shm, (shm.name, data.shape)
+
+
+def attach_series(name, shape):
+    """Pool initializer: map the shared block into this worker (no copy) and cap threads."""
+    global _series
+    limit_native_threads(1)
+    shm = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+    df = pd.DataFrame(array[:, 1:], columns=AGG_COLUMNS[1:], copy=False)
+    df.insert(0, 'date', pd.to_datetime(array[:, 0], unit='D'))
+    # Keep the mapping alive for the life of the worker
+    _series = (shm, df)
+
+
+def run_config(windows, lags, feature_set, engine, folds):
+    """Build one feature configuration from the shared series and walk-forward score it."""
+    _, df_agg = _series
+
+    start = time.perf_counter()
+    df_features = create_features(df_agg, windows, lags)
+    drop = FEATURE_SETS[feature_set]
+    if drop:
+        df_features = df_features.drop(columns=drop)
+    feature_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    predicted, actual = walk_forward_predictions(df_features, engine, folds, n_jobs=1, lags=lags)
+    train_s = time.perf_counter() - start
+
+    errors = np.abs(predicted - actual)
+    return {
+        'windows': ','.join(map(str, windows)),
+        'lags': ','.join(map(str, lags)),
+        'features': feature_set,
+        'n_features': len([c for c in df_features.columns if c not in ('date', TARGET_COL)]),
+        'feature_ms': feature_ms,
+        'train_s': train_s,
+        'wf_mae': errors.mean() if len(errors) else np.nan,
+        'wf_mape': (errors / np.maximum(actual, 1)).mean() * 100 if len(errors) else np.nan,
+    }
+
+
+def run_experiments(df_agg, windows_grid=GRID_WINDOWS, lags_grid=GRID_LAGS,
+                    feature_sets=tuple(FEATURE_SETS), engine=DEFAULT_ENGINE, folds=4, profile=None):
+    """
+    Score every (windows, lags, feature set) combination on the same daily
+    series in parallel. Returns the results ranked by walk-forward MAE.
+    """
+    profile = profile or ResourceProfile()
+    grid = list(product(windows_grid, lags_grid, feature_sets))
+    workers = profile.workers(len(grid))
+    print(f"Evaluating {len(grid)} configurations with {workers} workers...")
+
+    shm, (name, shape) = share_series(df_agg)
+    results = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach_series,
+                                 initargs=(name, shape)) as pool:
+            futures = [
+                pool.submit(run_config, windows, lags, feature_set, engine, folds)
+                for windows, lags, feature_set in grid
+            ]
+            for future in as_completed(futures):
+                results.append(future.result())
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return pd.DataFrame(results).sort_values('wf_mae').reset_index(drop=True)
+
+
+def parse_ints(value):
+    return tuple(int(v) for v in value.split(','))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare feature configurations')
+    parser.add_argument('--source', type=str, default=str(DATA_FILE),
+                        help='Orders source: CSV/Parquet/SQLite snapshot or database URL')
+    parser.add_argument('--feature-store', type=str, help='Feature store to read the daily series from')
+    parser.add_argument('--windows', type=parse_ints, nargs='+', default=GRID_WINDOWS,
+                        help='Rolling window sets to try, e.g. 3,7,14 7,14,28')
+    parser.add_argument('--lags', type=parse_ints, nargs='+', default=GRID_LAGS,
+                        help='Lag sets to try, e.g. 1,7 1,7,14')
+    parser.add_argument('--feature-sets', nargs='+', choices=list(FEATURE_SETS), default=list(FEATURE_SETS),
+                        help='all: every daily aggregate; sales: sales history and calendar only')
+    parser.add_argument('--engine', choices=ENGINES, default=DEFAULT_ENGINE)
+    parser.add_argument('--folds', type=int, default=4, help='Weekly walk-forward folds (default: 4)')
+    args = parser.parse_args()
+
+    profile = ResourceProfile().apply()
+    print(f"Resources: {profile}")
+
+    store = FeatureStore(args.source, args.feature_store, profile)
+    store.sync()
+    df_agg = store.read()[AGG_COLUMNS]
+    print(f"Loaded {len(df_agg)} days from {args.source}")
+    print(f"Current configuration: windows {WINDOWS}, lags {LAGS}")
+    print()
+
+    results = run_experiments(df_agg, args.windows, args.lags, args.feature_sets,
+                              args.engine, args.folds, profile)
+    print()
+    print(results.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Daily feature store for the sales prediction pipeline.
+Holds one finished feature row per sales day, so training, the nightly run and
+backtests all read the same rows instead of re-aggregating raw orders.
+
+Days are appended as they close (14:30 UTC). The store is only rebuilt from
+scratch when FEATURE_SCHEMA_VERSION changes, so bump it whenever
+the daily aggregates or create_features change.
+
+The live database gets a persistent store (daily_features.csv, or $FEATURE_STORE);
+snapshot sources are featurized in memory unless a store path is given.
+Event machines are excluded here, before aggregation.
+
+Aggregation and features run on pandas by default; FEATURE_BACKEND=polars
+runs the same definitions on Polars (see feature_backends.py).
+
+Usage:
+  python feature_store.py                                 # Sync from $DATABASE_URL
+  python feature_store.py --source orders.csv --store features.csv
+"""
+
+import os
+import argparse
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+import data_sources
+import feature_backends
+from resource_profile import ResourceProfile
+
+# Configuration
+SCRIPT_DIR = Path(__file__).parent
+FEATURE_STORE_PATH = Path(os.environ.get('FEATURE_STORE', SCRIPT_DIR / 'daily_features.csv'))
+
+# Bump when the aggregates or features below change; stores of another version are rebuilt
+FEATURE_SCHEMA_VERSION = 1
+
+# Devices to exclude from prediction (event machines)
+MACHINES_TO_DROP = ['852298', '852308', '852309', '852311']
+
+# Feature windows
+WINDOWS = [3, 7, 14]
+LAGS = [1, 7]
+TARGET_COL = 'daily_sales'
+
+# Daily aggregate columns (input to create_features)
+AGG_COLUMNS = [
+    'date', 'daily_sales', 'transactions', 'total_amount',
+    'total_refund', 'active_machines', 'error_count',
+]
+
+# Preceding days needed to extend rolling/lag features onto newly closed days
+CONTEXT_DAYS = max(WINDOWS + LAGS)
+
+
+def partial_daily(df, backend=None):
+    """
+    Per (sales day, machine) partial sums of an orders chunk. Partials from
+    any split of the orders add up, so large histories can be aggregated
+    chunk by chunk; combine_daily turns them into daily totals.
+    Daily window: 10:30 PM SGT Day X to 10:29 PM SGT Day X+1 -> labeled as Day X+1.
+    """
+    if feature_backends.resolve_backend(backend) == 'polars':
+        return feature_backends.partial_daily(df)
+
+    # Shift time and label by END date of the window
+    adjusted = df['log_datetime'] - pd.Timedelta(hours=14, minutes=30)
+    success = df['operation_outcome'] == 'Success'
+
+    parts = pd.DataFrame({
+        'date': pd.to_datetime(adjusted.dt.date) + pd.Timedelta(days=1),
+        'machine_sn': df['machine_sn'],
+        # Only count successful orders
+        'daily_sales': df['num_dispensed'].where(success, 0),
+        'transactions': success.astype(int),
+        'total_amount': df['transaction_amount'].where(success, 0.0),
+        'total_refund': df['refund_amount'].where(success, 0.0),
+        # Error count from all orders
+        'error_count': (df['error_code'] != 0).astype(int),
+    })
+    return parts.groupby(['date', 'machine_sn'], as_index=False).sum()
+
+
+def combine_daily(partials, device_groups=None, backend=None):
+    """
+    Add up partial_daily frames into TOTAL daily aggregates (all machines combined).
+    With device_groups (machine_sn, group_id rows) the totals are per group
+    instead, keyed by (group_id, date); a machine in several groups counts in each.
+    """
+    if feature_backends.resolve_backend(backend) == 'polars':
+        return feature_backends.combine_daily(partials, device_groups)
+
+    parts = pd.concat(partials, ignore_index=True)
+    parts = parts.groupby(['date', 'machine_sn'], as_index=False).sum()
+
+    keys = ['date']
+    if device_groups is not None:
+        parts = parts.merge(device_groups[['machine_sn', 'group_id']].drop_duplicates(), on='machine_sn')
+        keys = ['group_id', 'date']
+
+    # Days and machines count only where something sold
+    sold = parts[parts['transactions'] > 0]
+    df_agg = sold.groupby(keys).agg(
+        daily_sales=('daily_sales', 'sum'),
+        transactions=('transactions', 'sum'),
+        total_amount=('total_amount', 'sum'),
+        total_refund=('total_refund', 'sum'),
+        active_machines=('machine_sn', 'nunique')
+    ).reset_index()
+
+    errors = parts.groupby(keys)['error_count'].sum().rename('error_count').reset_index()
+    df_agg = df_agg.merge(errors, on=keys, how='left')
+    df_agg['error_count'] = df_agg['error_count'].fillna(0).astype(float)
+
+    return df_agg
+
+
+def aggregate_daily(df, backend=None):
+    """Aggregate orders to TOTAL daily level (all machines combined)."""
+    return combine_daily([partial_daily(df, backend)], backend=backend)
+
+
+def create_features(df_agg, windows=WINDOWS, lags=LAGS, backend=None):
+    """Create features for the model (total sales level)."""
+    if feature_backends.resolve_backend(backend) == 'polars':
+        return feature_backends.create_features(df_agg, windows, lags, TARGET_COL)
+
+    df_features = df_agg.copy()
+
+    df_features['date'] = pd.to_datetime(df_features['date'])
+    df_features['day'] = df_features['date'].dt.day
+    df_features['weekday'] = df_features['date'].dt.weekday
+    df_features['month'] = df_features['date'].dt.month
+    df_features['is_weekend'] = (df_features['weekday'] >= 5).astype(int)
+
+    # Rolling statistics (total level, no groupby)
+    for w in windows:
+        df_features[f'rolling_mean_{w}'] = df_features[TARGET_COL].rolling(window=w, min_periods=1).mean()
+        df_features[f'rolling_std_{w}'] = df_features[TARGET_COL].rolling(window=w, min_periods=1).std().fillna(0)
+
+    # Lag features
+    for lag in lags:
+        df_features[f'lag_{lag}'] = df_features[TARGET_COL].shift(lag)
+
+    # Error rate
+    df_features['error_rate'] = df_features['error_count'] / df_features['transactions'].replace(0, np.nan)
+    df_features['error_rate'] = df_features['error_rate'].fillna(0)
+
+    # Fill NA lags with 0
+    lag_cols = [c for c in df_features.columns if c.startswith('lag_')]
+    df_features[lag_cols] = df_features[lag_cols].fillna(0)
+
+    df_features = df_features.sort_values('date')
+
+    return df_features
+
+
+def create_group_features(df_group_agg, windows=WINDOWS, lags=LAGS, backend=None):
+    """create_features on each group's own daily series, keeping the group_id column."""
+    if feature_backends.resolve_backend(backend) == 'polars' and not df_group_agg.empty:
+        df_features = feature_backends.create_features(df_group_agg, windows, lags, TARGET_COL, by='group_id')
+        return df_features[['group_id'] + [c for c in df_features.columns if c != 'group_id']]
+
+    frames = [
+        create_features(series.drop(columns='group_id'), windows, lags).assign(group_id=group_id)
+        for group_id, series in df_group_agg.sort_values('date').groupby('group_id', sort=True)
+    ]
+    if not frames:
+        return pd.DataFrame(columns=['group_id'] + AGG_COLUMNS)
+    df_features = pd.concat(frames, ignore_index=True)
+    return df_features[['group_id'] + [c for c in df_features.columns if c != 'group_id']]
+
+
+def next_day_features(rows, lags=LAGS):
+    """
+    Turn each feature row into the model input for the following day:
+    the lags take the row's own sales and the date features move one day ahead.
+    """
+    rows = rows.copy()
+
+    # Use current values as lag placeholders for next day prediction
+    for lag in lags:
+        rows[f'lag_{lag}'] = rows[TARGET_COL].values
+
+    # Increment date features for next day
+    next_dates = rows['date'] + timedelta(days=1)
+    rows['day'] = next_dates.dt.day.astype(int)
+    rows['weekday'] = next_dates.dt.weekday.astype(int)
+    rows['month'] = next_dates.dt.month.astype(int)
+    rows['is_weekend'] = (rows['weekday'] >= 5).astype(int)
+
+    return rows
+
+
+def day_close(day):
+    """UTC time at which the sales day labelled `day` closes."""
+    return datetime.combine(day, data_sources.DAY_BOUNDARY)
+
+
+def last_closed_day(now=None):
+    """Label of the most recent sales day that has closed."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    return now.date() if now >= day_close(now.date()) else now.date() - timedelta(days=1)
+
+
+class FeatureStore:
+    """
+    Daily feature rows for one orders source, oldest first.
+    The live database (or any source given an explicit path) gets a persistent
+    store; snapshot sources are featurized in memory on each sync.
+    Orders are read in chunks sized by the resource profile's memory budget.
+    """
+
+    def __init__(self, source=None, path=None, profile=None, backend=None):
+        self.source = data_sources.resolve_source(source)
+        self.profile = profile or ResourceProfile()
+        self.backend = feature_backends.resolve_backend(backend)
+        if path is None and data_sources.is_database_source(self.source):
+            path = FEATURE_STORE_PATH
+        self.path = Path(path) if path else None
+        self.rows = None
+
+    def _aggregate(self, start, end):
+        """Daily aggregates of orders in [start, end), event machines removed, or None."""
+        partials = []
+        for chunk in data_sources.iter_orders(self.source, start, end, self.profile.chunk_rows):
+            chunk = chunk[~chunk['machine_sn'].isin(MACHINES_TO_DROP)]
+            if not chunk.empty:
+                partials.append(partial_daily(chunk, self.backend))
+        return combine_daily(partials, backend=self.backend) if partials else None
+
+    def _load(self):
+        """Stored rows, or None if there are none for the current schema version."""
+        if self.rows is not None:
+            return self.rows
+        if self.path is None or not self.path.exists():
+            return None
+
+        if self.path.suffix in ('.parquet', '.pq'):
+            df = pd.read_parquet(self.path)
+        else:
+            df = pd.read_csv(self.path, parse_dates=['date'])
+        if df.empty or (df['schema_version'] != FEATURE_SCHEMA_VERSION).any():
+            return None
+        return df.drop(columns='schema_version')
+
+    def _save(self, rows):
+        """Atomically replace the store file with `rows`."""
+        out = rows.copy()
+        out.insert(0, 'schema_version', FEATURE_SCHEMA_VERSION)
+
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        if self.path.suffix in ('.parquet', '.pq'):
+            out.to_parquet(tmp, index=False)
+        else:
+            out.to_csv(tmp, index=False)
+        os.replace(tmp, self.path)
+
+    def sync(self, through=None):
+        """
+        Append feature rows for every sales day closed up to `through`
+        (a date, default: the last closed day). Returns the number of days added.
+        """
+        through = min(through or last_closed_day(), last_closed_day())
+        stored = self._load()
+
+        if stored is None:
+            # Missing store or schema change: featurize the full history
+            start, context = None, None
+        else:
+            last = stored['date'].max()
+            if last.date() >= through:
+                self.rows = stored
+                return 0
+            start = day_close(last.date())
+            context = stored[AGG_COLUMNS].tail(CONTEXT_DAYS)
+
+        df_agg = self._aggregate(start, day_close(through))
+        if df_agg is None or df_agg.empty:
+            new_rows = None
+        else:
+            if context is not None:
+                df_agg = pd.concat([context, df_agg], ignore_index=True)
+            new_rows = create_features(df_agg, backend=self.backend)
+            if stored is not None:
+                new_rows = new_rows[new_rows['date'] > last]
+
+        if stored is None:
+            rows = new_rows if new_rows is not None else pd.DataFrame(columns=AGG_COLUMNS)
+        elif new_rows is None:
+            rows = stored
+        else:
+            rows = pd.concat([stored, new_rows], ignore_index=True)
+        self.rows = rows.reset_index(drop=True)
+
+        added = len(self.rows) - (0 if stored is None else len(stored))
+        if self.path is not None and (added or stored is None):
+            self._save(self.rows)
+        return added
+
+    def read(self, start=None, end=None):
+        """Feature rows with start <= date <= end (dates, inclusive), oldest first."""
+        rows = self.rows if self.rows is not None else self._load()
+        if rows is None:
+            return pd.DataFrame(columns=AGG_COLUMNS)
+        if start is not None:
+            rows = rows[rows['date'] >= pd.Timestamp(start)]
+        if end is not None:
+            rows = rows[rows['date'] <= pd.Timestamp(end)]
+        return rows.reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync the daily feature store')
+    parser.add_argument('--source', help='Orders source (default: $ORDERS_SOURCE or $DATABASE_URL)')
+    parser.add_argument('--store', help=f'Store file, .csv or .parquet (default: {FEATURE_STORE_PATH})')
+    parser.add_argument('--through', type=str, help='Last sales day to add (YYYY-MM-DD)')
+    parser.add_argument('--backend', choices=feature_backends.BACKENDS,
+                        help=f'Aggregation/feature backend (default: {feature_backends.DEFAULT_BACKEND})')
+    args = parser.parse_args()
+
+    through = datetime.strptime(args.through, '%Y-%m-%d').date() if args.through else None
+    store = FeatureStore(args.source, args.store or FEATURE_STORE_PATH, backend=args.backend)
+
+    added = store.sync(through)
+    rows = store.read()
+    print(f"Added {added} day(s) to {store.path} (schema v{FEATURE_SCHEMA_VERSION})")
+    if not rows.empty:
+        print(f"{len(rows)} days: {rows['date'].min().date()} to {rows['date'].max().date()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Per-machine hour-of-day demand profiles, for splitting daily forecasts into hours.
+
+Sold counts are kept per (machine, weekday, hour) in one small int32 array,
+stored with the device list and a watermark in an .npz file:
+  counts    (machines x 7 x 24)   weekday of the sales-day label x sales-day hour
+  devices   machine serials, one per row of counts
+  synced    label of the last sales day added (YYYY-MM-DD)
+
+Hours are counted from the 14:30 UTC day boundary, as in the nowcast: hour 0
+is 22:30-23:29 SGT and hour 23 is 21:30-22:29 SGT, so the 24 shares of a day
+split a daily forecast exactly. Sync adds closed days only, with one bincount
+per orders chunk. ml/predict.py reads the same file through its hourly_profile option.
+
+Usage:
+  python hourly_profile.py                                  # Sync from $DATABASE_URL
+  python hourly_profile.py --source orders.csv --path hourly_profile.npz
+  python hourly_profile.py --device 852301                  # Show one machine's profile
+"""
+
+import os
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data_sources
+from feature_store import MACHINES_TO_DROP, day_close, last_closed_day
+from resource_profile import ResourceProfile
+
+# Configuration
+SCRIPT_DIR = Path(__file__).parent
+HOURLY_PROFILE_PATH = Path(os.environ.get('HOURLY_PROFILE', SCRIPT_DIR / 'hourly_profile.npz'))
+HOURS = 24
+WEEKDAYS = 7
+
+# Pseudo-sales of the broader profile mixed into each narrower one, so sparse
+# weekday x hour cells and new machines lean on their hour-of-day / fleet shape
+PRIOR_SALES = 20
+
+
+def order_cells(df):
+    """(weekday, hour) cell of each order: weekday of its sales-day label, hour since 14:30 UTC."""
+    adjusted = df['log_datetime'] - timedelta(hours=14, minutes=30)
+    weekday = (adjusted.dt.weekday.values + 1) % WEEKDAYS
+    return weekday * HOURS + adjusted.dt.hour.values
+
+
+def shrink(counts, prior):
+    """Shares of `counts` along the last axis, shrunk towards `prior` shares by PRIOR_SALES."""
+    total = counts.sum(axis=-1, keepdims=True)
+    return (counts + PRIOR_SALES * prior) / (total + PRIOR_SALES)
+
+
+class HourlyProfile:
+    """Machine x weekday x hour sold counts with normalized profile views."""
+
+    def __init__(self, path=HOURLY_PROFILE_PATH):
+        self.path = Path(path)
+        self.counts = np.zeros((0, WEEKDAYS, HOURS), dtype=np.int32)
+        self.devices = []
+        self.synced = None
+        if self.path.exists():
+            with np.load(self.path) as data:
+                self.counts = data['counts']
+                self.devices = [str(d) for d in data['devices']]
+                self.synced = datetime.strptime(str(data['synced']), '%Y-%m-%d').date()
+
+    def _save(self):
+        tmp = self.path.with_name(self.path.stem + '.tmp.npz')
+        np.savez(tmp, counts=self.counts, devices=np.array(self.devices, dtype=str),
+                 synced=np.array(self.synced.strftime('%Y-%m-%d')))
+        os.replace(tmp, self.path)
+
+    def add_orders(self, df):
+        """Add successful orders' sold units, all machines and cells in one bincount (event machines left out)."""
+        df = df[(df['operation_outcome'] == 'Success') & ~df['machine_sn'].isin(MACHINES_TO_DROP)]
+        if df.empty:
+            return
+
+        machines = df['machine_sn'].astype(str).values
+        device_index = {d: i for i, d in enumerate(self.devices)}
+        for d in sorted(set(machines) - set(device_index)):
+            device_index[d] = len(self.devices)
+            self.devices.append(d)
+        if len(self.devices) > len(self.counts):
+            grown = np.zeros((len(self.devices), WEEKDAYS, HOURS), dtype=np.int32)
+            grown[:len(self.counts)] = self.counts
+            self.counts = grown
+
+        cells = np.fromiter((device_index[m] for m in machines), dtype=np.int64, count=len(machines))
+        cells = cells * WEEKDAYS * HOURS + order_cells(df)
+        added = np.bincount(cells, weights=df['num_dispensed'].values, minlength=self.counts.size)
+        self.counts += added.astype(np.int32).reshape(self.counts.shape)
+
+    def sync(self, source=None, through=None, profile=None):
+        """
+        Add every sales day closed up to `through` (a date, default: the last
+        closed day) since the last sync. Returns the number of days added.
+        """
+        profile = profile or ResourceProfile()
+        through = min(through or last_closed_day(), last_closed_day())
+        if self.synced is not None and self.synced >= through:
+            return 0
+
+        start = day_close(self.synced) if self.synced else None
+        first = last = None
+        for chunk in data_sources.iter_orders(source, start, day_close(through), profile.chunk_rows):
+            # A non-chunked window with no new orders comes back empty and untyped
+            if chunk.empty:
+                continue
+            chunk = chunk.assign(log_datetime=pd.to_datetime(chunk['log_datetime'], utc=True).dt.tz_localize(None))
+            self.add_orders(chunk)
+            labels = (chunk['log_datetime'] - timedelta(hours=14, minutes=30)).dt.date + timedelta(days=1)
+            first = labels.min() if first is None else min(first, labels.min())
+            last = labels.max() if last is None else max(last, labels.max())
+
+        # The live database is complete up to `through`; a snapshot ends at its last order
+        if not data_sources.is_database_source(data_sources.resolve_source(source)):
+            through = last
+        if through is None or (self.synced is None and first is None):
+            return 0
+
+        added = (through - self.synced).days if self.synced else (through - first).days + 1
+        self.synced = through
+        self._save()
+        return added
+
+    def hourly(self):
+        """(machines x 24) hour-of-day shares, shrunk towards the fleet profile."""
+        fleet = shrink(self.counts.sum(axis=(0, 1)), np.full(HOURS, 1 / HOURS))
+        return shrink(self.counts.sum(axis=1), fleet)
+
+    def weekday_hourly(self):
+        """(machines x 7 x 24) shares for each weekday, shrunk towards the machine's hour-of-day profile."""
+        return shrink(self.counts, self.hourly()[:, None, :])
+
+    def split(self, devices, daily, date):
+        """
+        Split daily forecasts into (machines x 24) expected sales per sales-day hour.
+        devices and daily are parallel; `date` is the sales day being forecast.
+        Machines without history get the fleet profile.
+        """
+        fleet = shrink(self.counts.sum(axis=(0, 1)), np.full(HOURS, 1 / HOURS))
+        shares = self.weekday_hourly()[:, date.weekday(), :]
+        device_index = {d: i for i, d in enumerate(self.devices)}
+        rows = np.array([device_index.get(str(d), -1) for d in devices])
+        out = np.where((rows >= 0)[:, None], shares[np.maximum(rows, 0)], fleet)
+        return out * np.asarray(daily, dtype=np.float64)[:, None]
+
+
+def hour_label(hour):
+    """SGT clock time at which a sales-day hour starts, e.g. 0 -> '22:30'."""
+    return f"{(22 + hour) % 24:02d}:30"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync per-machine hour-of-day demand profiles')
+    parser.add_argument('--source', help='Orders source (default: $ORDERS_SOURCE or $DATABASE_URL)')
+    parser.add_argument('--path', default=str(HOURLY_PROFILE_PATH), help=f'Profile file (default: {HOURLY_PROFILE_PATH})')
+    parser.add_argument('--through', type=str, help='Last sales day to add (YYYY-MM-DD)')
+    parser.add_argument('--device', type=str, help='Print this machine\'s hour-of-day profile')
+    args = parser.parse_args()
+
+    through = datetime.strptime(args.through, '%Y-%m-%d').date() if args.through else None
+    profiles = HourlyProfile(args.path)
+    added = profiles.sync(args.source, through)
+
+    print(f"Added {added} day(s) to {profiles.path}")
+    if not profiles.devices:
+        return
+    size_kb = profiles.path.stat().st_size / 1024
+    print(f"{len(profiles.devices)} machines, {int(profiles.counts.sum()):,} sales through "
+          f"{profiles.synced} ({size_kb:.1f} KB)")
+
+    if args.device:
+        if args.device not in profiles.devices:
+            raise SystemExit(f"No sales recorded for {args.device}")
+        shares = profiles.hourly()[profiles.devices.index(args.device)]
+    else:
+        shares = profiles.hourly().mean(axis=0)
+    print()
+    print(f"{'SGT':>6} {'Share':>7}")
+    for hour, share in enumerate(shares):
+        print(f"{hour_label(hour):>6} {share * 100:6.1f}%  {'#' * int(round(share * 200))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Model engines for the fleet-total sales model.
+train_model.py and the nightly run build their regressor here, so the engine
+can be switched without touching either script.
+
+Select with --engine (train_model.py) or $MODEL_ENGINE:
+  forest    RandomForestRegressor, 200 trees (default; the only engine with quantiles)
+  hist_gb   HistGradientBoostingRegressor on binned features (fast to fit, small artifact)
+  linear    Ridge on scaled features + weekday/month one-hots (regularized seasonal baseline)
+
+Compare them on the same data with: python train_model.py --compare
+"""
+
+import os
+
+ENGINES = ['forest', 'hist_gb', 'linear']
+DEFAULT_ENGINE = os.environ.get('MODEL_ENGINE', 'forest')
+
+# Ridge penalties searched by leave-one-out CV at fit time (logspace(-2, 3, 12))
+RIDGE_ALPHAS = [10 ** (-2 + 5 * i / 11) for i in range(12)]
+
+
+def make_model(engine=DEFAULT_ENGINE, n_jobs=-1):
+    """Unfitted regressor for an engine name (sklearn is only imported here)."""
+    if engine == 'forest':
+        from sklearn.ensemble import RandomForestRegressor
+        return RandomForestRegressor(n_estimators=200, random_state=42, n_jobs=n_jobs)
+    if engine == 'hist_gb':
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        return HistGradientBoostingRegressor(
+            max_iter=300, learning_rate=0.05, max_leaf_nodes=15,
+            l2_regularization=1.0, early_stopping=False, random_state=42
+        )
+    if engine == 'linear':
+        from sklearn.linear_model import RidgeCV
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import StandardScaler
+        return make_pipeline(StandardScaler(), RidgeCV(alphas=RIDGE_ALPHAS))
+    raise ValueError(f"Unknown model engine: {engine} (choose from {', '.join(ENGINES)})")
+
+
+def supports_quantiles(model):
+    """True if per-tree quantiles can be read off the model (random forests only)."""
+    return isinstance(getattr(model, 'estimators_', None), list)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Accuracy- and drift-driven retraining for the fleet-total model.
+
+The nightly run keeps sales_model.joblib until it is measurably worse, instead
+of training once or on a schedule. After the prediction is saved it checks:
+  accuracy  MAPE of the last ERROR_DAYS predictions made by the current model,
+            against the actualSales reconciled into "SalesPrediction"
+  drift     largest shift of a model input's recent mean from its training
+            mean, in training standard deviations (see feature_drift)
+and retrains in the background when either crosses its threshold. Reference
+stats are saved next to the model (sales_model.json) when it is trained; every
+retrain is appended to retrain_log.jsonl with its reasons and duration.
+
+Configured from the environment:
+  RETRAIN_MAPE     Rolling MAPE (%) that triggers a retrain (default 20)
+  RETRAIN_DRIFT    Feature shift (standard deviations) that triggers a retrain (default 1.5)
+
+Usage:
+  python model_health.py                  # Show the last retrains
+"""
+
+import os
+import json
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+# Configuration
+SCRIPT_DIR = Path(__file__).parent
+RETRAIN_LOG_PATH = SCRIPT_DIR / 'retrain_log.jsonl'
+MAPE_THRESHOLD = float(os.environ.get('RETRAIN_MAPE', 20))
+DRIFT_THRESHOLD = float(os.environ.get('RETRAIN_DRIFT', 1.5))
+
+ERROR_DAYS = 14             # Reconciled predictions in the rolling error
+MIN_ERROR_DAYS = 7          # Fewer than this -> accuracy is not judged yet
+DRIFT_DAYS = 14             # Recent feature rows compared with the training rows
+MIN_MODEL_AGE_DAYS = 7      # A model younger than this is never retrained
+
+# Calendar inputs shift with the season, not with demand
+CALENDAR_COLUMNS = ['day', 'weekday', 'month', 'is_weekend']
+
+
+def save_reference(path, df_train, feature_cols, trained_at=None):
+    """
+    Write the training range and per-feature mean/std next to a freshly trained
+    model. With path None the reference is only returned.
+    """
+    columns = [c for c in feature_cols if c not in CALENDAR_COLUMNS]
+    trained_at = trained_at or datetime.now(timezone.utc)
+    reference = {
+        'trained_at': trained_at.isoformat(timespec='seconds'),
+        'trained_through': df_train['date'].max().strftime('%Y-%m-%d'),
+        'rows': len(df_train),
+        'features': {
+            c: [float(df_train[c].mean()), float(df_train[c].std(ddof=0))] for c in columns
+        },
+    }
+    if path is not None:
+        tmp = Path(path).with_name(Path(path).name + '.tmp')
+        tmp.write_text(json.dumps(reference, indent=2))
+        os.replace(tmp, path)
+    return reference
+
+
+def load_reference(path, model_path=None, df_features=None, feature_cols=None, persist=True):
+    """
+    Reference stats of the current model. A model trained before they were
+    kept gets them from the feature rows up to its file date, taken as its
+    training date, saved once unless persist is False (snapshot replays).
+    Returns None if there is nothing to go on.
+    """
+    path = Path(path)
+    if path.exists():
+        return json.loads(path.read_text())
+    if model_path is None or df_features is None or not Path(model_path).exists():
+        return None
+
+    trained_at = datetime.fromtimestamp(Path(model_path).stat().st_mtime, timezone.utc)
+    df_train = df_features[df_features['date'] < np.datetime64(trained_at.date())]
+    if df_train.empty:
+        return None
+    return save_reference(path if persist else None, df_train, feature_cols, trained_at)
+
+
+def rolling_error(predicted, actual):
+    """(MAPE %, MAE) of paired predictions and actuals; days with no sales are left out of MAPE."""
+    predicted = np.asarray(predicted, dtype=np.float64)
+    actual = np.asarray(actual, dtype=np.float64)
+    errors = np.abs(predicted - actual)
+    sold = actual > 0
+    mape = float((errors[sold] / actual[sold]).mean() * 100) if sold.any() else None
+    return mape, float(errors.mean())
+
+
+def feature_drift(reference, df_recent):
+    """
+    Largest |recent mean - training mean| / training std over the reference
+    features, and the feature it belongs to. Constant training features are skipped.
+    """
+    worst, worst_feature = 0.0, None
+    for col, (mean, std) in reference['features'].items():
+        if col not in df_recent.columns or std == 0:
+            continue
+        shift = abs(float(df_recent[col].mean()) - mean) / std
+        if shift > worst:
+            worst, worst_feature = shift, col
+    return worst, worst_feature
+
+
+def check(reference, errors, df_features, now=None,
+          mape_threshold=MAPE_THRESHOLD, drift_threshold=DRIFT_THRESHOLD):
+    """
+    Decide whether the model needs retraining.
+    errors holds (prediction_date, predicted, actual) rows of reconciled
+    predictions; only those after the model was trained are counted.
+    Returns a report dict; report['reasons'] is empty when no retrain is due.
+    """
+    now = now or datetime.now(timezone.utc)
+    report = {'checked_at': now.isoformat(timespec='seconds'), 'reasons': []}
+    if reference is None:
+        report['note'] = 'no reference stats for this model'
+        return report
+
+    trained_at = datetime.fromisoformat(reference['trained_at'])
+    report['model_age_days'] = round((now - trained_at).total_seconds() / 86400, 1)
+
+    # Accuracy of the current model's own predictions
+    errors = errors[errors['prediction_date'] > np.datetime64(reference['trained_through'])]
+    errors = errors.sort_values('prediction_date').tail(ERROR_DAYS)
+    report['error_days'] = len(errors)
+    if len(errors) >= MIN_ERROR_DAYS:
+        report['mape'], report['mae'] = rolling_error(errors['predicted'], errors['actual'])
+        if report['mape'] is not None and report['mape'] > mape_threshold:
+            report['reasons'].append(f"MAPE {report['mape']:.1f}% over {len(errors)} days > {mape_threshold:g}%")
+
+    # Drift of the recent model inputs from the training rows
+    drift, feature = feature_drift(reference, df_features.sort_values('date').tail(DRIFT_DAYS))
+    report['drift'], report['drift_feature'] = round(drift, 3), feature
+    if drift > drift_threshold:
+        report['reasons'].append(f"{feature} shifted {drift:.2f} sd > {drift_threshold:g}")
+
+    if report['reasons'] and report['model_age_days'] < MIN_MODEL_AGE_DAYS:
+        report['note'] = f"model younger than {MIN_MODEL_AGE_DAYS} days, not retraining"
+        report['reasons'] = []
+    return report
+
+
+def describe(report):
+    """One-line summary of a check() report for the log."""
+    parts = []
+    if report.get('mape') is not None:
+        parts.append(f"MAPE {report['mape']:.1f}% over {report['error_days']} days")
+    elif 'error_days' in report:
+        parts.append(f"{report['error_days']} of {MIN_ERROR_DAYS} reconciled days needed for MAPE")
+    if report.get('drift_feature'):
+        parts.append(f"drift {report['drift']:.2f} sd ({report['drift_feature']})")
+    if 'model_age_days' in report:
+        parts.append(f"model {report['model_age_days']:g} days old")
+    if 'note' in report:
+        parts.append(report['note'])
+    return ', '.join(parts)
+
+
+def record_retrain(report, started_at, duration_s, rows, status, path=RETRAIN_LOG_PATH):
+    """Append one retrain (why, when, how long, outcome) to the retrain log."""
+    entry = {
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'duration_s': round(duration_s, 1),
+        'rows': rows,
+        'status': status,
+        **{k: report[k] for k in ('reasons', 'mape', 'mae', 'error_days', 'drift', 'drift_feature', 'model_age_days')
+           if k in report},
+    }
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the retrain log')
+    parser.add_argument('--log', default=str(RETRAIN_LOG_PATH), help=f'Retrain log (default: {RETRAIN_LOG_PATH})')
+    parser.add_argument('--last', type=int, default=10, help='Entries to show (default: 10)')
+    args = parser.parse_args()
+
+    path = Path(args.log)
+    if not path.exists():
+        print(f"No retrains recorded in {path}")
+        return
+    entries = [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+    print(f"{len(entries)} retrain(s) recorded; thresholds: MAPE {MAPE_THRESHOLD:g}%, drift {DRIFT_THRESHOLD:g} sd")
+    for entry in entries[-args.last:]:
+        print(f"{entry['started_at']}  {entry['status']:<8} {entry['duration_s']:>6.1f}s  "
+              f"{entry['rows']:>5} rows  {'; '.join(entry.get('reasons', []))}")
+
+
+if __name__ == "__main__":
+    main()
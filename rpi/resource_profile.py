@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Resource profile for running the pipeline on a constrained host (the Pi: 4 cores, 1 GB).
+Caps worker processes and native BLAS/OpenMP/Polars thread pools, and turns a memory
+budget into orders chunk sizes and training parallelism, so large fetches
+stream in chunks instead of getting the run OOM-killed. Once the process has
+peaked above the budget, later fetches use half-size chunks and training runs
+in a single worker.
+
+Configured from the environment:
+  PIPELINE_THREADS     CPU threads for the whole run (default: cores, at most 4)
+  PIPELINE_MEMORY_MB   Memory budget in MB (default: half of physical memory)
+"""
+
+import os
+
+DEFAULT_MAX_THREADS = 4
+DEFAULT_MEMORY_SHARE = 0.5      # Of physical memory, when no budget is set
+
+# Peak bytes per order row while fetching + normalizing (the raw and
+# normalized frames coexist briefly; the normalized frame alone is ~360 B/row)
+ORDER_ROW_BYTES = 1024
+CHUNK_SHARE = 0.25              # Share of the budget a single orders chunk may use
+
+# Resident size of one training worker process (interpreter + numpy/sklearn + data)
+WORKER_MB = 150
+
+THREAD_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS',
+               'POLARS_MAX_THREADS')
+
+
+def physical_memory_mb():
+    """Total physical memory in MB, or None if the platform does not report it."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2**20
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MB."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def limit_native_threads(n_threads):
+    """Cap BLAS/OpenMP threads in this process and in any process it starts."""
+    for var in THREAD_VARS:
+        os.environ[var] = str(n_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(n_threads)
+    except ImportError:
+        pass
+
+
+class ResourceProfile:
+    """CPU thread cap and memory budget for one pipeline run."""
+
+    def __init__(self, threads=None, memory_mb=None):
+        threads = threads or int(os.environ.get('PIPELINE_THREADS', 0))
+        self.threads = max(1, threads or min(os.cpu_count() or 1, DEFAULT_MAX_THREADS))
+
+        memory_mb = memory_mb or int(os.environ.get('PIPELINE_MEMORY_MB', 0))
+        if not memory_mb:
+            total = physical_memory_mb()
+            memory_mb = int(total * DEFAULT_MEMORY_SHARE) if total else 512
+        self.memory_mb = memory_mb
+
+    @property
+    def chunk_rows(self):
+        """Orders rows per fetch chunk that fit the budget, halved once the run is over it."""
+        rows = int(self.memory_mb * 2**20 * CHUNK_SHARE / ORDER_ROW_BYTES)
+        if self.over_budget():
+            rows //= 2
+        return max(10_000, rows)
+
+    def workers(self, tasks=None, worker_mb=WORKER_MB):
+        """Worker processes that fit both the thread cap and the memory budget (1 once over it)."""
+        if self.over_budget():
+            return 1
+        by_memory = max(1, self.memory_mb // worker_mb)
+        return max(1, min(self.threads, by_memory, tasks or self.threads))
+
+    def apply(self):
+        """Cap native thread pools for the rest of the run."""
+        limit_native_threads(self.threads)
+        return self
+
+    def over_budget(self):
+        """True if this process has already peaked above the memory budget."""
+        peak = peak_rss_mb()
+        return peak is not None and peak > self.memory_mb
+
+    def __repr__(self):
+        return f"{self.threads} threads, {self.memory_mb} MB budget, {self.chunk_rows:,} rows/chunk"
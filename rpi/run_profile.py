@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Opt-in CPU and allocation profiling for a pipeline run (--profile).
+
+start_profiling() runs the rest of the process under cProfile and tracemalloc
+and, when the process exits (normally, by sys.exit or Ctrl+C), writes two
+artifacts next to prediction.log (or into $PROFILE_DIR):
+  <name>-<timestamp>.prof        cProfile stats: python -m pstats <file>, or snakeviz
+  <name>-<timestamp>.alloc.txt   top allocation sites still held at exit, and the traced peak
+and logs a short hot-spot summary. Without the flag nothing here is imported,
+so normal runs pay nothing. Only the main thread is CPU-profiled.
+scripts/predict_sales.py imports this module; ml/predict.py, deployed on its
+own, carries a copy of start/finish_profiling that has to be kept in step.
+
+Usage:
+  python run_profile.py sales_prediction-20260211-143000.prof   # Print a saved profile
+"""
+
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+# Configuration
+SCRIPT_DIR = Path(__file__).parent
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', SCRIPT_DIR))
+TOP_FUNCTIONS = 10          # Functions in the logged summary, by own time
+TOP_ALLOCATIONS = 25        # Allocation sites in the .alloc.txt artifact (5 are logged)
+TRACE_FRAMES = 1            # Stack depth kept per allocation
+
+
+def start_profiling(name, directory=PROFILE_DIR, log=print):
+    """Profile the rest of this process; artifacts are written and summarized at exit."""
+    import atexit
+    import cProfile
+    import tracemalloc
+
+    tracemalloc.start(TRACE_FRAMES)
+    profiler = cProfile.Profile()
+    atexit.register(finish_profiling, profiler, name, Path(directory), log, time.perf_counter())
+    profiler.enable()
+    return profiler
+
+
+def hot_spots(stats, top=TOP_FUNCTIONS, within=None):
+    """
+    (own s, cumulative s, calls, 'file:line(function)') of the functions with
+    the most own time, or with `within` (a directory) the most cumulative time
+    among the functions defined there, i.e. the pipeline's own steps.
+    """
+    rows = [
+        (tt, ct, nc, f"{Path(file).name}:{line}({func})")
+        for (file, line, func), (cc, nc, tt, ct, callers) in stats.stats.items()
+        if within is None or Path(file).parent == within
+    ]
+    key = (lambda r: r[1]) if within is not None else (lambda r: r[0])
+    return sorted(rows, key=key, reverse=True)[:top]
+
+
+def finish_profiling(profiler, name, directory, log, started):
+    """Stop profiling, write the .prof and .alloc.txt artifacts and log the hot spots."""
+    import pstats
+    import tracemalloc
+
+    profiler.disable()
+    wall = time.perf_counter() - started
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    directory.mkdir(parents=True, exist_ok=True)
+    stem = directory / f"{name}-{datetime.now():%Y%m%d-%H%M%S}"
+    prof_path = stem.with_suffix('.prof')
+    alloc_path = stem.with_suffix('.alloc.txt')
+    profiler.dump_stats(prof_path)
+
+    allocations = snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+    with open(alloc_path, 'w') as f:
+        f.write(f"Traced peak: {peak / 2**20:.1f} MB\n")
+        f.write(f"Top {len(allocations)} allocation sites held at exit:\n")
+        for stat in allocations:
+            f.write(f"{stat}\n")
+
+    stats = pstats.Stats(profiler)
+    log(f"Profile: {wall:.2f}s wall, {stats.total_tt:.2f}s profiled CPU, {peak / 2**20:.1f} MB traced peak")
+    log(f"{'Own s':>8} {'Cum s':>8} {'Calls':>9}  Function")
+    for tt, ct, nc, func in hot_spots(stats):
+        log(f"{tt:8.3f} {ct:8.3f} {nc:9d}  {func}")
+    log("Slowest pipeline functions:")
+    for tt, ct, nc, func in hot_spots(stats, 5, Path(sys.argv[0]).resolve().parent):
+        log(f"{tt:8.3f} {ct:8.3f} {nc:9d}  {func}")
+    for stat in allocations[:5]:
+        log(f"Held at exit: {stat.size / 2**20:7.1f} MB  {stat.traceback[0]}")
+    log(f"Profile written to {prof_path} and {alloc_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print a saved run profile')
+    parser.add_argument('path', help='.prof file written by --profile')
+    parser.add_argument('--sort', default='tottime', help='pstats sort key (default: tottime)')
+    parser.add_argument('--top', type=int, default=30, help='Functions to print (default: 30)')
+    args = parser.parse_args()
+
+    import pstats
+    pstats.Stats(args.path, stream=sys.stdout).sort_stats(args.sort).print_stats(args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Dense machine x sales-day history of sold counts, memory-mapped from disk.
+
+Stored as a raw int32 file with one row per sales day and one column per machine
+(day-major: appending a day writes one row, and a trailing window is one
+contiguous slice), plus a JSON sidecar next to it:
+  {"version": 1, "start_date": "2025-10-01", "days": 120, "capacity": 192,
+   "devices": ["852001", ...], "first_day": [0, 14, ...]}
+
+Days without sales are 0. first_day is the row where each machine started
+reporting, so the days before it are not counted as zero-sale days.
+Sold counts are successful orders' num_dispensed, as in the per-machine models;
+event machines (feature_store.MACHINES_TO_DROP) are left out.
+ml/predict.py reads the same files through its history_path option.
+
+Usage:
+  python sales_matrix.py                                   # Sync from $DATABASE_URL
+  python sales_matrix.py --source orders.csv --path sales_matrix.i32
+"""
+
+import os
+import json
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+import data_sources
+from feature_store import MACHINES_TO_DROP, partial_daily, day_close, last_closed_day
+from resource_profile import ResourceProfile
+
+# Configuration
+SCRIPT_DIR = Path(__file__).parent
+MATRIX_PATH = Path(os.environ.get('SALES_MATRIX', SCRIPT_DIR / 'sales_matrix.i32'))
+MATRIX_VERSION = 1
+GROW_DAYS = 64      # Rows reserved per file extension, so most appends do not resize
+
+
+class SalesMatrix:
+    """Machine x day sold counts backed by a memory-mapped int32 file."""
+
+    def __init__(self, path=MATRIX_PATH):
+        self.path = Path(path)
+        self.meta_path = self.path.with_suffix('.json')
+        self.meta = json.loads(self.meta_path.read_text()) if self.meta_path.exists() else None
+
+    @property
+    def days(self):
+        return self.meta['days'] if self.meta else 0
+
+    @property
+    def devices(self):
+        return self.meta['devices'] if self.meta else []
+
+    @property
+    def start_date(self):
+        return pd.Timestamp(self.meta['start_date'])
+
+    @property
+    def end_date(self):
+        """Label of the last stored sales day."""
+        return self.start_date + timedelta(days=self.days - 1)
+
+    def _map(self, mode='r'):
+        shape = (self.meta['capacity'], len(self.devices))
+        return np.memmap(self.path, dtype=np.int32, mode=mode, shape=shape)
+
+    def sold(self):
+        """Read-only (days x machines) view of every stored day."""
+        return self._map()[:self.days]
+
+    def window(self, days, end=None):
+        """Trailing (days x machines) slice ending at row `end` (default: the last day)."""
+        end = self.days - 1 if end is None else end
+        return self.sold()[max(0, end - days + 1):end + 1]
+
+    def _write_meta(self):
+        tmp = self.meta_path.with_name(self.meta_path.name + '.tmp')
+        tmp.write_text(json.dumps(self.meta))
+        os.replace(tmp, self.meta_path)
+
+    def _write_new(self, start_date, devices, first_day, sold):
+        """Write a fresh file holding `sold` (days x machines) plus spare rows."""
+        capacity = len(sold) + GROW_DAYS
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        out = np.memmap(tmp, dtype=np.int32, mode='w+', shape=(capacity, len(devices)))
+        out[:len(sold)] = sold
+        out.flush()
+        del out
+        os.replace(tmp, self.path)
+
+        self.meta = {
+            'version': MATRIX_VERSION,
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'days': len(sold),
+            'capacity': capacity,
+            'devices': devices,
+            'first_day': first_day,
+        }
+        self._write_meta()
+
+    def append(self, df_daily):
+        """
+        Add days after end_date from a long (device_id, date, sold) frame.
+        Skipped days become zero rows. New machines add a column, which rewrites
+        the file; everything else only writes the new rows.
+        Returns the number of days added.
+        """
+        df_daily = df_daily.assign(date=pd.to_datetime(df_daily['date']), device_id=df_daily['device_id'].astype(str))
+        if self.meta is not None:
+            df_daily = df_daily[df_daily['date'] > self.end_date]
+        if df_daily.empty:
+            return 0
+
+        start = self.start_date if self.meta else df_daily['date'].min()
+        first_new = self.days
+        n_days = (df_daily['date'].max() - start).days + 1
+
+        devices = list(self.devices)
+        device_index = {d: i for i, d in enumerate(devices)}
+        for d in sorted(set(df_daily['device_id']) - set(device_index)):
+            device_index[d] = len(devices)
+            devices.append(d)
+
+        rows = (df_daily['date'] - start).dt.days.values
+        cols = df_daily['device_id'].map(device_index).values
+        block = np.zeros((n_days - first_new, len(devices)), dtype=np.int32)
+        np.add.at(block, (rows - first_new, cols), df_daily['sold'].values.astype(np.int32))
+
+        first_day = list(self.meta['first_day']) if self.meta else []
+        seen = pd.Series(rows, index=cols).groupby(level=0).min()
+        first_day += [int(seen[i]) for i in range(len(first_day), len(devices))]
+
+        if self.meta is None or len(devices) > len(self.devices):
+            old = self.sold() if self.meta else np.zeros((0, 0), dtype=np.int32)
+            sold = np.zeros((n_days, len(devices)), dtype=np.int32)
+            sold[:old.shape[0], :old.shape[1]] = old
+            sold[first_new:] = block
+            self._write_new(start, devices, first_day, sold)
+            return len(block)
+
+        if n_days > self.meta['capacity']:
+            self.meta['capacity'] = n_days + GROW_DAYS
+            with open(self.path, 'r+b') as f:
+                f.truncate(self.meta['capacity'] * len(devices) * 4)
+
+        out = self._map('r+')
+        out[first_new:n_days] = block
+        out.flush()
+        del out
+
+        self.meta['days'] = n_days
+        self._write_meta()
+        return len(block)
+
+    def sync(self, source=None, through=None, profile=None):
+        """
+        Append every sales day closed up to `through` (a date, default: the
+        last closed day) from an orders source. Returns the number of days added.
+        """
+        profile = profile or ResourceProfile()
+        through = min(through or last_closed_day(), last_closed_day())
+        start = None
+        if self.meta is not None:
+            if self.end_date.date() >= through:
+                return 0
+            start = day_close(self.end_date.date())
+
+        partials = []
+        for chunk in data_sources.iter_orders(source, start, day_close(through), profile.chunk_rows):
+            chunk = chunk[~chunk['machine_sn'].isin(MACHINES_TO_DROP)]
+            if not chunk.empty:
+                partials.append(partial_daily(chunk)[['machine_sn', 'date', 'daily_sales']])
+        added = 0
+        if partials:
+            df_daily = pd.concat(partials).groupby(['machine_sn', 'date'], as_index=False)['daily_sales'].sum()
+            df_daily = df_daily.rename(columns={'machine_sn': 'device_id', 'daily_sales': 'sold'})
+            added = self.append(df_daily)
+
+        # On the live database, closed days with no orders at all still get a
+        # (zero) row; a snapshot simply ends at its last order
+        if self.meta is not None and data_sources.is_database_source(data_sources.resolve_source(source)):
+            last = pd.Timestamp(through)
+            if last > self.end_date:
+                added += self.append(pd.DataFrame({'device_id': [self.devices[0]], 'date': [last], 'sold': [0]}))
+        return added
+
+    def to_long(self, devices=None):
+        """
+        Long (device_id, date, sold) frame of every machine-day from each
+        machine's first_day on, optionally limited to some devices.
+        """
+        sold = self.sold()
+        first_day = np.array(self.meta['first_day'])
+        cols = np.arange(len(self.devices))
+        if devices is not None:
+            wanted = set(map(str, devices))
+            cols = np.array([i for i, d in enumerate(self.devices) if d in wanted], dtype=int)
+
+        day_idx, col_idx = np.nonzero(np.arange(self.days)[:, None] >= first_day[cols][None, :])
+        return pd.DataFrame({
+            'device_id': np.array(self.devices, dtype=object)[cols[col_idx]],
+            'date': self.start_date + pd.to_timedelta(day_idx, unit='D'),
+            'sold': sold[day_idx, cols[col_idx]],
+        }).sort_values(['device_id', 'date']).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync the machine x day sales matrix')
+    parser.add_argument('--source', help='Orders source (default: $ORDERS_SOURCE or $DATABASE_URL)')
+    parser.add_argument('--path', default=str(MATRIX_PATH), help=f'Matrix file (default: {MATRIX_PATH})')
+    parser.add_argument('--through', type=str, help='Last sales day to add (YYYY-MM-DD)')
+    args = parser.parse_args()
+
+    through = datetime.strptime(args.through, '%Y-%m-%d').date() if args.through else None
+    matrix = SalesMatrix(args.path)
+    added = matrix.sync(args.source, through)
+
+    print(f"Added {added} day(s) to {matrix.path}")
+    if matrix.meta:
+        size_kb = matrix.path.stat().st_size / 1024
+        print(f"{len(matrix.devices)} machines x {matrix.days} days "
+              f"({matrix.start_date.date()} to {matrix.end_date.date()}, {size_kb:.1f} KB)")
+
+
+if __name__ == "__main__":
+    main()
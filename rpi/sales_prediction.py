@@ -6,26 +6,38 @@ Runs daily at 22:30 SGT via cron or systemd timer.
 
 Usage:
   python sales_prediction.py           # Run once
-  python sales_prediction.py --daemon  # Run as daemon with scheduler
+  python sales_prediction.py --daemon  # Run as daemon with scheduler (+ hourly nowcast)
+  python sales_prediction.py --nowcast # Re-estimate today's total from partial sales
+  python sales_prediction.py --backfill 2026-01-01 2026-02-01  # Regenerate past predictions
+  python sales_prediction.py --groups  # Per-group forecasts (snapshots: --groups-file groups.csv)
+  python sales_prediction.py --source orders.parquet --as-of 2026-02-11  # Replay from a snapshot
+
+Add --profile to any run for a CPU profile and allocation snapshot (see run_profile.py).
+Set PIPELINE_THREADS / PIPELINE_MEMORY_MB to cap CPU threads and memory (see resource_profile.py).
+The model is retrained in the background only when its rolling error or input
+drift crosses RETRAIN_MAPE / RETRAIN_DRIFT (see model_health.py).
+Candidate models in SHADOW_MODELS (or --shadow a.joblib,b.joblib) score the same
+feature matrix after the prediction is saved; their outputs go in "shadowPredictions".
 """
 
 import os
 import sys
+import json
 import warnings
 import argparse
 import logging
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 warnings.filterwarnings('ignore')
 
-import pandas as pd
-import numpy as np
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import joblib
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import OneHotEncoder
+# pandas, numpy, psycopg2, joblib and sklearn (and the pipeline modules that
+# pull them in) are imported inside the functions that use them, so --help,
+# the idle daemon and nowcast runs do not pay for loading a model stack.
+from resource_profile import ResourceProfile, peak_rss_mb
 
 # Setup logging
 logging.basicConfig(
@@ -43,77 +55,63 @@ DATABASE_URL = os.environ.get('DATABASE_URL')
 SCRIPT_DIR = Path(__file__).parent
 MODEL_PATH = SCRIPT_DIR / 'sales_model.joblib'
 ENCODER_PATH = SCRIPT_DIR / 'encoder.joblib'
+MODEL_META_PATH = SCRIPT_DIR / 'sales_model.json'     # Training reference stats (model_health.py)
+GROUP_MODEL_PATH = SCRIPT_DIR / 'group_model.joblib'
+
+# Candidate models scored alongside the production model (comma-separated paths,
+# e.g. from train_model.py --output); keyed by file name in "shadowPredictions"
+SHADOW_MODELS = [p.strip() for p in os.environ.get('SHADOW_MODELS', '').split(',') if p.strip()]
 
 # Devices to exclude from prediction (event machines)
 MACHINES_TO_DROP = ['852298', '852308', '852309', '852311']
 
-# Feature windows
-WINDOWS = [3, 7, 14]
+# Model columns
 TARGET_COL = 'daily_sales'
 MACHINE_COL = 'machine_sn'
 
+# Intraday nowcast
+NOWCAST_MINUTE = 5                      # Run at :05 past every hour (UTC)
+NOWCAST_PROFILE_DAYS = 14               # Completed days kept for the hourly profile
+NOWCAST_STATE_PATH = Path(os.environ.get('NOWCAST_STATE', SCRIPT_DIR / 'nowcast_state.npz'))
+NOWCAST_OVERLAP = timedelta(hours=1)    # Re-read window for late order uploads
+DAY_OFFSET = timedelta(hours=14, minutes=30)
+
+# CPU threads and memory budget ($PIPELINE_THREADS, $PIPELINE_MEMORY_MB)
+PROFILE = ResourceProfile()
+
+# Machine x day sales history kept up to date by the nightly run (optional)
+SALES_MATRIX_PATH = os.environ.get('SALES_MATRIX')
+
+# Per-machine hour-of-day demand profiles kept up to date by the nightly run (optional)
+HOURLY_PROFILE_PATH = os.environ.get('HOURLY_PROFILE')
+
+# Per-group forecasts: GROUP_FORECASTS=1 schedules them in the daemon after the
+# fleet run; snapshot sources read membership from a CSV ($DEVICE_GROUPS)
+GROUP_FORECASTS = os.environ.get('GROUP_FORECASTS', '').lower() in ('1', 'true', 'yes')
+DEVICE_GROUPS_PATH = os.environ.get('DEVICE_GROUPS')
+GROUP_MINUTE = 45                       # 14:45 UTC, after the fleet prediction
+GROUP_CONTEXT_DAYS = 28                 # Days of orders read to predict with a trained group model
+
 
 def get_db_connection():
     """Create database connection from DATABASE_URL."""
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
     if not DATABASE_URL:
         raise ValueError("DATABASE_URL environment variable is not set")
     return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
 
 
-def fetch_orders(days=30):
-    """
-    Fetch orders from the last N days.
-    Daily window: 10:30 PM SGT to 10:29 PM SGT next day.
-    """
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    # Fetch orders from last N days
-    # Using 10:30 PM SGT (14:30 UTC) as the day boundary
-    query = """
-        SELECT
-            "orderId",
-            "deviceId" as machine_sn,
-            "deviceName",
-            "createdAt" as log_datetime,
-            "isSuccess" as operation_outcome,
-            "payWay" as payment_mode,
-            "payAmount" as transaction_amount,
-            "quantity" as order_amt,
-            "deliverCount" as num_dispensed,
-            "refundAmount" as refund_amount
-        FROM "Order"
-        WHERE "createdAt" >= (CURRENT_DATE - INTERVAL '%s days' + TIME '14:30:00')
-          AND "createdAt" < (CURRENT_DATE + TIME '14:30:00')
-        ORDER BY "createdAt" ASC
-    """
-    cur.execute(query, (days,))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-
-    return pd.DataFrame(rows)
-
-
 def format_orders(df):
     """Format orders from DB to match model's expected input."""
+    import data_sources
+
     if df.empty:
         return df
 
-    # Convert types
-    df['log_datetime'] = pd.to_datetime(df['log_datetime'])
-    df['machine_sn'] = df['machine_sn'].astype(str)
-
-    # Map isSuccess (boolean) to operation_outcome
-    df['operation_outcome'] = df['operation_outcome'].map({True: 'Success', False: 'Failed'})
-
-    # Fill missing values
-    df['num_dispensed'] = df['num_dispensed'].fillna(0).astype(int)
-    df['transaction_amount'] = df['transaction_amount'].fillna(0)
-    df['refund_amount'] = df['refund_amount'].fillna(0)
-
-    # Add error_code as 0 (not available in our DB)
-    df['error_code'] = 0
+    # Convert types, map isSuccess to operation_outcome, fill missing values
+    df = data_sources.normalize_orders(df)
 
     # Filter out event machines
     df = df[~df['machine_sn'].isin(MACHINES_TO_DROP)]
@@ -121,63 +119,24 @@ def format_orders(df):
     return df
 
 
-def aggregate_daily(df):
+def load_features(source, through=None):
     """
-    Aggregate orders to TOTAL daily level (all machines combined).
-    Daily window: 10:30 PM SGT Day X to 10:29 PM SGT Day X+1 -> labeled as Day X+1.
-    Example: Jan 10 10:30 PM to Jan 11 10:29 PM SGT = "Jan 11 sales"
+    Bring the daily feature store up to date from the orders source and
+    return its rows up to `through` (a date, default: all closed days).
     """
-    # Shift time and label by END date of the window
-    df['adjusted_datetime'] = df['log_datetime'] - pd.Timedelta(hours=14, minutes=30)
-    df['date'] = pd.to_datetime(df['adjusted_datetime'].dt.date) + pd.Timedelta(days=1)
-
-    # Aggregate ALL machines together per day
-    df_agg = df.groupby(['date']).agg(
-        daily_sales=('num_dispensed', 'sum'),
-        transactions=('num_dispensed', 'count'),
-        total_amount=('transaction_amount', 'sum'),
-        error_count=('error_code', lambda x: (x != 0).sum()),
-        total_refund=('refund_amount', 'sum'),
-        active_machines=('machine_sn', 'nunique')
-    ).reset_index()
-
-    return df_agg
-
+    from feature_store import FeatureStore
 
-def create_features(df_agg):
-    """Create features for the model (total sales level)."""
-    df_features = df_agg.copy()
-
-    df_features['date'] = pd.to_datetime(df_features['date'])
-    df_features['day'] = df_features['date'].dt.day
-    df_features['weekday'] = df_features['date'].dt.weekday
-    df_features['month'] = df_features['date'].dt.month
-    df_features['is_weekend'] = (df_features['weekday'] >= 5).astype(int)
-
-    # Rolling statistics (total level, no groupby)
-    for w in WINDOWS:
-        df_features[f'rolling_mean_{w}'] = df_features[TARGET_COL].rolling(window=w, min_periods=1).mean()
-        df_features[f'rolling_std_{w}'] = df_features[TARGET_COL].rolling(window=w, min_periods=1).std().fillna(0)
-
-    # Lag features
-    for lag in [1, 7]:
-        df_features[f'lag_{lag}'] = df_features[TARGET_COL].shift(lag)
-
-    # Error rate
-    df_features['error_rate'] = df_features['error_count'] / df_features['transactions'].replace(0, np.nan)
-    df_features['error_rate'] = df_features['error_rate'].fillna(0)
-
-    # Fill NA lags with 0
-    lag_cols = [c for c in df_features.columns if c.startswith('lag_')]
-    df_features[lag_cols] = df_features[lag_cols].fillna(0)
-
-    df_features = df_features.sort_values('date')
-
-    return df_features
+    store = FeatureStore(source, profile=PROFILE)
+    added = store.sync(through)
+    if added:
+        logger.info(f"Added {added} closed day(s) to the feature store")
+    return store.read(end=through)
 
 
 def prepare_features(df, encoder=None):
     """Prepare feature matrix for prediction."""
+    import numpy as np
+
     CATEGORICALS = ['weekday', 'month']
     exclude_cols = [MACHINE_COL, 'date', TARGET_COL, 'devicename']
     feature_cols = [c for c in df.columns if c not in exclude_cols and c.lower() not in ['devicename']]
@@ -188,6 +147,7 @@ def prepare_features(df, encoder=None):
 
     # One-hot encode categoricals
     if encoder is None:
+        from sklearn.preprocessing import OneHotEncoder
         encoder = OneHotEncoder(sparse_output=False, handle_unknown='ignore')
         encoder.fit(df[CATEGORICALS])
 
@@ -200,7 +160,11 @@ def prepare_features(df, encoder=None):
 
 def train_model(df_features):
     """Train a new model on the available data."""
-    logger.info("Training new model...")
+    import joblib
+    from model_engines import DEFAULT_ENGINE, make_model
+    from model_health import save_reference
+
+    logger.info(f"Training new {DEFAULT_ENGINE} model...")
 
     # Remove rows with NaN target
     df_train = df_features[~df_features[TARGET_COL].isnull()].copy()
@@ -208,15 +172,19 @@ def train_model(df_features):
     if len(df_train) < 50:
         logger.warning(f"Only {len(df_train)} samples available for training")
 
-    X, encoder, _ = prepare_features(df_train)
+    X, encoder, feature_cols = prepare_features(df_train)
     y = df_train[TARGET_COL].values
 
-    model = RandomForestRegressor(n_estimators=200, random_state=42, n_jobs=-1)
+    model = make_model(DEFAULT_ENGINE, n_jobs=PROFILE.threads)
     model.fit(X, y)
 
-    # Save model and encoder
-    joblib.dump(model, MODEL_PATH)
-    joblib.dump(encoder, ENCODER_PATH)
+    # Save model and encoder; replaced atomically, since a background retrain
+    # may finish while another run is loading them
+    for obj, path in ((model, MODEL_PATH), (encoder, ENCODER_PATH)):
+        tmp = path.with_name(path.name + '.tmp')
+        joblib.dump(obj, tmp)
+        os.replace(tmp, path)
+    save_reference(MODEL_META_PATH, df_train, feature_cols)
 
     logger.info(f"Model saved to {MODEL_PATH}")
     return model, encoder
@@ -224,42 +192,103 @@ def train_model(df_features):
 
 def load_model():
     """Load existing model or return None."""
+    import joblib
+
     if MODEL_PATH.exists() and ENCODER_PATH.exists():
         model = joblib.load(MODEL_PATH)
         encoder = joblib.load(ENCODER_PATH)
+        # Models are saved with the trainer's n_jobs; predict within this host's cap
+        if hasattr(model, 'n_jobs'):
+            model.n_jobs = PROFILE.threads
         logger.info("Loaded existing model")
         return model, encoder
     return None, None
 
 
-def generate_predictions(df_features, model, encoder):
-    """Generate prediction for the next day (total sales level)."""
-    # Get the last row (most recent day's data)
-    last_row = df_features.sort_values('date').iloc[[-1]].copy()
+def pack_forest(model):
+    """
+    Flatten the leaf values of every tree in a fitted forest into one array.
+    Returns (values, offsets) where tree i's node n is values[offsets[i] + n].
+    """
+    import numpy as np
+
+    estimators = getattr(model, 'estimators_', None)
+    if not isinstance(estimators, list) or not hasattr(estimators[0], 'tree_'):
+        raise ValueError("Quantiles need a random forest model")
+
+    trees = [est.tree_ for est in estimators]
+    offsets = np.cumsum([0] + [t.node_count for t in trees[:-1]])
+    values = np.concatenate([t.value[:, 0, 0] for t in trees])
+    return values, offsets
 
-    # Use current values as lag placeholders for next day prediction
-    for lag in [1, 7]:
-        last_row[f'lag_{lag}'] = last_row[TARGET_COL].values[0]
 
-    # Increment date features for next day
-    next_date = last_row['date'].iloc[0] + timedelta(days=1)
-    last_row['day'] = next_date.day
-    last_row['weekday'] = next_date.weekday()
-    last_row['month'] = next_date.month
-    last_row['is_weekend'] = 1 if next_date.weekday() >= 5 else 0
+def forest_tree_predictions(model, X):
+    """Per-tree predictions as a (trees x rows) array from one batched apply()."""
+    values, offsets = pack_forest(model)
+    return values[model.apply(X) + offsets].T
+
+
+def quantile_key(q):
+    """Label for a quantile, e.g. 0.9 -> 'p90'."""
+    return f"p{q * 100:g}"
+
+
+def next_day_matrix(rows, encoder):
+    """Roll each feature row forward to the next day and build the model matrix for it."""
+    from feature_store import next_day_features
+
+    rows = next_day_features(rows)
+    X, _, _ = prepare_features(rows, encoder)
+    return rows, X
+
+
+def predict_next_days(rows, model, encoder, quantiles=None):
+    """
+    Predict the day after each feature row, all in one matrix call.
+    Every row is treated as the most recent day, exactly as the nightly run does.
+    With quantiles (e.g. [0.1, 0.9]) also adds predicted_p10/predicted_p90 columns
+    taken from the spread of the forest's trees (forest engine only).
+    """
+    rows, X = next_day_matrix(rows, encoder)
+    return predict_matrix(rows, X, model, quantiles)
 
-    # Prepare features and predict
-    X, _, _ = prepare_features(last_row, encoder)
-    prediction = model.predict(X)[0]
 
-    last_row['predicted_sales'] = prediction
-    last_row['prediction_date'] = next_date
+def predict_matrix(rows, X, model, quantiles=None):
+    """predict_next_days() on rows already rolled forward, with their matrix X."""
+    import numpy as np
+    from model_engines import supports_quantiles
 
-    return last_row
+    next_dates = rows['date'] + timedelta(days=1)
+
+    if quantiles and not supports_quantiles(model):
+        logger.warning(f"{type(model).__name__} has no per-tree spread, skipping quantiles")
+        quantiles = None
+
+    if quantiles:
+        per_tree = forest_tree_predictions(model, X)
+        predictions = per_tree.mean(axis=0)
+        for q, values in zip(quantiles, np.quantile(per_tree, quantiles, axis=0)):
+            rows[f'predicted_{quantile_key(q)}'] = values
+    else:
+        predictions = model.predict(X)
+
+    rows['predicted_sales'] = predictions
+    rows['prediction_date'] = next_dates
+
+    return rows
+
+
+def generate_predictions(df_features, model, encoder, quantiles=None):
+    """Generate prediction for the next day (total sales level)."""
+    # Get the last row (most recent day's data)
+    last_row = df_features.sort_values('date').iloc[[-1]]
+    return predict_next_days(last_row, model, encoder, quantiles)
 
 
 def save_predictions(prediction_row):
     """Save total prediction to database."""
+    import pandas as pd
+
     conn = get_db_connection()
     cur = conn.cursor()
 
@@ -267,24 +296,32 @@ def save_predictions(prediction_row):
     predicted_sales = float(prediction_row['predicted_sales'].iloc[0])
     rolling_mean_7 = float(prediction_row.get('rolling_mean_7', pd.Series([0])).iloc[0])
     rolling_mean_14 = float(prediction_row.get('rolling_mean_14', pd.Series([0])).iloc[0])
+    quantiles = {
+        c[len('predicted_'):]: float(prediction_row[c].iloc[0])
+        for c in prediction_row.columns if c.startswith('predicted_p')
+    }
 
     query = """
         INSERT INTO "SalesPrediction" (
             id, "predictionDate", "predictedSales",
-            "rollingMean7", "rollingMean14",
+            "rollingMean7", "rollingMean14", "predictedQuantiles",
             "createdAt", "updatedAt"
         )
         VALUES (
-            gen_random_uuid()::text, %s, %s, %s, %s, NOW(), NOW()
+            gen_random_uuid()::text, %s, %s, %s, %s, %s::jsonb, NOW(), NOW()
         )
         ON CONFLICT ("predictionDate")
         DO UPDATE SET
             "predictedSales" = EXCLUDED."predictedSales",
             "rollingMean7" = EXCLUDED."rollingMean7",
             "rollingMean14" = EXCLUDED."rollingMean14",
+            "predictedQuantiles" = EXCLUDED."predictedQuantiles",
             "updatedAt" = NOW()
     """
-    cur.execute(query, (prediction_date, predicted_sales, rolling_mean_7, rolling_mean_14))
+    cur.execute(query, (
+        prediction_date, predicted_sales, rolling_mean_7, rolling_mean_14,
+        json.dumps(quantiles) if quantiles else None
+    ))
 
     conn.commit()
     cur.close()
@@ -293,6 +330,72 @@ def save_predictions(prediction_row):
     logger.info(f"Saved prediction for {prediction_date.date()}: {predicted_sales:.1f} sales")
 
 
+def save_predictions_bulk(prediction_rows):
+    """
+    Save many predictions in one transaction: all rows go into a temp table via
+    execute_values, then a single INSERT ... ON CONFLICT merges them.
+    """
+    from psycopg2.extras import execute_values
+
+    quantile_cols = [c for c in prediction_rows.columns if c.startswith('predicted_p')]
+    records = []
+    for _, row in prediction_rows.iterrows():
+        quantiles = {c[len('predicted_'):]: float(row[c]) for c in quantile_cols}
+        records.append((
+            row['prediction_date'].to_pydatetime(),
+            float(row['predicted_sales']),
+            float(row.get('rolling_mean_7', 0)),
+            float(row.get('rolling_mean_14', 0)),
+            json.dumps(quantiles) if quantiles else None,
+        ))
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    cur.execute("""
+        CREATE TEMP TABLE sales_prediction_stage (
+            "predictionDate" timestamp(3),
+            "predictedSales" double precision,
+            "rollingMean7" double precision,
+            "rollingMean14" double precision,
+            "predictedQuantiles" jsonb
+        ) ON COMMIT DROP
+    """)
+    execute_values(
+        cur,
+        'INSERT INTO sales_prediction_stage VALUES %s',
+        records,
+        template='(%s, %s, %s, %s, %s::jsonb)',
+        page_size=1000
+    )
+    cur.execute("""
+        INSERT INTO "SalesPrediction" (
+            id, "predictionDate", "predictedSales",
+            "rollingMean7", "rollingMean14", "predictedQuantiles",
+            "createdAt", "updatedAt"
+        )
+        SELECT
+            gen_random_uuid()::text, "predictionDate", "predictedSales",
+            "rollingMean7", "rollingMean14", "predictedQuantiles",
+            NOW(), NOW()
+        FROM sales_prediction_stage
+        ON CONFLICT ("predictionDate")
+        DO UPDATE SET
+            "predictedSales" = EXCLUDED."predictedSales",
+            "rollingMean7" = EXCLUDED."rollingMean7",
+            "rollingMean14" = EXCLUDED."rollingMean14",
+            "predictedQuantiles" = EXCLUDED."predictedQuantiles",
+            "updatedAt" = NOW()
+    """)
+    saved = cur.rowcount
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    logger.info(f"Saved {saved} predictions in one transaction")
+
+
 def update_actual_sales():
     """Update actual sales for past predictions (for accuracy tracking)."""
     conn = get_db_connection()
@@ -324,50 +427,214 @@ def update_actual_sales():
     logger.info(f"Updated {updated} predictions with actual sales")
 
 
-def run_prediction():
-    """Main prediction routine."""
+def fetch_prediction_errors(days):
+    """The last `days` reconciled predictions as (prediction_date, predicted, actual) rows."""
+    import pandas as pd
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT "predictionDate" AS prediction_date, "predictedSales" AS predicted, "actualSales" AS actual
+        FROM "SalesPrediction"
+        WHERE "actualSales" IS NOT NULL
+        ORDER BY "predictionDate" DESC
+        LIMIT %s
+    """, (days,))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+
+    errors = pd.DataFrame(rows, columns=['prediction_date', 'predicted', 'actual'])
+    errors['prediction_date'] = pd.to_datetime(errors['prediction_date']).dt.tz_localize(None).dt.normalize()
+    return errors
+
+
+def replay_prediction_errors(df_features, model, encoder, days):
+    """
+    What fetch_prediction_errors would hold for a snapshot: the model's
+    predictions for the last `days` days, each from the day before, next to the actuals.
+    """
+    import pandas as pd
+
+    rows = df_features.sort_values('date').tail(days + 1)
+    predicted = predict_next_days(rows.iloc[:-1], model, encoder)
+    actual = rows.set_index('date')[TARGET_COL].reindex(predicted['prediction_date'])
+    return pd.DataFrame({
+        'prediction_date': predicted['prediction_date'].values,
+        'predicted': predicted['predicted_sales'].values,
+        'actual': actual.values,
+    }).dropna()
+
+
+def check_model_health(df_features, model, encoder, write_back):
+    """Rolling accuracy and input drift of the current model (see model_health.check)."""
+    from model_health import ERROR_DAYS, check, load_reference
+
+    _, _, feature_cols = prepare_features(df_features.tail(1).copy(), encoder)
+    reference = load_reference(MODEL_META_PATH, MODEL_PATH, df_features, feature_cols, persist=write_back)
+    if write_back:
+        errors = fetch_prediction_errors(ERROR_DAYS)
+    else:
+        errors = replay_prediction_errors(df_features, model, encoder, ERROR_DAYS)
+    return check(reference, errors, df_features)
+
+
+# Background retrain started by run_prediction, if one is running
+_retrain_thread = None
+
+
+def retrain_in_background(df_features, report):
+    """
+    Retrain on `df_features` in a background thread and record why and how long
+    it took. Not a daemon thread: a one-shot cron run exits once it has finished.
+    """
+    global _retrain_thread
+    if _retrain_thread is not None and _retrain_thread.is_alive():
+        logger.info("A retrain is already running, not starting another")
+        return None
+
+    def retrain():
+        from model_health import record_retrain
+
+        started_at = datetime.now(timezone.utc)
+        start = time.perf_counter()
+        try:
+            train_model(df_features)
+            status = 'ok'
+        except Exception as e:
+            logger.error(f"Background retrain failed: {e}", exc_info=True)
+            status = 'failed'
+        entry = record_retrain(report, started_at, time.perf_counter() - start, len(df_features), status)
+        logger.info(f"Background retrain {status} in {entry['duration_s']:.1f}s")
+
+    _retrain_thread = threading.Thread(target=retrain, name='retrain', daemon=False)
+    _retrain_thread.start()
+    return _retrain_thread
+
+
+def score_shadow_models(paths, X):
+    """
+    Score the production feature matrix X (one row) with each candidate model.
+    Returns {name: prediction}, name being the file's stem. A candidate that
+    fails to load or expects a different matrix is logged and left out.
+    """
+    import joblib
+
+    shadow = {}
+    for path in paths:
+        name = Path(path).stem
+        try:
+            model = joblib.load(path)
+            expected = getattr(model, 'n_features_in_', X.shape[1])
+            if expected != X.shape[1]:
+                logger.warning(f"Shadow model {name} expects {expected} features, "
+                               f"the production matrix has {X.shape[1]}; skipping")
+                continue
+            if hasattr(model, 'n_jobs'):
+                model.n_jobs = PROFILE.threads
+            shadow[name] = float(model.predict(X)[0])
+        except Exception as e:
+            logger.warning(f"Shadow model {name} failed: {e}")
+    return shadow
+
+
+def save_shadow_predictions(prediction_date, shadow):
+    """Store shadow model outputs on the already saved prediction row."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE "SalesPrediction"
+        SET "shadowPredictions" = %s::jsonb, "updatedAt" = NOW()
+        WHERE "predictionDate" = %s
+    """, (json.dumps(shadow), prediction_date))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    logger.info(f"Saved {len(shadow)} shadow prediction(s) for {prediction_date.date()}")
+
+
+def run_prediction(source=None, as_of=None, quantiles=None, shadow_models=None):
+    """
+    Main prediction routine.
+    With a snapshot source, the run is replayed locally and nothing is written back.
+    shadow_models (default: SHADOW_MODELS) are candidate model files scored on
+    the same feature matrix once the production prediction is saved.
+    """
+    import data_sources
+
     logger.info(f"Starting sales prediction at {datetime.now()}")
     logger.info("-" * 50)
 
     try:
-        # Step 1: Fetch orders
-        logger.info("Fetching orders from database...")
-        orders_df = fetch_orders(days=30)
-        logger.info(f"Fetched {len(orders_df)} orders")
+        source = data_sources.resolve_source(source)
+        write_back = data_sources.is_database_source(source)
 
-        if orders_df.empty:
+        # Step 1: Sync the daily feature store and read it
+        logger.info(f"Loading daily features from {data_sources.source_kind(source)}...")
+        df_features = load_features(source, as_of)
+        logger.info(f"Loaded {len(df_features)} days of features")
+
+        if df_features.empty:
             logger.warning("No orders found. Exiting.")
             return False
 
-        # Step 2: Format orders
-        logger.info("Formatting orders...")
-        orders_df = format_orders(orders_df)
-
-        # Step 3: Aggregate daily (total level)
-        logger.info("Aggregating to daily total...")
-        df_agg = aggregate_daily(orders_df)
-        logger.info(f"Aggregated to {len(df_agg)} days")
-
-        # Step 4: Create features
-        logger.info("Creating features...")
-        df_features = create_features(df_agg)
-
-        # Step 5: Load or train model
+        # Step 2: Load or train model
         model, encoder = load_model()
         if model is None:
             model, encoder = train_model(df_features)
 
-        # Step 6: Generate prediction
+        # Step 3: Generate prediction; the matrix is kept for the shadow models
         logger.info("Generating prediction...")
-        prediction_row = generate_predictions(df_features, model, encoder)
-
-        # Step 7: Save prediction
-        logger.info("Saving prediction to database...")
-        save_predictions(prediction_row)
-
-        # Step 8: Update actual sales for past predictions
-        logger.info("Updating actual sales for past predictions...")
-        update_actual_sales()
+        rows, X = next_day_matrix(df_features.sort_values('date').iloc[[-1]], encoder)
+        prediction_row = predict_matrix(rows, X, model, quantiles)
+
+        if write_back:
+            # Step 4: Save prediction
+            logger.info("Saving prediction to database...")
+            save_predictions(prediction_row)
+
+            # Step 5: Update actual sales for past predictions
+            logger.info("Updating actual sales for past predictions...")
+            update_actual_sales()
+
+            # Step 6: Append the closed day to the machine x day history
+            if SALES_MATRIX_PATH:
+                from sales_matrix import SalesMatrix
+                added = SalesMatrix(SALES_MATRIX_PATH).sync(source, as_of, PROFILE)
+                logger.info(f"Added {added} day(s) to sales matrix {SALES_MATRIX_PATH}")
+
+            # Step 7: Add the closed day's orders to the hour-of-day profiles
+            if HOURLY_PROFILE_PATH:
+                from hourly_profile import HourlyProfile
+                added = HourlyProfile(HOURLY_PROFILE_PATH).sync(source, as_of, PROFILE)
+                logger.info(f"Added {added} day(s) to hourly profiles {HOURLY_PROFILE_PATH}")
+
+        # Step 8: Score the candidate models on the same matrix, after the production writes
+        shadow_models = SHADOW_MODELS if shadow_models is None else shadow_models
+        shadow = {}
+        if shadow_models:
+            shadow = score_shadow_models(shadow_models, X)
+            if write_back and shadow:
+                try:
+                    save_shadow_predictions(prediction_row['prediction_date'].iloc[0], shadow)
+                except Exception as e:
+                    logger.warning(f"Saving shadow predictions failed: {e}")
+
+        # Step 9: Retrain in the background if accuracy or input drift calls for it
+        try:
+            from model_health import describe
+            report = check_model_health(df_features, model, encoder, write_back)
+            logger.info(f"Model health: {describe(report)}")
+            if report['reasons']:
+                logger.info(f"Retrain needed: {'; '.join(report['reasons'])}")
+                if write_back:
+                    retrain_in_background(df_features, report)
+        except Exception as e:
+            logger.warning(f"Model health check failed: {e}")
+
+        if not write_back:
+            logger.info("Snapshot source, skipping database writes and retraining")
 
         logger.info("-" * 50)
         logger.info("Prediction complete!")
@@ -376,8 +643,17 @@ def run_prediction():
         logger.info("\nPrediction Summary:")
         logger.info(f"  Date: {prediction_row['prediction_date'].iloc[0].date()}")
         logger.info(f"  Predicted Sales: {prediction_row['predicted_sales'].iloc[0]:.1f}")
+        for col in prediction_row.columns:
+            if col.startswith('predicted_p'):
+                logger.info(f"  {col[len('predicted_'):].upper()}: {prediction_row[col].iloc[0]:.1f}")
         logger.info(f"  7-day Rolling Avg: {prediction_row['rolling_mean_7'].iloc[0]:.1f}")
         logger.info(f"  14-day Rolling Avg: {prediction_row['rolling_mean_14'].iloc[0]:.1f}")
+        for name, value in shadow.items():
+            logger.info(f"  Shadow {name}: {value:.1f}")
+        logger.info(f"  Peak memory: {peak_rss_mb():.0f} MB of {PROFILE.memory_mb} MB budget")
+        if PROFILE.over_budget():
+            logger.warning(f"Over the memory budget: later fetches use {PROFILE.chunk_rows:,}-row chunks "
+                           "and training a single worker")
 
         return True
 
@@ -386,8 +662,516 @@ def run_prediction():
         return False
 
 
-def run_daemon():
-    """Run as a daemon with APScheduler."""
+def run_backfill(start_date, end_date, source=None, quantiles=None):
+    """
+    Regenerate predictions for every date in [start_date, end_date] in one pass:
+    one feature store read, one predict call and one bulk write.
+    Each date is predicted from the previous day's features, as the nightly run would.
+    """
+    import pandas as pd
+    import data_sources
+
+    logger.info(f"Backfilling predictions for {start_date} to {end_date}")
+    logger.info("-" * 50)
+
+    try:
+        source = data_sources.resolve_source(source)
+
+        last_input_day = end_date - timedelta(days=1)
+        df_features = load_features(source, last_input_day)
+
+        model, encoder = load_model()
+        if model is None:
+            logger.error("Model not found. Run: ./setup.sh train")
+            return False
+
+        first_input_day = pd.Timestamp(start_date - timedelta(days=1))
+        rows = df_features[
+            (df_features['date'] >= first_input_day) &
+            (df_features['date'] <= pd.Timestamp(last_input_day))
+        ]
+        if rows.empty:
+            logger.warning("No sales days in the backfill range. Exiting.")
+            return False
+
+        predictions = predict_next_days(rows, model, encoder, quantiles)
+        logger.info(f"Predicted {len(predictions)} dates in one call")
+
+        if data_sources.is_database_source(source):
+            save_predictions_bulk(predictions)
+            update_actual_sales()
+        else:
+            logger.info("Snapshot source, skipping database writes")
+
+        for _, row in predictions.iterrows():
+            logger.info(f"  {row['prediction_date'].date()}: {row['predicted_sales']:.1f}")
+        return True
+
+    except Exception as e:
+        logger.error(f"Backfill failed: {e}", exc_info=True)
+        return False
+
+
+def load_group_features(source, device_groups, through=None, start=None):
+    """
+    Per-group daily feature rows from one chunked pass over the orders: each
+    chunk becomes (day, machine) partials, which are then summed per group.
+    Only orders from `start` on are read (default: the full history).
+    """
+    import pandas as pd
+    import data_sources
+    from feature_store import partial_daily, combine_daily, create_group_features, day_close, last_closed_day
+
+    through = min(through or last_closed_day(), last_closed_day())
+    partials = []
+    for chunk in data_sources.iter_orders(source, start, day_close(through), PROFILE.chunk_rows):
+        chunk = chunk[~chunk['machine_sn'].isin(MACHINES_TO_DROP)]
+        if not chunk.empty:
+            partials.append(partial_daily(chunk))
+    if not partials:
+        return pd.DataFrame()
+    return create_group_features(combine_daily(partials, device_groups))
+
+
+def train_group_model(df_features, save=True):
+    """
+    Train one model on every group's feature rows together, so a new group is
+    served without a model of its own and all groups predict in one call.
+    Without save (snapshot runs) the model is only used for this run.
+    """
+    import joblib
+    from feature_store import FEATURE_SCHEMA_VERSION
+    from model_engines import DEFAULT_ENGINE, make_model
+
+    logger.info(f"Training {DEFAULT_ENGINE} group model on {df_features['group_id'].nunique()} groups...")
+    df_train = df_features[~df_features[TARGET_COL].isnull()].drop(columns='group_id')
+
+    X, encoder, _ = prepare_features(df_train)
+    model = make_model(DEFAULT_ENGINE, n_jobs=PROFILE.threads)
+    model.fit(X, df_train[TARGET_COL].values)
+
+    if not save:
+        logger.info("Snapshot source, group model not saved")
+        return model, encoder
+
+    # Replaced atomically, like the machine model
+    tmp = GROUP_MODEL_PATH.with_name(GROUP_MODEL_PATH.name + '.tmp')
+    joblib.dump({'model': model, 'encoder': encoder, 'schema_version': FEATURE_SCHEMA_VERSION}, tmp)
+    os.replace(tmp, GROUP_MODEL_PATH)
+    logger.info(f"Group model saved to {GROUP_MODEL_PATH}")
+    return model, encoder
+
+
+def load_group_model():
+    """Load the group model, or return None if missing or built for another feature schema."""
+    import joblib
+    from feature_store import FEATURE_SCHEMA_VERSION
+
+    if not GROUP_MODEL_PATH.exists():
+        return None, None
+    bundle = joblib.load(GROUP_MODEL_PATH)
+    if bundle.get('schema_version') != FEATURE_SCHEMA_VERSION:
+        logger.info("Group model was trained on another feature schema, retraining")
+        return None, None
+
+    model = bundle['model']
+    if hasattr(model, 'n_jobs'):
+        model.n_jobs = PROFILE.threads
+    logger.info("Loaded existing group model")
+    return model, bundle['encoder']
+
+
+def save_group_predictions(prediction_rows):
+    """
+    Save every group's prediction in one transaction: rows go into a temp table
+    via execute_values, then a single INSERT ... ON CONFLICT merges them.
+    """
+    from psycopg2.extras import execute_values
+
+    quantile_cols = [c for c in prediction_rows.columns if c.startswith('predicted_p')]
+    records = []
+    for _, row in prediction_rows.iterrows():
+        quantiles = {c[len('predicted_'):]: float(row[c]) for c in quantile_cols}
+        records.append((
+            row['group_id'],
+            row['prediction_date'].to_pydatetime(),
+            float(row['predicted_sales']),
+            float(row.get('rolling_mean_7', 0)),
+            float(row.get('rolling_mean_14', 0)),
+            json.dumps(quantiles) if quantiles else None,
+        ))
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    cur.execute("""
+        CREATE TEMP TABLE group_prediction_stage (
+            "groupId" text,
+            "predictionDate" timestamp(3),
+            "predictedSales" double precision,
+            "rollingMean7" double precision,
+            "rollingMean14" double precision,
+            "predictedQuantiles" jsonb
+        ) ON COMMIT DROP
+    """)
+    execute_values(
+        cur,
+        'INSERT INTO group_prediction_stage VALUES %s',
+        records,
+        template='(%s, %s, %s, %s, %s, %s::jsonb)',
+        page_size=1000
+    )
+    cur.execute("""
+        INSERT INTO "GroupSalesPrediction" (
+            id, "groupId", "predictionDate", "predictedSales",
+            "rollingMean7", "rollingMean14", "predictedQuantiles",
+            "createdAt", "updatedAt"
+        )
+        SELECT
+            gen_random_uuid()::text, "groupId", "predictionDate", "predictedSales",
+            "rollingMean7", "rollingMean14", "predictedQuantiles",
+            NOW(), NOW()
+        FROM group_prediction_stage
+        ON CONFLICT ("groupId", "predictionDate")
+        DO UPDATE SET
+            "predictedSales" = EXCLUDED."predictedSales",
+            "rollingMean7" = EXCLUDED."rollingMean7",
+            "rollingMean14" = EXCLUDED."rollingMean14",
+            "predictedQuantiles" = EXCLUDED."predictedQuantiles",
+            "updatedAt" = NOW()
+    """)
+    saved = cur.rowcount
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    logger.info(f"Saved {saved} group predictions in one transaction")
+
+
+def update_group_actual_sales():
+    """Fill in actual group sales for closed days (for accuracy tracking)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    # Sales day X+1 runs 14:30 UTC day X to 14:30 UTC day X+1, as in the feature store
+    query = """
+        UPDATE "GroupSalesPrediction" gp
+        SET "actualSales" = subq.actual_sales
+        FROM (
+            SELECT
+                dg."groupId" as group_id,
+                DATE(o."createdAt" - INTERVAL '14 hours 30 minutes') + 1 as sale_date,
+                SUM(o."deliverCount") as actual_sales
+            FROM "Order" o
+            JOIN "Device" d ON d."deviceId" = o."deviceId"
+            JOIN "DeviceGroup" dg ON dg."deviceId" = d.id
+            WHERE o."isSuccess" = true
+            GROUP BY 1, 2
+        ) subq
+        WHERE gp."groupId" = subq.group_id
+        AND DATE(gp."predictionDate") = subq.sale_date
+        AND subq.sale_date <= DATE(NOW() - INTERVAL '14 hours 30 minutes')
+        AND gp."actualSales" IS NULL
+    """
+    cur.execute(query)
+    updated = cur.rowcount
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    logger.info(f"Updated {updated} group predictions with actual sales")
+
+
+def run_group_predictions(source=None, as_of=None, groups_path=None, quantiles=None):
+    """
+    Predict the next day for every machine group in one run: one chunked pass
+    over the orders split by group, one predict call for all groups and one
+    bulk write. With a snapshot source nothing is written back.
+    """
+    import data_sources
+    from feature_store import day_close, last_closed_day
+
+    logger.info(f"Starting group predictions at {datetime.now()}")
+    logger.info("-" * 50)
+
+    try:
+        source = data_sources.resolve_source(source)
+        write_back = data_sources.is_database_source(source)
+
+        # Step 1: Load group membership
+        device_groups = data_sources.fetch_device_groups(source, groups_path or DEVICE_GROUPS_PATH)
+        names = dict(zip(device_groups['group_id'], device_groups['group_name']))
+        logger.info(f"Loaded {len(names)} groups covering {device_groups['machine_sn'].nunique()} machines")
+        if device_groups.empty:
+            logger.warning("No device groups. Exiting.")
+            return False
+
+        # Step 2: Load the group model; with one, only recent orders are needed
+        model, encoder = load_group_model()
+        start = None
+        if model is not None:
+            through = min(as_of or last_closed_day(), last_closed_day())
+            start = day_close(through - timedelta(days=GROUP_CONTEXT_DAYS))
+
+        # Step 3: Per-group features from one pass over the orders
+        df_features = load_group_features(source, device_groups, as_of, start)
+        if df_features.empty:
+            logger.warning("No orders found for any group. Exiting.")
+            return False
+        if model is None:
+            model, encoder = train_group_model(df_features, save=write_back)
+
+        # Step 4: Predict every group that sold on the latest day, in one call
+        latest = df_features['date'].max()
+        last_rows = df_features.groupby('group_id').tail(1)
+        stale = last_rows[last_rows['date'] < latest]
+        if not stale.empty:
+            logger.warning(f"Skipping {len(stale)} group(s) with no sales on {latest.date()}")
+        last_rows = last_rows[last_rows['date'] == latest]
+
+        predictions = predict_next_days(last_rows.drop(columns='group_id'), model, encoder, quantiles)
+        predictions.insert(0, 'group_id', last_rows['group_id'].values)
+        logger.info(f"Predicted {len(predictions)} groups in one call")
+
+        if write_back:
+            # Step 5: Save all groups in one statement, then fill in past actuals
+            logger.info("Saving group predictions to database...")
+            save_group_predictions(predictions)
+            update_group_actual_sales()
+        else:
+            logger.info("Snapshot source, skipping database writes")
+
+        logger.info(f"Group predictions for {predictions['prediction_date'].iloc[0].date()}:")
+        for _, row in predictions.sort_values('predicted_sales', ascending=False).iterrows():
+            logger.info(f"  {names.get(row['group_id'], row['group_id'])}: {row['predicted_sales']:.1f}")
+        return True
+
+    except Exception as e:
+        logger.error(f"Group predictions failed: {e}", exc_info=True)
+        return False
+
+
+class IntradayNowcast:
+    """
+    Hourly re-estimate of the current sales day's total from partial actuals.
+
+    Keeps per-hour sales for today and the last few completed days in memory,
+    and only fetches orders newer than its watermark, so each hourly run is a
+    small incremental query rather than a 30-day refetch. With a state_path
+    the watermark and counts are saved after each database run and picked up
+    by the next, so one-shot --nowcast runs and daemon restarts stay incremental.
+    """
+
+    def __init__(self, source=None, state_path=None):
+        import numpy as np
+
+        self.source = source
+        self.state_path = Path(state_path) if state_path else None
+        self.watermark = None
+        self.day_start = None
+        self.hourly = np.zeros(24)
+        self.history = deque(maxlen=NOWCAST_PROFILE_DAYS)
+        self.seen_ids = set()
+
+    def _load(self, now):
+        """Resume from the last saved state, unless it is older than the profile window."""
+        import numpy as np
+
+        with np.load(self.state_path) as data:
+            watermark = datetime.fromisoformat(str(data['watermark']))
+            if now - watermark > timedelta(days=NOWCAST_PROFILE_DAYS):
+                return
+            self.watermark = watermark
+            self.day_start = datetime.fromisoformat(str(data['day_start']))
+            self.hourly = data['hourly'].astype(np.float64)
+            self.history.extend(data['history'].astype(np.float64))
+            self.seen_ids = {str(i) for i in data['seen_ids']}
+
+    def _save(self):
+        """Write the watermark, today's hourly counts and the profile days, atomically."""
+        import numpy as np
+
+        tmp = self.state_path.with_name(self.state_path.stem + '.tmp.npz')
+        np.savez(
+            tmp,
+            watermark=np.array(self.watermark.isoformat()),
+            day_start=np.array(self.day_start.isoformat()),
+            hourly=self.hourly,
+            history=np.array(list(self.history)).reshape(-1, 24),
+            seen_ids=np.array(sorted(self.seen_ids), dtype=str),
+        )
+        os.replace(tmp, self.state_path)
+
+    def _roll_to(self, day_start):
+        """Close the current sales day and start a new one."""
+        import numpy as np
+
+        if self.day_start is not None:
+            self.history.append(self.hourly)
+        self.day_start = day_start
+        self.hourly = np.zeros(24)
+        self.seen_ids = set()
+
+    def _ingest(self, orders_df):
+        """Add new successful orders to the per-hour counts, rolling over days as needed."""
+        import pandas as pd
+        import numpy as np
+
+        if orders_df.empty:
+            return
+        df = orders_df[orders_df['operation_outcome'] == 'Success']
+        df = df[~df['orderId'].isin(self.seen_ids)]
+
+        day_starts = (df['log_datetime'] - DAY_OFFSET).dt.floor('D') + DAY_OFFSET
+        hours = ((df['log_datetime'] - day_starts) // pd.Timedelta(hours=1)).clip(0, 23)
+
+        for day_start in sorted(day_starts.unique()):
+            day_start = pd.Timestamp(day_start).to_pydatetime()
+            if self.day_start is not None and day_start < self.day_start:
+                continue  # late upload for a closed day
+            if day_start != self.day_start:
+                self._roll_to(day_start)
+            mask = (day_starts == day_start).values
+            np.add.at(self.hourly, hours.values[mask].astype(int), df['num_dispensed'].values[mask])
+            self.seen_ids.update(df['orderId'].values[mask])
+
+    def profile(self):
+        """Share of a day's sales expected in each hour (uniform until history exists)."""
+        import numpy as np
+
+        if not self.history:
+            return np.full(24, 1 / 24)
+        totals = np.sum(self.history, axis=0)
+        if totals.sum() == 0:
+            return np.full(24, 1 / 24)
+        return totals / totals.sum()
+
+    def elapsed_share(self, now):
+        """Fraction of the day's expected sales that should have happened by now."""
+        elapsed = (now - self.day_start) / timedelta(hours=1)
+        full = min(int(elapsed), 24)
+        profile = self.profile()
+        share = profile[:full].sum()
+        if full < 24:
+            share += profile[full] * (elapsed - full)
+        return float(min(share, 1.0))
+
+    def estimate(self, prior, now):
+        """
+        Blend the model's prior with the day's pace so far.
+        The remaining sales are scaled by how the day is tracking against the
+        prior, trusting that pace more as more of the day has been observed.
+        """
+        actual = float(self.hourly.sum())
+        share = self.elapsed_share(now)
+        if prior is None or prior <= 0 or share <= 0:
+            return actual if prior is None else max(actual, float(prior))
+
+        pace = actual / (prior * share)
+        remaining = prior * (1 - share) * (1 + share * (pace - 1))
+        return actual + max(remaining, 0.0)
+
+    def run(self, now=None):
+        """Fetch orders since the watermark, update the profile and upsert the nowcast."""
+        import numpy as np
+        import data_sources
+
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        try:
+            source = data_sources.resolve_source(self.source)
+            write_back = data_sources.is_database_source(source)
+            # Only live runs share state; a snapshot replay starts fresh
+            if self.watermark is None and write_back and self.state_path and self.state_path.exists():
+                self._load(now)
+            if self.watermark is None:
+                # First run seeds the hourly profile from recent complete days
+                start = sales_day_start(now) - timedelta(days=NOWCAST_PROFILE_DAYS)
+            else:
+                # Re-read a short overlap to pick up late uploads; seen_ids dedupes them
+                start = self.watermark - NOWCAST_OVERLAP
+
+            orders_df = format_orders(data_sources.fetch_orders(source, start, now))
+            self._ingest(orders_df)
+            self.watermark = now
+
+            current_start = sales_day_start(now)
+            if self.day_start is None or current_start > self.day_start:
+                self._roll_to(current_start)
+
+            if write_back and self.state_path:
+                self._save()
+
+            prediction_date = datetime.combine(current_start.date() + timedelta(days=1), datetime.min.time())
+            prior = fetch_predicted_sales(prediction_date) if write_back else None
+            if prior is None and self.history:
+                prior = float(np.mean([h.sum() for h in self.history]))
+
+            nowcast = self.estimate(prior, now)
+            if write_back and not save_nowcast(prediction_date, nowcast):
+                logger.warning(f"No nightly prediction for {prediction_date.date()}, nowcast not stored")
+
+            prior_str = f"{prior:.1f}" if prior is not None else "n/a"
+            logger.info(
+                f"Nowcast for {prediction_date.date()}: {nowcast:.1f} sales "
+                f"(actual so far {self.hourly.sum():.0f}, prior {prior_str}, "
+                f"{len(orders_df)} orders fetched)"
+            )
+            return nowcast
+
+        except Exception as e:
+            logger.error(f"Nowcast failed: {e}", exc_info=True)
+            return None
+
+
+def sales_day_start(ts):
+    """Return the 14:30 UTC start of the sales day containing ts."""
+    from data_sources import DAY_BOUNDARY
+
+    start = datetime.combine(ts.date(), DAY_BOUNDARY)
+    return start if ts >= start else start - timedelta(days=1)
+
+
+def fetch_predicted_sales(prediction_date):
+    """Return the stored nightly prediction for a date, or None."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        'SELECT "predictedSales" FROM "SalesPrediction" WHERE DATE("predictionDate") = %s',
+        (prediction_date.date(),)
+    )
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    return float(row['predictedSales']) if row else None
+
+
+def save_nowcast(prediction_date, nowcast_sales):
+    """
+    Store the intraday nowcast on the date's nightly prediction row. Without
+    one nothing is written: "predictedSales" only ever holds the model's prior.
+    Returns whether a row was updated.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    query = """
+        UPDATE "SalesPrediction"
+        SET "nowcastSales" = %s, "nowcastAt" = NOW(), "updatedAt" = NOW()
+        WHERE DATE("predictionDate") = %s
+    """
+    cur.execute(query, (nowcast_sales, prediction_date.date()))
+    updated = cur.rowcount
+
+    conn.commit()
+    cur.close()
+    conn.close()
+    return updated > 0
+
+
+def run_daemon(source=None, quantiles=None, shadow_models=None, groups_path=None):
+    """Run as a daemon with APScheduler; every job gets the CLI's source and settings."""
     try:
         from apscheduler.schedulers.blocking import BlockingScheduler
         from apscheduler.triggers.cron import CronTrigger
@@ -403,12 +1187,39 @@ def run_daemon():
     scheduler.add_job(
         run_prediction,
         CronTrigger(hour=14, minute=30, timezone='UTC'),
+        kwargs={'source': source, 'quantiles': quantiles, 'shadow_models': shadow_models},
         id='daily_prediction',
         name='Daily Sales Prediction',
         misfire_grace_time=3600  # Allow 1 hour grace period
     )
 
+    # Per-group forecasts once the fleet run is done
+    if GROUP_FORECASTS:
+        scheduler.add_job(
+            run_group_predictions,
+            CronTrigger(hour=14, minute=GROUP_MINUTE, timezone='UTC'),
+            kwargs={'source': source, 'groups_path': groups_path, 'quantiles': quantiles},
+            id='group_predictions',
+            name='Per-Group Sales Predictions',
+            misfire_grace_time=3600
+        )
+
+    # Hourly intraday nowcast of the current sales day
+    nowcaster = IntradayNowcast(source, NOWCAST_STATE_PATH)
+    scheduler.add_job(
+        nowcaster.run,
+        CronTrigger(minute=NOWCAST_MINUTE, timezone='UTC'),
+        id='hourly_nowcast',
+        name='Intraday Sales Nowcast',
+        max_instances=1,
+        coalesce=True,
+        misfire_grace_time=600
+    )
+
     logger.info("Daemon started. Prediction scheduled at 22:30 SGT (14:30 UTC) daily.")
+    if GROUP_FORECASTS:
+        logger.info(f"Group predictions scheduled at 14:{GROUP_MINUTE:02d} UTC daily.")
+    logger.info(f"Nowcast scheduled hourly at :{NOWCAST_MINUTE:02d}.")
     logger.info("Press Ctrl+C to exit.")
 
     try:
@@ -417,9 +1228,9 @@ def run_daemon():
         logger.info("Daemon stopped.")
 
 
-def test_prediction(test_date_str):
+def test_prediction(test_date_str, source=None):
     """Test prediction accuracy for a specific date."""
-    from datetime import datetime
+    import pandas as pd
 
     test_date = datetime.strptime(test_date_str, '%Y-%m-%d').date()
 
@@ -428,49 +1239,16 @@ def test_prediction(test_date_str):
     logger.info("-" * 50)
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Fetch orders up to the day BEFORE test_date (for prediction input)
-        # We need 30 days of data ending the day before
-        end_date = datetime.combine(test_date - timedelta(days=1), datetime.max.time())
-        start_date = datetime.combine(test_date - timedelta(days=31), datetime.min.time())
-
-        query = """
-            SELECT
-                "orderId",
-                "deviceId" as machine_sn,
-                "deviceName",
-                "createdAt" as log_datetime,
-                "isSuccess" as operation_outcome,
-                "payWay" as payment_mode,
-                "payAmount" as transaction_amount,
-                "quantity" as order_amt,
-                "deliverCount" as num_dispensed,
-                "refundAmount" as refund_amount
-            FROM "Order"
-            WHERE "createdAt" >= %s AND "createdAt" <= %s
-            ORDER BY "createdAt" ASC
-        """
-        cur.execute(query, (start_date, end_date))
-        rows = cur.fetchall()
-        orders_df = pd.DataFrame(rows)
-        logger.info(f"Fetched {len(orders_df)} orders for training period")
+        # Features up to the day BEFORE test_date are the prediction input,
+        # the test_date row itself holds the actual sales
+        df_features = load_features(source, test_date)
+        history = df_features[df_features['date'] < pd.Timestamp(test_date)]
+        logger.info(f"Loaded {len(history)} days of features")
 
-        if orders_df.empty:
+        if history.empty:
             logger.error("No orders found for training period")
             return False
 
-        # Format orders
-        orders_df = format_orders(orders_df)
-
-        # Aggregate daily
-        df_agg = aggregate_daily(orders_df)
-        logger.info(f"Aggregated to {len(df_agg)} days")
-
-        # Create features
-        df_features = create_features(df_agg)
-
         # Load model
         model, encoder = load_model()
         if model is None:
@@ -478,27 +1256,13 @@ def test_prediction(test_date_str):
             return False
 
         # Generate prediction
-        prediction_row = generate_predictions(df_features, model, encoder)
+        prediction_row = generate_predictions(history, model, encoder)
         predicted_sales = prediction_row['predicted_sales'].iloc[0]
 
-        # Now fetch ACTUAL sales for test_date
-        # Day window: 22:30 prev day to 22:29 current day (SGT)
-        # In UTC: 14:30 prev day to 14:29 current day
-        actual_start = datetime.combine(test_date - timedelta(days=1), datetime.min.time()) + timedelta(hours=14, minutes=30)
-        actual_end = datetime.combine(test_date, datetime.min.time()) + timedelta(hours=14, minutes=29)
-
-        query = """
-            SELECT SUM("deliverCount") as actual_sales
-            FROM "Order"
-            WHERE "createdAt" >= %s AND "createdAt" <= %s
-            AND "isSuccess" = true
-        """
-        cur.execute(query, (actual_start, actual_end))
-        result = cur.fetchone()
-        actual_sales = float(result['actual_sales']) if result['actual_sales'] else 0
-
-        cur.close()
-        conn.close()
+        # ACTUAL sales for test_date (22:30 prev day to 22:29 current day SGT)
+        actual_sales = float(
+            df_features.loc[df_features['date'] == pd.Timestamp(test_date), TARGET_COL].sum()
+        )
 
         # Calculate accuracy
         error = abs(predicted_sales - actual_sales)
@@ -522,16 +1286,56 @@ def test_prediction(test_date_str):
 def main():
     parser = argparse.ArgumentParser(description='Sales Prediction for Raspberry Pi')
     parser.add_argument('--daemon', action='store_true', help='Run as daemon with scheduler')
+    parser.add_argument('--nowcast', action='store_true', help='Run the intraday nowcast once')
+    parser.add_argument('--backfill', nargs=2, metavar=('START', 'END'),
+                        help='Regenerate predictions for a date range (YYYY-MM-DD YYYY-MM-DD)')
+    parser.add_argument('--groups', action='store_true', help='Predict every machine group once')
+    parser.add_argument('--groups-file', type=str,
+                        help='Group membership CSV for snapshot sources (default: $DEVICE_GROUPS)')
     parser.add_argument('--test', type=str, help='Test prediction for a specific date (YYYY-MM-DD)')
+    parser.add_argument('--source', type=str,
+                        help='Orders source: database URL or snapshot file (default: DATABASE_URL)')
+    parser.add_argument('--quantiles', type=str, default=os.environ.get('PREDICTION_QUANTILES'),
+                        help='Comma-separated quantiles to store, e.g. 0.1,0.9 (default: $PREDICTION_QUANTILES)')
+    parser.add_argument('--as-of', type=str,
+                        help='Replay the run as of this date (YYYY-MM-DD), e.g. against a snapshot')
+    parser.add_argument('--shadow', type=str,
+                        help='Comma-separated candidate model files to score alongside production '
+                             '(default: $SHADOW_MODELS)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Write a CPU profile and allocation snapshot next to prediction.log')
     args = parser.parse_args()
 
+    if args.profile:
+        from run_profile import start_profiling
+        start_profiling('sales_prediction', log=logger.info)
+
+    PROFILE.apply()
+    logger.info(f"Resources: {PROFILE}")
+
+    as_of = datetime.strptime(args.as_of, '%Y-%m-%d').date() if args.as_of else None
+    quantiles = [float(q) for q in args.quantiles.split(',')] if args.quantiles else None
+    shadow_models = [p.strip() for p in args.shadow.split(',') if p.strip()] if args.shadow else None
+
     if args.daemon:
-        run_daemon()
+        run_daemon(source=args.source, quantiles=quantiles, shadow_models=shadow_models,
+                   groups_path=args.groups_file)
+    elif args.backfill:
+        start, end = (datetime.strptime(d, '%Y-%m-%d').date() for d in args.backfill)
+        success = run_backfill(start, end, source=args.source, quantiles=quantiles)
+        sys.exit(0 if success else 1)
+    elif args.groups:
+        success = run_group_predictions(args.source, as_of, args.groups_file, quantiles)
+        sys.exit(0 if success else 1)
+    elif args.nowcast:
+        nowcast = IntradayNowcast(args.source, NOWCAST_STATE_PATH).run()
+        sys.exit(0 if nowcast is not None else 1)
     elif args.test:
-        success = test_prediction(args.test)
+        success = test_prediction(args.test, source=args.source)
         sys.exit(0 if success else 1)
     else:
-        success = run_prediction()
+        success = run_prediction(source=args.source, as_of=as_of, quantiles=quantiles,
+                                 shadow_models=shadow_models)
         sys.exit(0 if success else 1)
 
 
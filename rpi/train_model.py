@@ -5,24 +5,48 @@ Run this on the RPi to create model files compatible with its numpy version.
 
 Usage:
   python train_model.py
+  python train_model.py --source orders.parquet   # Train from a snapshot or database
+  python train_model.py --feature-store daily_features.csv   # Reuse stored daily features
+  python train_model.py --engine hist_gb          # Gradient boosting instead of the forest
+  python train_model.py --compare                 # Time/size/walk-forward error of every engine
+  python train_model.py --engine hist_gb --output candidate.joblib   # Shadow candidate (SHADOW_MODELS)
+  python train_model.py --max-threads 2 --memory-mb 400       # Stay inside a resource budget
+  python train_model.py --per-machine             # Per-machine model bundle for ml/predict.py
+  python train_model.py --per-machine --clusters 4
+  python train_model.py --per-machine --history sales_matrix.i32   # Machine-days from the sales matrix
+  python train_model.py --fleet-model --device-encoding index   # One model, device as an index
+  python train_model.py --profile                 # Also write a CPU/allocation profile (run_profile.py)
 """
 
+import io
+import os
+import time
+import argparse
 import warnings
 warnings.filterwarnings('ignore')
 
 import pandas as pd
 import numpy as np
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from pathlib import Path
 import joblib
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import OneHotEncoder
 
+import data_sources
+from feature_store import FeatureStore, LAGS, next_day_features
+from model_engines import ENGINES, DEFAULT_ENGINE, make_model
+from model_health import save_reference
+from resource_profile import ResourceProfile, limit_native_threads, peak_rss_mb
+from sales_matrix import SalesMatrix
+
 # Configuration
 SCRIPT_DIR = Path(__file__).parent
 DATA_FILE = SCRIPT_DIR / 'training_data.csv'
 MODEL_PATH = SCRIPT_DIR / 'sales_model.joblib'
 ENCODER_PATH = SCRIPT_DIR / 'encoder.joblib'
+MODEL_META_PATH = SCRIPT_DIR / 'sales_model.json'     # Training reference stats (model_health.py)
 
 # Devices to exclude from prediction (event machines)
 MACHINES_TO_DROP = ['852298', '852308', '852309', '852311']
@@ -31,114 +55,40 @@ MACHINES_TO_DROP = ['852298', '852308', '852309', '852311']
 WINDOWS = [3, 7, 14]
 TARGET_COL = 'daily_sales'
 
-
-def load_training_data():
-    """Load and format training data from CSV."""
-    print(f"Loading data from {DATA_FILE}...")
-    df = pd.read_csv(DATA_FILE)
-    print(f"Loaded {len(df)} orders")
-
-    # Rename columns to match expected format
-    df = df.rename(columns={
-        'TerminalId': 'machine_sn',
-        'CreateTime': 'log_datetime',
-        'IsSuccess': 'operation_outcome',
-        'PayAmount': 'transaction_amount',
-        'DeliverCount': 'num_dispensed',
-        'RefundAmount': 'refund_amount',
-        'Fault': 'error_code'
-    })
-
-    # Convert types
-    df['log_datetime'] = pd.to_datetime(df['log_datetime'])
-    df['machine_sn'] = df['machine_sn'].astype(str)
-
-    # Map IsSuccess values
-    success_map = {
-        'Success': 'Success',
-        '成功': 'Success',
-        True: 'Success',
-        'true': 'Success',
-        1: 'Success'
-    }
-    df['operation_outcome'] = df['operation_outcome'].map(lambda x: success_map.get(x, 'Failed'))
-
-    # Fill missing values
-    df['num_dispensed'] = pd.to_numeric(df['num_dispensed'], errors='coerce').fillna(0).astype(int)
-    df['transaction_amount'] = pd.to_numeric(df['transaction_amount'], errors='coerce').fillna(0)
-    df['refund_amount'] = pd.to_numeric(df['refund_amount'], errors='coerce').fillna(0)
-    df['error_code'] = df['error_code'].fillna(0)
-
-    # Filter out event machines
-    df = df[~df['machine_sn'].isin(MACHINES_TO_DROP)]
-    print(f"After filtering: {len(df)} orders")
-
-    return df
+# Per-machine models (served by ml/predict.py)
+MACHINE_MODELS_PATH = SCRIPT_DIR / 'machine_models.joblib'
+FLEET_MODEL_PATH = SCRIPT_DIR / 'fleet_model.joblib'
+MACHINE_FEATURES = [
+    'weekday', 'month', 'day_of_month', 'is_weekend', 'lag_1', 'lag_7',
+    'rolling_avg_3', 'rolling_avg_7', 'rolling_avg_14', 'rolling_std_7',
+]
+MIN_MACHINE_DAYS = 30       # Less history than this -> served by the fleet model
+FLEET_MODEL_KEY = 'fleet'
 
 
-def aggregate_daily(df):
+def load_machine_daily(source=DATA_FILE, profile=None):
     """
-    Aggregate orders to TOTAL daily level (all machines combined).
-    Daily window: 10:30 PM SGT Day X to 10:29 PM SGT Day X+1 -> labeled as Day X+1.
+    Load orders from CSV or any other orders source and aggregate them to daily
+    sales per machine. Orders are streamed in chunks sized by the memory budget;
+    per-machine daily sums add up across chunks.
     """
-    # Shift time and label by END date of the window
-    df['adjusted_datetime'] = df['log_datetime'] - pd.Timedelta(hours=14, minutes=30)
-    df['date'] = pd.to_datetime(df['adjusted_datetime'].dt.date) + pd.Timedelta(days=1)
-
-    # Only count successful orders
-    df_success = df[df['operation_outcome'] == 'Success']
-
-    # Aggregate ALL machines together per day
-    df_agg = df_success.groupby(['date']).agg(
-        daily_sales=('num_dispensed', 'sum'),
-        transactions=('num_dispensed', 'count'),
-        total_amount=('transaction_amount', 'sum'),
-        total_refund=('refund_amount', 'sum'),
-        active_machines=('machine_sn', 'nunique')
-    ).reset_index()
+    profile = profile or ResourceProfile()
+    print(f"Loading data from {source}...")
 
-    # Add error count from all orders
-    error_counts = df[df['error_code'] != 0].groupby(
-        pd.to_datetime(df['adjusted_datetime'].dt.date) + pd.Timedelta(days=1)
-    ).size().reset_index(name='error_count')
-    error_counts.columns = ['date', 'error_count']
+    n_orders, n_kept, partials = 0, 0, []
+    for chunk in data_sources.iter_orders(source, chunk_rows=profile.chunk_rows):
+        n_orders += len(chunk)
 
-    df_agg = df_agg.merge(error_counts, on='date', how='left')
-    df_agg['error_count'] = df_agg['error_count'].fillna(0)
+        # Filter out event machines
+        chunk = chunk[~chunk['machine_sn'].isin(MACHINES_TO_DROP)]
+        n_kept += len(chunk)
+        partials.append(aggregate_machine_daily(chunk))
 
-    return df_agg
+    print(f"Loaded {n_orders} orders in {len(partials)} chunk(s)")
+    print(f"After filtering: {n_kept} orders")
 
-
-def create_features(df_agg):
-    """Create features for the model (total sales level)."""
-    df_features = df_agg.copy()
-
-    df_features['date'] = pd.to_datetime(df_features['date'])
-    df_features['day'] = df_features['date'].dt.day
-    df_features['weekday'] = df_features['date'].dt.weekday
-    df_features['month'] = df_features['date'].dt.month
-    df_features['is_weekend'] = (df_features['weekday'] >= 5).astype(int)
-
-    # Rolling statistics (total level, no groupby)
-    for w in WINDOWS:
-        df_features[f'rolling_mean_{w}'] = df_features[TARGET_COL].rolling(window=w, min_periods=1).mean()
-        df_features[f'rolling_std_{w}'] = df_features[TARGET_COL].rolling(window=w, min_periods=1).std().fillna(0)
-
-    # Lag features
-    for lag in [1, 7]:
-        df_features[f'lag_{lag}'] = df_features[TARGET_COL].shift(lag)
-
-    # Error rate
-    df_features['error_rate'] = df_features['error_count'] / df_features['transactions'].replace(0, np.nan)
-    df_features['error_rate'] = df_features['error_rate'].fillna(0)
-
-    # Fill NA lags with 0
-    lag_cols = [c for c in df_features.columns if c.startswith('lag_')]
-    df_features[lag_cols] = df_features[lag_cols].fillna(0)
-
-    df_features = df_features.sort_values('date')
-
-    return df_features
+    df_daily = pd.concat(partials, ignore_index=True)
+    return df_daily.groupby(['device_id', 'date'], as_index=False)['sold'].sum()
 
 
 def prepare_features(df, encoder=None):
@@ -163,29 +113,46 @@ def prepare_features(df, encoder=None):
     return X, encoder, NUMERICALS
 
 
-def train_model(df_features):
-    """Train a new model on the available data."""
-    print("Training model...")
+def train_model(df_features, engine=DEFAULT_ENGINE, n_jobs=-1, output=None):
+    """
+    Train a new model on the available data.
+    With `output`, train a candidate for sales_prediction.py's SHADOW_MODELS
+    instead: it is fitted on the production encoder's matrix and only the model
+    is written, so the production model and encoder are left alone.
+    """
+    print(f"Training {engine} model...")
 
     # Remove rows with NaN target
     df_train = df_features[~df_features[TARGET_COL].isnull()].copy()
 
     print(f"Training on {len(df_train)} days of data")
 
-    X, encoder, numericals = prepare_features(df_train)
+    encoder = joblib.load(ENCODER_PATH) if output and ENCODER_PATH.exists() else None
+    X, encoder, numericals = prepare_features(df_train, encoder)
     y = df_train[TARGET_COL].values
 
-    model = RandomForestRegressor(n_estimators=200, random_state=42, n_jobs=-1)
+    model = make_model(engine, n_jobs)
     model.fit(X, y)
 
     # Save model and encoder
-    joblib.dump(model, MODEL_PATH)
-    joblib.dump(encoder, ENCODER_PATH)
-
-    print(f"Model saved to {MODEL_PATH}")
-    print(f"Encoder saved to {ENCODER_PATH}")
+    if output:
+        joblib.dump(model, output)
+        print(f"Candidate model saved to {output}")
+    else:
+        # Replaced atomically, as sales_prediction.py does, with the health
+        # check's reference stats, so the new model is judged on its own data
+        for obj, path in ((model, MODEL_PATH), (encoder, ENCODER_PATH)):
+            tmp = path.with_name(path.name + '.tmp')
+            joblib.dump(obj, tmp)
+            os.replace(tmp, path)
+        save_reference(MODEL_META_PATH, df_train, numericals)
+        print(f"Model saved to {MODEL_PATH}")
+        print(f"Encoder saved to {ENCODER_PATH}")
+
+    # Print feature importance (tree engines only)
+    if not hasattr(model, 'feature_importances_'):
+        return model, encoder
 
-    # Print feature importance
     feature_names = numericals + list(encoder.get_feature_names_out(['weekday', 'month']))
     importances = pd.DataFrame({
         'feature': feature_names,
@@ -198,38 +165,358 @@ def train_model(df_features):
     return model, encoder
 
 
+def walk_forward_predictions(df_features, engine, folds=4, fold_days=7, n_jobs=-1, lags=LAGS):
+    """
+    Expanding-window backtest over the last folds * fold_days days.
+    Each fold is trained on the days before it, then predicts each of its days
+    from the previous day's row, the same way the nightly run does.
+    Returns (predicted, actual) arrays.
+    """
+    dates = df_features['date']
+    actual_by_date = df_features.set_index('date')[TARGET_COL]
+    predicted, actual = [], []
+
+    for k in range(folds, 0, -1):
+        fold_start = dates.max() - timedelta(days=k * fold_days - 1)
+        fold_end = fold_start + timedelta(days=fold_days)
+
+        df_train = df_features[dates < fold_start].copy()
+        inputs = df_features[(dates >= fold_start - timedelta(days=1)) & (dates < fold_end - timedelta(days=1))]
+        if len(df_train) < 14 or inputs.empty:
+            continue
+
+        X_train, encoder, _ = prepare_features(df_train)
+        model = make_model(engine, n_jobs).fit(X_train, df_train[TARGET_COL].values)
+
+        X, _, _ = prepare_features(next_day_features(inputs, lags), encoder)
+        targets = actual_by_date.reindex(inputs['date'] + timedelta(days=1)).values
+        known = ~np.isnan(targets)
+        predicted.append(model.predict(X)[known])
+        actual.append(targets[known])
+
+    if not predicted:
+        return np.array([]), np.array([])
+    return np.concatenate(predicted), np.concatenate(actual)
+
+
+def compare_engines(df_features, engines=ENGINES, folds=4, fold_days=7, repeat=50, n_jobs=-1):
+    """
+    Fit every engine on the same data and report train time, single-row
+    inference latency, artifact size and walk-forward error.
+    Returns the results as a DataFrame, best MAE first.
+    """
+    df_train = df_features[~df_features[TARGET_COL].isnull()].copy()
+    X, encoder, _ = prepare_features(df_train)
+    y = df_train[TARGET_COL].values
+    X_next, _, _ = prepare_features(next_day_features(df_train.iloc[[-1]]), encoder)
+
+    results = []
+    for engine in engines:
+        print(f"  {engine}...")
+        t0 = time.perf_counter()
+        model = make_model(engine, n_jobs).fit(X, y)
+        train_s = time.perf_counter() - t0
+
+        # The nightly run predicts a single row
+        timings = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            model.predict(X_next)
+            timings.append(time.perf_counter() - t0)
+
+        buf = io.BytesIO()
+        joblib.dump(model, buf)
+
+        predicted, actual = walk_forward_predictions(df_features, engine, folds, fold_days, n_jobs)
+        errors = np.abs(predicted - actual)
+        results.append({
+            'engine': engine,
+            'train_s': train_s,
+            'predict_ms': float(np.median(timings)) * 1000,
+            'size_kb': buf.tell() / 1024,
+            'wf_days': len(actual),
+            'wf_mae': errors.mean() if len(errors) else np.nan,
+            'wf_mape': (errors / np.maximum(actual, 1)).mean() * 100 if len(errors) else np.nan,
+        })
+
+    return pd.DataFrame(results).sort_values('wf_mae').reset_index(drop=True)
+
+
+def aggregate_machine_daily(df):
+    """Aggregate successful orders to daily sales per machine (same day window as above)."""
+    adjusted = df['log_datetime'] - pd.Timedelta(hours=14, minutes=30)
+    df = df.assign(date=pd.to_datetime(adjusted.dt.date) + pd.Timedelta(days=1))
+    df_success = df[df['operation_outcome'] == 'Success']
+
+    df_daily = df_success.groupby(['machine_sn', 'date'])['num_dispensed'].sum().reset_index()
+    return df_daily.rename(columns={'machine_sn': 'device_id', 'num_dispensed': 'sold'})
+
+
+def create_machine_features(df_daily):
+    """
+    Create per-machine training rows the same way ml/predict.py builds its input:
+    rolling windows and lags are taken on day D, date features and the target
+    come from the machine's next day.
+    """
+    df = df_daily.sort_values(['device_id', 'date']).copy()
+    sold = df.groupby('device_id')['sold']
+
+    for w in WINDOWS:
+        df[f'rolling_avg_{w}'] = sold.transform(lambda x: x.rolling(window=w, min_periods=1).mean())
+    df['rolling_std_7'] = sold.transform(lambda x: x.rolling(window=7, min_periods=1).std().fillna(0))
+    df['lag_1'] = df['sold']
+    df['lag_7'] = sold.shift(7).fillna(0)
+
+    # Target is the next day this machine reported
+    df['target'] = sold.shift(-1)
+    df['target_date'] = df.groupby('device_id')['date'].shift(-1)
+    df = df.dropna(subset=['target']).copy()
+
+    df['weekday'] = df['target_date'].dt.weekday
+    df['month'] = df['target_date'].dt.month
+    df['day_of_month'] = df['target_date'].dt.day
+    df['is_weekend'] = (df['weekday'] >= 5).astype(int)
+
+    return df
+
+
+def _fit_machine_model(key, X, y, n_estimators, n_jobs):
+    """Fit one forest in a worker process."""
+    start = time.perf_counter()
+    model = RandomForestRegressor(
+        n_estimators=n_estimators, min_samples_leaf=2, random_state=42, n_jobs=n_jobs
+    )
+    model.fit(X, y)
+    return key, model, time.perf_counter() - start
+
+
+def assign_machine_groups(df_features, clusters=None):
+    """
+    Map each machine to the model that will serve it.
+    Per machine by default; with clusters, machines are banded by average daily
+    sales. Machines without MIN_MACHINE_DAYS of history go to the fleet model.
+    """
+    days = df_features.groupby('device_id').size()
+    if clusters:
+        mean_sold = df_features.groupby('device_id')['sold'].mean()
+        bands = pd.qcut(mean_sold.rank(method='first'), clusters, labels=False)
+        return {str(d): f'cluster_{b}' for d, b in bands.items()}
+
+    return {
+        str(d): (str(d) if n >= MIN_MACHINE_DAYS else FLEET_MODEL_KEY)
+        for d, n in days.items()
+    }
+
+
+def train_machine_models(df_features, clusters=None, workers=None, profile=None, n_estimators=100):
+    """
+    Fit one model per machine (or per cluster) plus a pooled fleet fallback,
+    in parallel worker processes. workers x threads-per-worker never exceeds
+    the profile's thread cap, and only as many workers start as fit its memory budget.
+    """
+    profile = profile or ResourceProfile()
+    routes = assign_machine_groups(df_features, clusters)
+    device_keys = df_features['device_id'].astype(str).map(routes)
+
+    jobs = [(FLEET_MODEL_KEY, df_features.index)]
+    for key in sorted(set(routes.values()) - {FLEET_MODEL_KEY}):
+        jobs.append((key, df_features.index[device_keys == key]))
+
+    cores = profile.threads
+    workers = max(1, min(workers or profile.workers(len(jobs)), cores, len(jobs)))
+    threads_per_worker = max(1, cores // workers)
+
+    print(f"Training {len(jobs)} models with {workers} workers x {threads_per_worker} threads...")
+    start = time.perf_counter()
+
+    models = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=limit_native_threads,
+                             initargs=(threads_per_worker,)) as pool:
+        futures = [
+            pool.submit(
+                _fit_machine_model, key,
+                df_features.loc[idx, MACHINE_FEATURES],
+                df_features.loc[idx, 'target'].values,
+                n_estimators, threads_per_worker
+            )
+            for key, idx in jobs
+        ]
+        for future in as_completed(futures):
+            key, model, elapsed = future.result()
+            models[key] = model
+            print(f"  {key}: {elapsed:.1f}s")
+
+    print(f"Trained {len(models)} models in {time.perf_counter() - start:.1f}s")
+
+    return {
+        'kind': 'per_machine',
+        'feature_cols': MACHINE_FEATURES,
+        'models': models,
+        'routes': routes,
+        'fallback': FLEET_MODEL_KEY,
+        'trained_at': datetime.now().isoformat(),
+    }
+
+
+def encode_devices(df_features, devices, encoding):
+    """
+    Machine feature matrix with device identity encoded as in ml/predict.py:
+    an integer 'device_idx' column, or a sparse one-hot block over devices.
+    """
+    device_index = {d: i for i, d in enumerate(devices)}
+    codes = df_features['device_id'].astype(str).map(device_index).fillna(-1).astype(int).values
+
+    if encoding == 'index':
+        X = df_features[MACHINE_FEATURES].reset_index(drop=True)
+        X['device_idx'] = codes
+        return X, MACHINE_FEATURES + ['device_idx']
+
+    from scipy import sparse
+    dense = sparse.csr_matrix(df_features[MACHINE_FEATURES].values.astype(np.float64))
+    onehot = sparse.csr_matrix(
+        (np.ones(len(codes)), (np.arange(len(codes)), codes)),
+        shape=(len(codes), len(devices))
+    )
+    return sparse.hstack([dense, onehot], format='csr'), MACHINE_FEATURES
+
+
+def train_fleet_model(df_features, encoding='index', n_estimators=200, n_jobs=-1):
+    """
+    Fit one model over every machine's rows for ml/predict.py, with device
+    identity as an index or sparse one-hot instead of dense device_* columns.
+    """
+    devices = sorted(df_features['device_id'].astype(str).unique())
+    X, feature_cols = encode_devices(df_features, devices, encoding)
+
+    print(f"Training fleet model ({encoding} device encoding, {len(devices)} devices)...")
+    start = time.perf_counter()
+    model = RandomForestRegressor(n_estimators=n_estimators, random_state=42, n_jobs=n_jobs)
+    model.fit(X, df_features['target'].values)
+    print(f"Trained in {time.perf_counter() - start:.1f}s")
+
+    return {
+        'model': model,
+        'feature_cols': feature_cols,
+        'device_encoding': encoding,
+        'devices': devices,
+        'trained_at': datetime.now().isoformat(),
+    }
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Train the sales prediction model')
+    parser.add_argument('--source', type=str, default=str(DATA_FILE),
+                        help='Orders source: CSV/Parquet/SQLite snapshot or database URL')
+    parser.add_argument('--feature-store', type=str,
+                        help='Daily feature store to sync and train from (default: in memory, '
+                             'or the shared store for a database source)')
+    parser.add_argument('--engine', choices=ENGINES, default=DEFAULT_ENGINE,
+                        help=f'Model engine for the fleet-total model (default: $MODEL_ENGINE or {DEFAULT_ENGINE})')
+    parser.add_argument('--compare', action='store_true',
+                        help='Compare all engines on the same data instead of saving a model')
+    parser.add_argument('--folds', type=int, default=4,
+                        help='Weekly walk-forward folds for --compare (default: 4)')
+    parser.add_argument('--per-machine', action='store_true',
+                        help='Train per-machine models for ml/predict.py instead of the fleet total')
+    parser.add_argument('--fleet-model', action='store_true',
+                        help='Train one model over all machines for ml/predict.py')
+    parser.add_argument('--history', type=str,
+                        help='With --per-machine / --fleet-model, sync and read machine-days from this sales matrix')
+    parser.add_argument('--device-encoding', choices=['index', 'sparse'], default='index',
+                        help='Device identity encoding for --fleet-model (default: index)')
+    parser.add_argument('--clusters', type=int,
+                        help='With --per-machine, train one model per sales-volume band instead')
+    parser.add_argument('--workers', type=int,
+                        help='Training processes (default: one per core, within the memory budget)')
+    parser.add_argument('--max-threads', type=int,
+                        help='Total CPU threads across workers (default: $PIPELINE_THREADS or up to 4 cores)')
+    parser.add_argument('--memory-mb', type=int,
+                        help='Memory budget in MB (default: $PIPELINE_MEMORY_MB or half of RAM)')
+    parser.add_argument('--output', type=str,
+                        help='Output path for --per-machine / --fleet-model artifacts, or a '
+                             'candidate fleet-total model to score as a shadow')
+    parser.add_argument('--profile', action='store_true',
+                        help='Write a CPU profile and allocation snapshot next to prediction.log')
+    args = parser.parse_args()
+
+    if args.profile:
+        from run_profile import start_profiling
+        start_profiling('train_model')
+
+    profile = ResourceProfile(args.max_threads, args.memory_mb).apply()
+
     print(f"=== Sales Prediction Model Training ===")
     print(f"Started at {datetime.now()}")
+    print(f"Resources: {profile}")
     print()
 
     # Check data file exists
-    if not DATA_FILE.exists():
+    if args.source == str(DATA_FILE) and not DATA_FILE.exists():
         print(f"ERROR: Data file not found: {DATA_FILE}")
         print("Please ensure training_data.csv is in the same directory.")
         return
 
-    # Load data
-    df = load_training_data()
-
-    # Aggregate daily
-    print("\nAggregating to daily totals...")
-    df_agg = aggregate_daily(df)
-    print(f"Aggregated to {len(df_agg)} days")
-    print(f"Date range: {df_agg['date'].min().date()} to {df_agg['date'].max().date()}")
-    print(f"Average daily sales: {df_agg['daily_sales'].mean():.1f}")
+    if args.per_machine or args.fleet_model:
+        if args.history:
+            matrix = SalesMatrix(args.history)
+            added = matrix.sync(args.source, profile=profile)
+            print(f"Sales matrix {matrix.path}: {added} new day(s), "
+                  f"{len(matrix.devices)} machines x {matrix.days} days")
+            df_daily = matrix.to_long()
+            df_daily = df_daily[~df_daily['device_id'].isin(MACHINES_TO_DROP)]
+        else:
+            df_daily = load_machine_daily(args.source, profile)
+
+        print("\nCreating per-machine features...")
+        df_features = create_machine_features(df_daily)
+        print(f"{len(df_features)} machine-days across {df_features['device_id'].nunique()} machines")
+
+        print()
+        if args.per_machine:
+            bundle = train_machine_models(df_features, args.clusters, args.workers, profile)
+            output = Path(args.output or MACHINE_MODELS_PATH)
+        else:
+            bundle = train_fleet_model(df_features, args.device_encoding, n_jobs=profile.threads)
+            output = Path(args.output or FLEET_MODEL_PATH)
+        joblib.dump(bundle, output, compress=3)
+
+        print("\n=== Training Complete ===")
+        print(f"Model bundle: {output} ({output.stat().st_size / 1024:.1f} KB)")
+        print(f"Peak memory: {peak_rss_mb():.0f} MB of {profile.memory_mb} MB budget")
+        return
 
-    # Create features
-    print("\nCreating features...")
-    df_features = create_features(df_agg)
+    # Daily totals and features come from the feature store
+    print(f"Loading daily features from {args.source}...")
+    store = FeatureStore(args.source, args.feature_store, profile)
+    added = store.sync()
+    df_features = store.read()
+    if store.path is not None:
+        print(f"Feature store {store.path}: {added} new day(s)")
+    print(f"Loaded {len(df_features)} days")
+    print(f"Date range: {df_features['date'].min().date()} to {df_features['date'].max().date()}")
+    print(f"Average daily sales: {df_features['daily_sales'].mean():.1f}")
+
+    if args.compare:
+        print(f"\nComparing engines ({args.folds} x 7-day walk-forward folds)...")
+        results = compare_engines(df_features, folds=args.folds, n_jobs=profile.threads)
+        print()
+        print(results.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+        print(f"\nLowest walk-forward MAE: {results['engine'].iloc[0]}")
+        return
 
     # Train model
     print()
-    model, encoder = train_model(df_features)
+    output = Path(args.output) if args.output else None
+    model, encoder = train_model(df_features, args.engine, n_jobs=profile.threads, output=output)
 
     print("\n=== Training Complete ===")
-    print(f"Model file: {MODEL_PATH} ({MODEL_PATH.stat().st_size / 1024:.1f} KB)")
-    print(f"Encoder file: {ENCODER_PATH} ({ENCODER_PATH.stat().st_size / 1024:.1f} KB)")
+    if output:
+        print(f"Candidate model: {output} ({output.stat().st_size / 1024:.1f} KB)")
+        print(f"Score it alongside production with SHADOW_MODELS={output}")
+    else:
+        print(f"Model file: {MODEL_PATH} ({MODEL_PATH.stat().st_size / 1024:.1f} KB)")
+        print(f"Encoder file: {ENCODER_PATH} ({ENCODER_PATH.stat().st_size / 1024:.1f} KB)")
+    print(f"Peak memory: {peak_rss_mb():.0f} MB of {profile.memory_mb} MB budget")
 
 
 if __name__ == "__main__":
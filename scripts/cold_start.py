@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Cold-start cost of the Python entry points.
+Each entry point is imported in a fresh interpreter (as a cron run, the daemon
+or a spawned ml/predict.py would be), and the time to get past module load is
+reported along with which heavy libraries that already pulled in.
+
+Usage:
+  python scripts/cold_start.py                          # Print the table
+  python scripts/cold_start.py --record cold_start.csv  # Also append the results for tracking
+  python scripts/cold_start.py --max-ms 300             # Exit 1 if any entry point is slower
+"""
+
+import os
+import sys
+import csv
+import json
+import argparse
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Entry point -> (directory it runs from, module name)
+ENTRY_POINTS = {
+    'rpi/sales_prediction.py': ('rpi', 'sales_prediction'),
+    'scripts/predict_sales.py': ('scripts', 'predict_sales'),
+    'ml/predict.py': ('ml', 'predict'),
+}
+
+# Libraries that should only load on the code path that needs them
+HEAVY_MODULES = ['pandas', 'numpy', 'sklearn', 'joblib', 'psycopg2', 'scipy', 'pyarrow']
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{'import_ms': elapsed, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(entry, repeat=5):
+    """
+    Best-of-`repeat` cold start of one entry point: wall time of the whole
+    process and of the module import alone, in ms, plus the heavy modules loaded.
+    """
+    directory, module = ENTRY_POINTS[entry]
+    code = PROBE.format(module=module, heavy=HEAVY_MODULES)
+    env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+
+    best = None
+    for _ in range(repeat):
+        start = datetime.now()
+        out = subprocess.run(
+            [sys.executable, '-c', code], cwd=REPO_DIR / directory, env=env,
+            capture_output=True, text=True, check=True,
+        )
+        wall_ms = (datetime.now() - start).total_seconds() * 1000
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        if best is None or wall_ms < best['wall_ms']:
+            best = {'entry': entry, 'wall_ms': wall_ms, **result}
+    return best
+
+
+def record(results, path):
+    """Append results to a CSV, one row per entry point, for tracking over time."""
+    commit = subprocess.run(
+        ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True
+    ).stdout.strip()
+    new_file = not Path(path).exists()
+    with open(path, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(['measured_at', 'commit', 'python', 'entry', 'wall_ms', 'import_ms', 'heavy'])
+        for r in results:
+            writer.writerow([
+                datetime.now().isoformat(timespec='seconds'), commit,
+                '.'.join(map(str, sys.version_info[:2])), r['entry'],
+                f"{r['wall_ms']:.0f}", f"{r['import_ms']:.0f}", ' '.join(r['heavy']),
+            ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold-start time of the Python entry points')
+    parser.add_argument('--entry', nargs='+', choices=list(ENTRY_POINTS), default=list(ENTRY_POINTS))
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh processes per entry point (best is kept)')
+    parser.add_argument('--record', type=str, help='CSV file to append the results to')
+    parser.add_argument('--max-ms', type=float, help='Fail if any entry point takes longer to start')
+    args = parser.parse_args()
+
+    results = [measure(entry, args.repeat) for entry in args.entry]
+
+    print(f"{'Entry point':<28} {'Process':>9} {'Import':>9}  Heavy modules loaded")
+    for r in results:
+        heavy = ', '.join(r['heavy']) or '-'
+        print(f"{r['entry']:<28} {r['wall_ms']:>7.0f}ms {r['import_ms']:>7.0f}ms  {heavy}")
+
+    if args.record:
+        record(results, args.record)
+        print(f"\nAppended to {args.record}")
+
+    if args.max_ms is not None:
+        slow = [r['entry'] for r in results if r['wall_ms'] > args.max_ms]
+        if slow:
+            print(f"\nOver the {args.max_ms:.0f} ms budget: {', '.join(slow)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+pandas vs Polars for daily aggregation and feature building.
+Generates a synthetic fleet history, runs each stage on both backends, checks
+the results match (up to float tolerance) and prints the timings:
+  aggregate        partial_daily + combine_daily over every order (rpi/feature_store.py)
+  group features   combine_daily by group + create_group_features
+  fleet features   create_features on the fleet-total daily series
+  machine rows     per-machine latest feature rows (ml/predict.py)
+
+Usage:
+  python scripts/feature_backends_benchmark.py                     # 2000 machines x 365 days
+  python scripts/feature_backends_benchmark.py --machines 5000 --days 730 --repeat 3
+"""
+
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR / 'rpi'))
+sys.path.insert(0, str(REPO_DIR / 'ml'))
+
+import feature_store  # noqa: E402
+import predict  # noqa: E402
+
+START = datetime(2025, 1, 1, 14, 30)
+
+
+def synthetic_orders(machines, days, orders_per_day, seed=0):
+    """Normalized orders (as data_sources.iter_orders yields) spread over machines and days."""
+    rng = np.random.default_rng(seed)
+    n = machines * days * orders_per_day
+    seconds = rng.integers(0, days * 86400, n)
+    success = rng.random(n) < 0.95
+    return pd.DataFrame({
+        'machine_sn': (852000 + rng.integers(0, machines, n)).astype(str),
+        'log_datetime': pd.Timestamp(START) + pd.to_timedelta(seconds, unit='s'),
+        'operation_outcome': np.where(success, 'Success', 'Failed'),
+        'num_dispensed': rng.integers(1, 4, n),
+        'transaction_amount': rng.integers(1, 4, n) * 2.5,
+        'refund_amount': np.where(success, 0.0, 2.5),
+        'error_code': np.where(rng.random(n) < 0.02, 7, 0),
+    })
+
+
+def synthetic_groups(machines, groups):
+    """Every machine in one group, every tenth also in a second one."""
+    device_ids = (852000 + np.arange(machines)).astype(str)
+    first = pd.DataFrame({'machine_sn': device_ids, 'group_id': [f'g{i % groups}' for i in range(machines)]})
+    second = first.iloc[::10].assign(group_id=lambda d: 'g' + ((d.index // 10 + 1) % groups).astype(str))
+    return pd.concat([first, second], ignore_index=True)
+
+
+def best_time(fn, repeat):
+    """(best wall time in seconds, last result) over `repeat` runs."""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def compare(stage, reference, candidate):
+    """Raise if the two backends' frames differ beyond float tolerance."""
+    try:
+        pd.testing.assert_frame_equal(
+            reference.reset_index(drop=True), candidate.reset_index(drop=True),
+            check_dtype=False, check_exact=False, rtol=1e-9, atol=1e-9,
+        )
+    except AssertionError as e:
+        raise SystemExit(f"{stage}: backends differ\n{e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pandas and Polars feature backends')
+    parser.add_argument('--machines', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--orders-per-day', type=int, default=4, help='Orders per machine per day')
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per stage (best is kept)')
+    args = parser.parse_args()
+
+    if feature_store.feature_backends.resolve_backend('polars') != 'polars':
+        raise SystemExit('Polars is not installed (pip install polars)')
+
+    print(f"Generating {args.machines} machines x {args.days} days x {args.orders_per_day} orders...")
+    orders = synthetic_orders(args.machines, args.days, args.orders_per_day)
+    device_groups = synthetic_groups(args.machines, args.groups)
+    print(f"{len(orders):,} orders")
+    print()
+
+    def aggregate(backend):
+        return feature_store.combine_daily([feature_store.partial_daily(orders, backend)], backend=backend)
+
+    partials = [feature_store.partial_daily(orders, 'pandas')]
+    daily = aggregate('pandas')
+    group_daily = feature_store.combine_daily(partials, device_groups, backend='pandas')
+    machine_daily = partials[0].rename(columns={'machine_sn': 'device_id', 'daily_sales': 'sold'})
+    machine_daily = machine_daily[['device_id', 'date', 'sold']].sample(frac=1, random_state=0)
+    plan = predict.plan_features(predict.BASE_FEATURES)
+
+    stages = {
+        'aggregate': aggregate,
+        'group features': lambda backend: feature_store.create_group_features(
+            feature_store.combine_daily(partials, device_groups, backend=backend), backend=backend),
+        'fleet features': lambda backend: feature_store.create_features(daily, backend=backend),
+        'machine rows': lambda backend: (
+            predict.polars_last_rows(machine_daily, plan) if backend == 'polars'
+            else predict.machine_last_rows(machine_daily.sort_values(['device_id', 'date']), plan)),
+    }
+    sizes = {
+        'aggregate': len(orders), 'group features': len(group_daily),
+        'fleet features': len(daily), 'machine rows': len(machine_daily),
+    }
+
+    print(f"{'Stage':<16} {'Input rows':>12} {'pandas':>9} {'polars':>9} {'Speedup':>8}")
+    for stage, fn in stages.items():
+        pandas_s, reference = best_time(lambda: fn('pandas'), args.repeat)
+        polars_s, candidate = best_time(lambda: fn('polars'), args.repeat)
+        compare(stage, reference, candidate)
+        print(f"{stage:<16} {sizes[stage]:>12,} {pandas_s:>8.2f}s {polars_s:>8.2f}s {pandas_s / polars_s:>7.1f}x")
+    print()
+    print("Results match within float tolerance")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,28 @@
 Sales Prediction Script for Vending Machines
 Fetches orders from PostgreSQL, generates predictions, stores results back.
 Run via GitHub Actions daily.
+
+Usage:
+  python predict_sales.py
+  python predict_sales.py --artifact-store .model-cache   # Reuse a stored model
+  python predict_sales.py --profile                       # Also write a CPU/allocation profile
 """
 
+import io
 import os
+import sys
+import json
+import time
+import hashlib
+import argparse
 import warnings
 warnings.filterwarnings('ignore')
 
-import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import joblib
 
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import OneHotEncoder
+# pandas, numpy, psycopg2, joblib and sklearn are imported by the functions
+# that use them, so --help does not load them and a restored model artifact
+# only pulls in what unpickling it needs.
 
 # Configuration
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -28,12 +35,30 @@ MACHINES_TO_DROP = ['852298', '852308', '852309', '852311']
 
 # Feature windows
 WINDOWS = [3, 7, 14]
+LAGS = [1, 7]
 TARGET_COL = 'daily_sales'
 MACHINE_COL = 'machine_sn'
 
+# Model configuration; bump FEATURE_SCHEMA_VERSION when features change
+# so stored artifacts are not reused
+MODEL_PARAMS = {'n_estimators': 200, 'random_state': 42, 'n_jobs': -1}
+FEATURE_SCHEMA_VERSION = 1
+
+# A stored model is retrained once the data has this many days it never saw,
+# or once it is this old, even if every day it did see is unchanged
+ARTIFACT_MAX_NEW_DAYS = 7
+ARTIFACT_MAX_AGE_DAYS = 7
+
+# --profile artifacts (predict_sales-<timestamp>.prof / .alloc.txt), written by rpi/run_profile.py
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.dirname(os.path.abspath(__file__)))
+
 
 def get_db_connection():
     """Create database connection from DATABASE_URL."""
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
     return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
 
 
@@ -42,6 +67,8 @@ def fetch_orders(days=30):
     Fetch orders from the last N days.
     Daily window: 10:30 PM SGT to 10:29 PM SGT next day.
     """
+    import pandas as pd
+
     conn = get_db_connection()
     cur = conn.cursor()
 
@@ -74,6 +101,8 @@ def fetch_orders(days=30):
 
 def fetch_devices():
     """Fetch all active devices."""
+    import pandas as pd
+
     conn = get_db_connection()
     cur = conn.cursor()
 
@@ -92,6 +121,8 @@ def fetch_devices():
 
 def format_orders(df):
     """Format orders from DB to match model's expected input."""
+    import pandas as pd
+
     if df.empty:
         return df
 
@@ -122,6 +153,8 @@ def aggregate_daily(df):
     Daily window: 10:30 PM SGT Day X to 10:29 PM SGT Day X+1 → labeled as Day X+1.
     Example: Jan 10 10:30 PM to Jan 11 10:29 PM SGT = "Jan 11 sales"
     """
+    import pandas as pd
+
     # Shift time and label by END date of the window
     df['adjusted_datetime'] = df['log_datetime'] - pd.Timedelta(hours=14, minutes=30)
     df['date'] = pd.to_datetime(df['adjusted_datetime'].dt.date) + pd.Timedelta(days=1)
@@ -141,6 +174,9 @@ def aggregate_daily(df):
 
 def create_features(df_agg):
     """Create features for the model (total sales level)."""
+    import pandas as pd
+    import numpy as np
+
     df_features = df_agg.copy()
 
     df_features['date'] = pd.to_datetime(df_features['date'])
@@ -155,7 +191,7 @@ def create_features(df_agg):
         df_features[f'rolling_std_{w}'] = df_features[TARGET_COL].rolling(window=w, min_periods=1).std().fillna(0)
 
     # Lag features
-    for lag in [1, 7]:
+    for lag in LAGS:
         df_features[f'lag_{lag}'] = df_features[TARGET_COL].shift(lag)
 
     # Error rate
@@ -173,6 +209,8 @@ def create_features(df_agg):
 
 def prepare_features(df, encoder=None):
     """Prepare feature matrix for prediction."""
+    import numpy as np
+
     CATEGORICALS = ['weekday', 'month']
     exclude_cols = [MACHINE_COL, 'date', TARGET_COL, 'devicename']
     feature_cols = [c for c in df.columns if c not in exclude_cols and c.lower() not in ['devicename']]
@@ -183,6 +221,7 @@ def prepare_features(df, encoder=None):
 
     # One-hot encode categoricals
     if encoder is None:
+        from sklearn.preprocessing import OneHotEncoder
         encoder = OneHotEncoder(sparse_output=False, handle_unknown='ignore')
         encoder.fit(df[CATEGORICALS])
 
@@ -195,6 +234,9 @@ def prepare_features(df, encoder=None):
 
 def train_model(df_features):
     """Train a new model on the available data."""
+    import joblib
+    from sklearn.ensemble import RandomForestRegressor
+
     print("Training new model...")
 
     # Remove rows with NaN target
@@ -206,7 +248,7 @@ def train_model(df_features):
     X, encoder, _ = prepare_features(df_train)
     y = df_train[TARGET_COL].values
 
-    model = RandomForestRegressor(n_estimators=200, random_state=42, n_jobs=-1)
+    model = RandomForestRegressor(**MODEL_PARAMS)
     model.fit(X, y)
 
     # Save model and encoder
@@ -219,6 +261,8 @@ def train_model(df_features):
 
 def load_model():
     """Load existing model or return None."""
+    import joblib
+
     if os.path.exists(MODEL_PATH) and os.path.exists(ENCODER_PATH):
         model = joblib.load(MODEL_PATH)
         encoder = joblib.load(ENCODER_PATH)
@@ -227,13 +271,209 @@ def load_model():
     return None, None
 
 
+class LocalArtifactStore:
+    """Model artifacts under a local directory: <root>/<key>/<name>."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get(self, key, name):
+        path = os.path.join(self.root, key, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def put(self, key, name, data):
+        os.makedirs(os.path.join(self.root, key), exist_ok=True)
+        tmp = os.path.join(self.root, key, name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(self.root, key, name))
+
+
+class S3ArtifactStore:
+    """Model artifacts in an object store bucket (s3://bucket/prefix), via boto3."""
+
+    def __init__(self, uri, client=None):
+        bucket, _, prefix = uri[len('s3://'):].partition('/')
+        if client is None:
+            import boto3
+            client = boto3.client('s3')
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+
+    def _key(self, key, name):
+        return '/'.join(p for p in (self.prefix, key, name) if p)
+
+    def get(self, key, name):
+        """Object bytes, or None if it does not exist; any other error is raised."""
+        from botocore.exceptions import ClientError
+
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._key(key, name))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404', 'NotFound'):
+                return None
+            raise
+        return obj['Body'].read()
+
+    def put(self, key, name, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key, name), Body=data)
+
+
+def open_artifact_store(uri):
+    """Artifact store for a local path/file:// URI or an s3:// URI."""
+    if uri.startswith('s3://'):
+        return S3ArtifactStore(uri)
+    if uri.startswith('file://'):
+        uri = uri[len('file://'):]
+    return LocalArtifactStore(uri)
+
+
+def artifact_key():
+    """
+    Content hash of everything that determines the model's shape: feature
+    schema, windows, lags, model parameters and the sklearn version.
+    """
+    from importlib.metadata import version
+    spec = {
+        'feature_schema': FEATURE_SCHEMA_VERSION,
+        'windows': WINDOWS,
+        'lags': LAGS,
+        'model': 'RandomForestRegressor',
+        'params': MODEL_PARAMS,
+        'sklearn': '.'.join(version('scikit-learn').split('.')[:2]),
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def daily_fingerprints(df_agg):
+    """Per-day hash of the aggregates the model trains on, keyed by date."""
+    return {
+        row['date'].strftime('%Y-%m-%d'): hashlib.sha256(
+            f"{row['daily_sales']}|{row['transactions']}|{row['total_amount']:.2f}".encode()
+        ).hexdigest()[:16]
+        for _, row in df_agg.iterrows()
+    }
+
+
+def _serialize(obj):
+    import joblib
+
+    buf = io.BytesIO()
+    joblib.dump(obj, buf)
+    return buf.getvalue()
+
+
+def restore_model(store, key, df_agg, now=None):
+    """
+    Restore model + encoder for this schema key if the days they were trained on
+    are unchanged in the fresh data, and the model is neither too old nor too
+    far behind it (ARTIFACT_MAX_AGE_DAYS / ARTIFACT_MAX_NEW_DAYS).
+    Returns (model, encoder, reason); model is None with the retrain reason on a miss.
+    """
+    import joblib
+
+    raw = store.get(key, 'manifest.json')
+    if raw is None:
+        return None, None, 'no artifact for this schema'
+    manifest = json.loads(raw)
+
+    # Days still inside the fetch window must match what the model saw
+    current = daily_fingerprints(df_agg)
+    for day, fingerprint in manifest['daily_fingerprints'].items():
+        if day in current and current[day] != fingerprint:
+            return None, None, f'training data changed ({day})'
+
+    # Days after the last one it was trained on; once the window has moved
+    # past the training days nothing above can differ, so this bounds staleness
+    trained_through = max(manifest['daily_fingerprints'], default='')
+    new_days = sum(day > trained_through for day in current)
+    if new_days >= ARTIFACT_MAX_NEW_DAYS:
+        return None, None, f'{new_days} days of data since it was trained (through {trained_through})'
+    age = (now or datetime.now()) - datetime.fromisoformat(manifest['trained_at'])
+    if age > timedelta(days=ARTIFACT_MAX_AGE_DAYS):
+        return None, None, f'model is {age.days} days old'
+
+    blobs = {}
+    for name in ('model.joblib', 'encoder.joblib'):
+        data = store.get(key, name)
+        if data is None or hashlib.sha256(data).hexdigest() != manifest['sha256'][name]:
+            return None, None, f'{name} missing or corrupt'
+        blobs[name] = data
+
+    model = joblib.load(io.BytesIO(blobs['model.joblib']))
+    encoder = joblib.load(io.BytesIO(blobs['encoder.joblib']))
+    return model, encoder, None
+
+
+def save_model_artifact(store, key, model, encoder, df_agg):
+    """Store model + encoder with a manifest of content hashes and training days."""
+    blobs = {'model.joblib': _serialize(model), 'encoder.joblib': _serialize(encoder)}
+    for name, data in blobs.items():
+        store.put(key, name, data)
+
+    manifest = {
+        'key': key,
+        'trained_at': datetime.now().isoformat(),
+        'sha256': {name: hashlib.sha256(data).hexdigest() for name, data in blobs.items()},
+        'daily_fingerprints': daily_fingerprints(df_agg),
+    }
+    # Manifest last, so a partial upload never looks like a valid artifact
+    store.put(key, 'manifest.json', json.dumps(manifest, indent=2).encode())
+
+
+def load_or_train_model(df_agg, df_features, store_uri=None):
+    """
+    Get a model for this run. With an artifact store, a stored model is reused
+    until the schema or its training data changes; otherwise falls back to the
+    local model files, training only when they are missing.
+    """
+    if not store_uri:
+        model, encoder = load_model()
+        if model is None:
+            model, encoder = train_model(df_features)
+        return model, encoder
+
+    store = open_artifact_store(store_uri)
+    key = artifact_key()
+
+    start = time.perf_counter()
+    try:
+        model, encoder, reason = restore_model(store, key, df_agg)
+    except Exception as e:
+        # Not a miss: credentials, network or permissions. Say so instead of
+        # quietly retraining every night
+        print(f"WARNING: Model artifact store unavailable: {e}")
+        model, encoder, reason = None, None, 'artifact store error'
+    if model is not None:
+        print(f"Model artifact: cache hit (key {key}, restored in {time.perf_counter() - start:.2f}s)")
+        return model, encoder
+
+    print(f"Model artifact: retrain ({reason}, key {key})")
+    start = time.perf_counter()
+    model, encoder = train_model(df_features)
+    trained = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        save_model_artifact(store, key, model, encoder, df_agg)
+    except Exception as e:
+        print(f"WARNING: Could not store the model artifact: {e}")
+        return model, encoder
+    print(f"Model artifact: trained in {trained:.2f}s, stored in {time.perf_counter() - start:.2f}s")
+    return model, encoder
+
+
 def generate_predictions(df_features, model, encoder):
     """Generate prediction for the next day (total sales level)."""
     # Get the last row (most recent day's data)
     last_row = df_features.sort_values('date').iloc[[-1]].copy()
 
     # Use current values as lag placeholders for next day prediction
-    for lag in [1, 7]:
+    for lag in LAGS:
         last_row[f'lag_{lag}'] = last_row[TARGET_COL].values[0]
 
     # Increment date features for next day
@@ -255,6 +495,8 @@ def generate_predictions(df_features, model, encoder):
 
 def save_predictions(prediction_row):
     """Save total prediction to database."""
+    import pandas as pd
+
     conn = get_db_connection()
     cur = conn.cursor()
 
@@ -320,6 +562,20 @@ def update_actual_sales():
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Sales prediction for vending machines')
+    parser.add_argument('--artifact-store', type=str, default=os.environ.get('MODEL_ARTIFACT_STORE'),
+                        help='Model artifact store: local directory or s3://bucket/prefix '
+                             '(default: $MODEL_ARTIFACT_STORE)')
+    parser.add_argument('--profile', action='store_true',
+                        help=f'Write a CPU profile and allocation snapshot to {PROFILE_DIR} ($PROFILE_DIR)')
+    args = parser.parse_args()
+
+    if args.profile:
+        # Runs from a repo checkout, so the rpi/ profiler is importable
+        sys.path.insert(0, os.path.join(REPO_DIR, 'rpi'))
+        from run_profile import start_profiling
+        start_profiling('predict_sales', PROFILE_DIR)
+
     print(f"Starting sales prediction at {datetime.now()}")
     print("-" * 50)
 
@@ -346,9 +602,7 @@ def main():
     df_features = create_features(df_agg)
 
     # Step 5: Load or train model
-    model, encoder = load_model()
-    if model is None:
-        model, encoder = train_model(df_features)
+    model, encoder = load_or_train_model(df_agg, df_features, args.artifact_store)
 
     # Step 6: Generate prediction
     print("Generating prediction...")